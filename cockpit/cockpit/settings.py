@@ -1,4 +1,5 @@
 from pathlib import Path
+import importlib.util
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,9 +41,57 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'crm.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
 }
 
+# Fraction of requests whose latency and SQL are recorded (Server-Timing header, /metrics); 0 turns it off
+CRM_METRICS_SAMPLE_RATE = float(os.environ.get('CRM_METRICS_SAMPLE_RATE', 1.0))
+# Client addresses allowed to scrape /metrics (comma-separated); staff users always are, everyone else gets 403
+CRM_METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('CRM_METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# Rows fetched per server-side cursor round trip for ?format=ndjson streams
+CRM_STREAM_CHUNK_SIZE = int(os.environ.get('CRM_STREAM_CHUNK_SIZE', 2000))
+
+# Digest for new EntityDetail.hashdiff values ('blake2b' or 'sha256'); see rehash_details to convert stored ones
+CRM_HASHDIFF_SCHEME = os.environ.get('CRM_HASHDIFF_SCHEME', 'blake2b')
+
+# 'buffered': audit rows are written with one insert per service call, inside its transaction.
+# 'spool': one AuditSpool row per transaction instead, moved into AuditLog by drain_audit_spool.
+CRM_AUDIT_MODE = os.environ.get('CRM_AUDIT_MODE', 'buffered')
+
+# AuditLog is partitioned by month: maintain_audit_partitions keeps AHEAD months created in advance and
+# detaches partitions older than RETENTION_MONTHS (unset: keep everything).
+CRM_AUDIT_PARTITIONS_AHEAD = int(os.environ.get('CRM_AUDIT_PARTITIONS_AHEAD', 3))
+CRM_AUDIT_RETENTION_MONTHS = int(os.environ['CRM_AUDIT_RETENTION_MONTHS']) if os.environ.get('CRM_AUDIT_RETENTION_MONTHS') else None
+
+# /changes long-poll: longest ?wait= accepted, and how often a waiting request rereads without a notification.
+CRM_CHANGES_MAX_WAIT_SECONDS = int(os.environ.get('CRM_CHANGES_MAX_WAIT_SECONDS', 30))
+CRM_CHANGES_RECHECK_SECONDS = float(os.environ.get('CRM_CHANGES_RECHECK_SECONDS', 1.0))
+
+# SCD2 writes take an advisory lock on each entity's lock bucket (crm.locking) so concurrent writers of one
+# entity queue instead of failing on unique_current_entity / the exclusion constraints.
+CRM_WRITE_LOCKS = os.environ.get('CRM_WRITE_LOCKS', 'true').lower() not in ('0', 'false', 'no')
+# Entities hash into this many lock buckets, the most advisory locks one write transaction takes.
+# Fewer buckets spare the server's shared lock table; more make unrelated writers collide less.
+CRM_WRITE_LOCK_BUCKETS = int(os.environ.get('CRM_WRITE_LOCK_BUCKETS', 1024))
+
+# >0: single-entity API writes wait this long in a per-process queue, so a burst of writes to one entity
+# becomes one version (crm.coalesce). Adds up to this much latency to each write.
+CRM_WRITE_COALESCE_MS = int(os.environ.get('CRM_WRITE_COALESCE_MS', 0))
+
+# POST /entities/bulk: most entities accepted per request, and how many are applied per transaction.
+CRM_BULK_MAX_ITEMS = int(os.environ.get('CRM_BULK_MAX_ITEMS', 10000))
+CRM_BULK_TRANSACTION_SIZE = int(os.environ.get('CRM_BULK_TRANSACTION_SIZE', 1000))
+
+# refresh_snapshots: wait for writes to go quiet before reconciling, but never lag more than MAX_LAG;
+# each delta rescans OVERLAP seconds before the high-water mark to catch late-committing transactions.
+CRM_SNAPSHOT_QUIET_SECONDS = int(os.environ.get('CRM_SNAPSHOT_QUIET_SECONDS', 30))
+CRM_SNAPSHOT_MAX_LAG_SECONDS = int(os.environ.get('CRM_SNAPSHOT_MAX_LAG_SECONDS', 300))
+CRM_SNAPSHOT_OVERLAP_SECONDS = int(os.environ.get('CRM_SNAPSHOT_OVERLAP_SECONDS', 60))
+
 MIDDLEWARE = [
+    'crm.metrics.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +135,34 @@ DATABASES = {
     }
 }
 
+# Each process keeps a psycopg 3 pool of DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE open connections, so requests
+# skip the connect; one waits up to DB_POOL_TIMEOUT seconds for a free connection. Size the pool for the
+# concurrent queries of a process (async views hold a connection only while a query runs), not its clients.
+# Without psycopg_pool (or with DB_POOL=false) connections are kept open for DB_CONN_MAX_AGE seconds instead.
+if os.environ.get('DB_POOL', 'true').lower() not in ('0', 'false', 'no') and importlib.util.find_spec('psycopg_pool'):
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Use a shared backend (Redis, Memcached) when running several processes: locmem is per process,
+# so write invalidation only reaches the process that wrote and the others wait for the timeout.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Seconds a serialized entity stays cached for GET /entities/<uid>; writes invalidate it on commit
+CRM_ENTITY_CACHE_TIMEOUT = int(os.environ.get('CRM_ENTITY_CACHE_TIMEOUT', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
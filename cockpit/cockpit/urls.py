@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
+from crm.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/v1/', include('crm.urls'))
+    path('api/v1/', include('crm.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
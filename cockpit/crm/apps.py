@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
+
+    def ready(self):
+        from . import lookups  # noqa: F401
+        from .entity_types import entity_type_changed
+        from .metrics import install_query_recorder
+        from .models import EntityType
+
+        post_save.connect(entity_type_changed, sender=EntityType, dispatch_uid='crm_entity_type_saved')
+        post_delete.connect(entity_type_changed, sender=EntityType, dispatch_uid='crm_entity_type_deleted')
+        connection_created.connect(install_query_recorder, dispatch_uid='crm_query_recorder')
@@ -0,0 +1,163 @@
+"""
+Async (ASGI) versions of the read endpoints, served under /api/v1/async/.
+
+They query through Django's async ORM, so a worker process serves many slow clients at once and
+holds a pooled database connection only while a query runs. DRF views are synchronous, so these
+are plain Django views: token authentication, the query parameters and the response bodies match
+the DRF views they mirror.
+"""
+import functools
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+from .audit import audit_summary
+from .entity_cache import aget_cached_entity, etag_matches
+from .models import Entity
+from .pagination import KeysetPagination, SummaryPagination
+from .renderers import NDJSONRenderer
+from .serializers import EntitySerializer
+from .services import aload_details_by_uid
+from .views import (audit_row, diff_queryset, history_detail_row, history_querysets, parse_point_in_time,
+                    stream_chunk_size, wants_summary)
+
+
+def json_response(data, status=200, headers=None):
+    return JsonResponse(data, encoder=JSONEncoder, safe=False, status=status, headers=headers)
+
+
+def error_response(message, status=400):
+    return json_response({'error': message}, status=status)
+
+
+def wants_ndjson(request):
+    return request.GET.get('format') == 'ndjson' or NDJSONRenderer.media_type in request.headers.get('Accept', '')
+
+
+async def stream_ndjson(rows):
+    encode = JSONEncoder().encode
+    return StreamingHttpResponse((encode(row) + '\n' async for row in rows), content_type=NDJSONRenderer.media_type)
+
+
+async def authenticate(request):
+    """The active user of an "Authorization: Token <key>" header, as DRF's TokenAuthentication finds it."""
+    scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'token' or not key.strip():
+        return None
+    token = await Token.objects.select_related('user').filter(key=key.strip()).afirst()
+    return token.user if token and token.user.is_active else None
+
+
+def token_required(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await authenticate(request)
+        if user is None:
+            return json_response({'detail': 'Authentication credentials were not provided.'}, status=401,
+                                 headers={'WWW-Authenticate': 'Token'})
+        request.user = user
+        try:
+            return await view(request, *args, **kwargs)
+        except NotFound as exc:
+            return json_response({'detail': exc.detail}, status=404)
+    return require_GET(wrapper)
+
+
+async def serialize_entities(entities, as_of=None):
+    details_by_uid = await aload_details_by_uid([e.entity_uid for e in entities], as_of=as_of)
+    context = {'as_of': as_of, 'details_by_uid': details_by_uid}
+    # The entity type lookups may have to load the registry, which is synchronous.
+    return await sync_to_async(lambda: EntitySerializer(entities, many=True, context=context).data)()
+
+
+@token_required
+async def entity_detail(request, entity_uid):
+    async def build():
+        entity = await Entity.objects.filter(entity_uid=entity_uid, is_current=True).afirst()
+        return (await serialize_entities([entity]))[0] if entity else None
+
+    cached = await aget_cached_entity(entity_uid, build)
+    if cached is None:
+        return json_response({'detail': 'Not found'}, status=404)
+    etag = quote_etag(cached['etag'])
+    if etag_matches(request, etag):
+        return HttpResponse(status=304, headers={'ETag': etag})
+    return json_response(cached['data'], headers={'ETag': etag})
+
+
+@token_required
+async def entity_history(request, entity_uid):
+    entities, details, error = history_querysets(entity_uid, request.GET)
+    if error:
+        return error_response(error)
+    entities = [entity async for entity in entities]
+    return json_response({
+        'entities': await serialize_entities(entities),
+        'details': [history_detail_row(d) async for d in details],
+    })
+
+
+@token_required
+async def entities_as_of(request):
+    if not request.GET.get('as_of'):
+        return error_response('as_of parameter required')
+    as_of = parse_point_in_time(request.GET['as_of'])
+    if as_of is None:
+        return error_response('Invalid date format')
+
+    qs = Entity.objects.as_of(as_of)
+    if wants_ndjson(request):
+        return await stream_ndjson(iter_snapshot(qs.order_by('valid_from', 'id'), as_of))
+    paginator = KeysetPagination(ordering=('-valid_from', '-id'))
+    page = paginator.finish_page([e async for e in paginator.page_queryset(qs, Request(request))])
+    return json_response({'next': paginator.get_next_link(), 'results': await serialize_entities(page, as_of)})
+
+
+async def iter_snapshot(qs, as_of):
+    chunk_size = stream_chunk_size()
+    chunk = []
+    async for entity in qs.aiterator(chunk_size=chunk_size):
+        chunk.append(entity)
+        if len(chunk) == chunk_size:
+            for row in await serialize_entities(chunk, as_of):
+                yield row
+            chunk = []
+    if chunk:
+        for row in await serialize_entities(chunk, as_of):
+            yield row
+
+
+@token_required
+async def diff(request):
+    logs, error = diff_queryset(request.GET)
+    if error:
+        return error_response(error)
+
+    if wants_summary(request.GET):
+        # The summary is one raw SQL statement; the async ORM has no raw cursor, so it runs in a thread.
+        if wants_ndjson(request):
+            return await stream_ndjson(iter_summary(logs))
+        paginator = SummaryPagination()
+        fetch = sync_to_async(lambda: paginator.paginate_rows(
+            lambda after, limit: audit_summary(logs, after=after, limit=limit), Request(request)))
+        page = await fetch()
+        return json_response({'next': paginator.get_next_link(), 'results': page})
+    if wants_ndjson(request):
+        rows = logs.order_by('timestamp', 'id').aiterator(chunk_size=stream_chunk_size())
+        return await stream_ndjson(audit_row(log) async for log in rows)
+    paginator = KeysetPagination(ordering=('timestamp', 'id'))
+    page = paginator.finish_page([log async for log in paginator.page_queryset(logs, Request(request))])
+    return json_response({'next': paginator.get_next_link(), 'results': [audit_row(log) for log in page]})
+
+
+async def iter_summary(logs):
+    chunk_size = stream_chunk_size()
+    after = None
+    while rows := await sync_to_async(audit_summary)(logs, after=after, limit=chunk_size):
+        for row in rows:
+            yield row
+        after = rows[-1]['entity_uid'], rows[-1]['detail_code']
@@ -0,0 +1,166 @@
+import functools
+import json
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from crm.models import AuditLog, AuditSpool
+
+AUDIT_FIELDS = ('actor', 'action', 'entity_uid', 'detail_code', 'before', 'after')
+
+# Moves the oldest spooled batches into crm_auditlog in one statement: a batch is deleted from the
+# spool only together with the insert of its entries. SKIP LOCKED lets several drainers run at once.
+DRAIN_SPOOL_SQL = """
+WITH batch AS (
+    DELETE FROM crm_auditspool
+    WHERE id IN (SELECT id FROM crm_auditspool ORDER BY id LIMIT %(limit)s FOR UPDATE SKIP LOCKED)
+    RETURNING id, entries
+)
+INSERT INTO crm_auditlog (actor, action, entity_uid, detail_code, before, after, timestamp)
+SELECT e.actor, e.action, e.entity_uid, e.detail_code, e.before, e.after, e.timestamp
+FROM batch
+CROSS JOIN LATERAL ROWS FROM (jsonb_to_recordset(batch.entries) AS (
+    actor text, action text, entity_uid uuid, detail_code text, before jsonb, after jsonb, timestamp timestamptz
+)) WITH ORDINALITY AS e(actor, action, entity_uid, detail_code, before, after, timestamp, n)
+ORDER BY batch.id, e.n
+"""
+
+# Net change per (entity_uid, detail_code): every window runs over the group's whole frame, ordered as
+# the rows were written, so the group's first row (n = 1) carries the group's first before and last after.
+SUMMARY_SQL = """
+SELECT entity_uid, detail_code, first_before::text, last_after::text, changes, first_at, last_at
+FROM (
+    SELECT l.entity_uid, l.detail_code,
+           first_value(l.before) OVER w AS first_before,
+           last_value(l.after) OVER w AS last_after,
+           count(*) OVER w AS changes,
+           first_value(l.timestamp) OVER w AS first_at,
+           last_value(l.timestamp) OVER w AS last_at,
+           row_number() OVER w AS n
+    FROM ({logs}) AS l
+    WINDOW w AS (PARTITION BY l.entity_uid, l.detail_code ORDER BY l.timestamp, l.id
+                 ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+) AS net
+WHERE n = 1 AND first_before IS DISTINCT FROM last_after
+ORDER BY entity_uid, detail_code NULLS FIRST
+"""
+
+
+def audit_mode():
+    return getattr(settings, 'CRM_AUDIT_MODE', 'buffered')
+
+
+class AuditWriter:
+    """
+    Collects AuditLog rows while a batched() block runs and writes them with one insert when the
+    outermost block exits - still inside the caller's transaction, so the audit rows commit or roll
+    back with the changes they describe. Rows added outside a batch are written immediately.
+
+    Rows added inside a savepoint that was rolled back are dropped at flush: each add registers an
+    on_commit marker, and Django discards the markers of rolled-back savepoints.
+
+    In 'spool' mode the flush is a single AuditSpool row instead; drain_spool() moves it into AuditLog.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _buffer(self):
+        if not hasattr(self._local, 'groups'):
+            self._local.groups = []
+            self._local.depth = 0
+        return self._local.groups
+
+    @contextmanager
+    def batch(self):
+        groups = self._buffer()
+        start = len(groups)
+        self._local.depth += 1
+        try:
+            yield
+        except BaseException:
+            del groups[start:]
+            raise
+        finally:
+            self._local.depth -= 1
+        if self._local.depth == 0:
+            self.flush()
+
+    def batched(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.batch():
+                return func(*args, **kwargs)
+        return wrapper
+
+    def add(self, *logs):
+        marker = None
+        if connection.in_atomic_block:
+            marker = lambda: None  # noqa: E731
+            transaction.on_commit(marker)
+        self._buffer().append((marker, logs))
+        if self._local.depth == 0:
+            self.flush()
+
+    def flush(self):
+        groups = self._buffer()
+        if not groups:
+            return
+        self._local.groups = []
+        pending = {id(entry[1]) for entry in connection.run_on_commit}
+        entries = [log for marker, logs in groups if marker is None or id(marker) in pending for log in logs]
+        if not entries:
+            return
+        if audit_mode() == 'spool':
+            now = timezone.now()
+            AuditSpool.objects.create(entries=[
+                dict({field: getattr(log, field) for field in AUDIT_FIELDS}, timestamp=now) for log in entries
+            ])
+        else:
+            AuditLog.objects.bulk_create(entries, batch_size=1000)
+
+
+audit_writer = AuditWriter()
+
+
+def drain_spool(batch_size=500):
+    """Move up to batch_size spooled transactions into AuditLog. Returns the number of AuditLog rows written."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(DRAIN_SPOOL_SQL, {'limit': batch_size})
+        return cursor.rowcount
+
+
+def audit_summary(logs, after=None, limit=None):
+    """
+    Net change per (entity_uid, detail_code) over the AuditLog rows of the logs queryset: the first
+    row's before and the last row's after, with the number of rows and their time span. Groups that
+    ended where they started are left out. Rows are ordered by (entity_uid, detail_code), null
+    detail_code (entity-level changes) first, and start after the key after when given.
+    """
+    logs = logs.filter(entity_uid__isnull=False).order_by()
+    if after is not None:
+        # Whole groups are skipped, so the windows still see every row of the groups that remain.
+        uid, code = after
+        same_entity = Q(entity_uid=uid, detail_code__isnull=False) if code is None else Q(entity_uid=uid, detail_code__gt=code)
+        logs = logs.filter(Q(entity_uid__gt=uid) | same_entity)
+    sql, params = logs.values('id', 'entity_uid', 'detail_code', 'before', 'after', 'timestamp').query.sql_with_params()
+    sql = SUMMARY_SQL.format(logs=sql)
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params = (*params, limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [
+            {
+                'entity_uid': uid,
+                'detail_code': code,
+                'before': None if before is None else json.loads(before),
+                'after': None if after_ is None else json.loads(after_),
+                'changes': changes,
+                'first_timestamp': first_at,
+                'last_timestamp': last_at,
+            }
+            for uid, code, before, after_, changes, first_at, last_at in cursor.fetchall()
+        ]
@@ -0,0 +1,399 @@
+import datetime
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from crm.coalesce import WriteCoalescer
+from crm.entity_cache import entity_generation_key
+from crm.hashdiff import hashdiff_many, legacy_hashdiff
+from crm.loader import load_file
+from crm.models import AuditLog, Entity, EntityDetail, EntitySnapshot, EntityType
+from crm.services import scd2_bulk_upsert, scd2_upsert_entity
+
+BENCH_ENTITY_TYPE = 'BENCH'
+BENCH_START = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+SEED_ENTITY_HISTORY_SQL = """
+INSERT INTO crm_entity (entity_uid, entity_type_id, display_name, valid_from, valid_to, is_current, created_at, updated_at)
+SELECT md5('bench-' || e)::uuid,
+       %(entity_type_id)s,
+       'Bench entity ' || e || ' v' || v,
+       %(start)s + v * %(step)s + (e %% 1440) * interval '1 minute',
+       CASE WHEN v < %(versions)s - 1 THEN %(start)s + (v + 1) * %(step)s + (e %% 1440) * interval '1 minute' END,
+       v = %(versions)s - 1,
+       now(), now()
+FROM generate_series(%(first)s, %(last)s) AS e
+CROSS JOIN generate_series(0, %(versions)s - 1) AS v
+"""
+
+
+def _timed(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'min_ms': round(samples[0], 3),
+    }
+
+
+def _plan_scans(qs):
+    return [line.strip(' ->') for line in qs.explain().splitlines() if 'Scan' in line]
+
+
+def seed_entity_history(entities, versions, step=datetime.timedelta(days=1), chunk=50000):
+    entity_type, _ = EntityType.objects.get_or_create(code=BENCH_ENTITY_TYPE)
+    with connection.cursor() as cursor:
+        for first in range(0, entities, chunk):
+            cursor.execute(SEED_ENTITY_HISTORY_SQL, {
+                'entity_type_id': entity_type.pk,
+                'start': BENCH_START,
+                'step': step,
+                'versions': versions,
+                'first': first,
+                'last': min(first + chunk, entities) - 1,
+            })
+        cursor.execute('ANALYZE crm_entity')
+    return entity_type
+
+
+def drop_bench_data():
+    entity_type = EntityType.objects.filter(code=BENCH_ENTITY_TYPE).first()
+    if entity_type:
+        uids = Entity.objects.filter(entity_type=entity_type).values('entity_uid')
+        for model in (AuditLog, EntitySnapshot, EntityDetail):
+            model.objects.filter(entity_uid__in=uids).delete()
+        Entity.objects.filter(entity_type=entity_type).delete()
+        entity_type.delete()
+
+
+def bench_asof(versions, step=datetime.timedelta(days=1), repeats=20, page_size=100, seed=0):
+    """
+    Compare the legacy as-of predicate with GiST range containment on the bench rows.
+    Both queries fetch the first keyset page and count the full snapshot at random points in time.
+    """
+    entity_type = EntityType.objects.get(code=BENCH_ENTITY_TYPE)
+    rnd = random.Random(seed)
+    horizon = step.total_seconds() * versions
+    points = [BENCH_START + datetime.timedelta(seconds=rnd.uniform(0, horizon)) for _ in range(repeats)]
+    base = Entity.objects.filter(entity_type=entity_type)
+
+    # Each variant as the as-of endpoint ran it: the full snapshot and its first keyset page.
+    def legacy(ts):
+        return base.filter(valid_from__lte=ts).filter(Q(valid_to__isnull=True) | Q(valid_to__gte=ts))
+
+    def legacy_page(ts):
+        return legacy(ts).order_by('valid_from', 'id')[:page_size]
+
+    def ranged(ts):
+        return base.as_of(ts)
+
+    def ranged_page(ts):
+        return ranged(ts).order_by('-valid_from', '-id')[:page_size]
+
+    results = {}
+    for name, build, build_page in (('legacy', legacy, legacy_page), ('range', ranged, ranged_page)):
+        it = iter(points)
+        count_samples = _timed(lambda: build(next(it)).count(), repeats)
+        it = iter(points)
+        page_samples = _timed(lambda: list(build_page(next(it))), repeats)
+        results[name] = {
+            'count': _summary(count_samples),
+            'first_page': _summary(page_samples),
+            'plan': _plan_scans(build(points[0])),
+            'page_plan': _plan_scans(build_page(points[0])),
+        }
+    results['rows'] = base.count()
+    return results
+
+
+# Business values (the part of a detail value its hashdiff covers) shaped like production details.
+HASHDIFF_PAYLOADS = {
+    'email': 'olena.kovalenko@example.com',
+    'address': {'street': 'Khreshchatyk 22', 'city': 'Kyiv', 'zip': '01001', 'country': 'UA',
+                'geo': {'lat': 50.4501, 'lon': 30.5234}},
+    'phones': [{'type': 'mobile', 'number': '+380501234567', 'primary': True},
+               {'type': 'work', 'number': '+380442345678', 'primary': False, 'ext': 12}],
+}
+
+
+def _vary(value, i):
+    if isinstance(value, dict):
+        return {**value, 'seq': i}
+    if isinstance(value, list):
+        return [*value, i]
+    return f'{i}.{value}'
+
+
+def bench_hashdiff(count=100000, repeats=5):
+    """Hashes per second of the legacy str()-based hash and of each scheme over realistic payloads."""
+    variants = {
+        'legacy_sha256': lambda values: [legacy_hashdiff(value) for value in values],
+        'sha256': lambda values: hashdiff_many(values, 'sha256'),
+        'blake2b': lambda values: hashdiff_many(values, 'blake2b'),
+    }
+    results = {}
+    for payload, value in HASHDIFF_PAYLOADS.items():
+        values = [_vary(value, i) for i in range(count)]
+        results[payload] = {}
+        for name, fn in variants.items():
+            best_ms = min(_timed(lambda: fn(values), repeats))
+            results[payload][name] = {'hashes_per_sec': round(count / best_ms * 1000), 'best_ms': round(best_ms, 3)}
+    return results
+
+
+def bench_concurrent_writes(threads=8, writes=50, entities=1, locks=True, coalesce_ms=0):
+    """
+    threads writers each apply `writes` display-name updates spread over `entities` hot entities.
+    Reports throughput, the share of writes that failed (conflicts: unique/exclusion violations,
+    deadlocks) and how many versions were written. Runs with CRM_WRITE_LOCKS = locks; with
+    coalesce_ms > 0 the writes go through a WriteCoalescer. Bench rows are removed afterwards.
+    """
+    uids = [uuid.uuid4() for _ in range(entities)]
+    coalescer = WriteCoalescer(window=coalesce_ms / 1000, idle_timeout=0.5) if coalesce_ms else None
+    errors = []
+
+    def writer(index):
+        try:
+            for n in range(writes):
+                uid, name = uids[(index + n) % entities], f'Bench writer {index} #{n}'
+                try:
+                    if coalescer:
+                        coalescer.submit({'entity_uid': uid, 'entity_type': BENCH_ENTITY_TYPE, 'display_name': name},
+                                         actor='bench').result()
+                    else:
+                        scd2_upsert_entity(uid, BENCH_ENTITY_TYPE, name, actor='bench')
+                except DatabaseError as exc:
+                    errors.append(type(exc).__name__)
+        finally:
+            connection.close()
+
+    with override_settings(CRM_WRITE_LOCKS=locks):
+        workers = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+    total = threads * writes
+    versions = Entity.objects.filter(entity_uid__in=uids).count()
+    current = Entity.objects.filter(entity_uid__in=uids, is_current=True).count()
+    AuditLog.objects.filter(entity_uid__in=uids).delete()
+    EntitySnapshot.objects.filter(entity_uid__in=uids).delete()
+    EntityDetail.objects.filter(entity_uid__in=uids).delete()
+    Entity.objects.filter(entity_uid__in=uids).delete()
+    return {
+        'writes': total,
+        'seconds': round(elapsed, 3),
+        'writes_per_sec': round(total / elapsed),
+        'conflicts': len(errors),
+        'conflict_rate': round(len(errors) / total, 4),
+        'errors': sorted(set(errors)),
+        'versions': versions,
+        'current_rows': current,
+    }
+
+
+def bench_uids(count, seed):
+    rnd = random.Random(seed)
+    return [uuid.UUID(int=rnd.getrandbits(128), version=4) for _ in range(count)]
+
+
+def bench_record(uid, version, details):
+    tag = f'{uid.hex[:8]}-v{version}'
+    return {
+        'entity_uid': uid,
+        'entity_type': BENCH_ENTITY_TYPE,
+        'display_name': f'Bench entity {tag}',
+        'details': [{'detail_code': f'BENCH_{d}', 'value': {'value': f'{tag}-{d}'}} for d in range(details)],
+    }
+
+
+def seed_bench_dataset(uids, details, versions, batch_size=1000):
+    """Write every uid as `versions` SCD2 versions with `details` details each, through scd2_bulk_upsert."""
+    started = time.perf_counter()
+    for version in range(versions):
+        for first in range(0, len(uids), batch_size):
+            scd2_bulk_upsert([bench_record(uid, version, details) for uid in uids[first:first + batch_size]],
+                             actor='bench')
+    elapsed = time.perf_counter() - started
+    return {'rows': len(uids) * versions, 'rows_per_sec': round(len(uids) * versions / elapsed)}
+
+
+def _measured(fn, calls):
+    """Latency summary, total time and median query count of fn(arg) over the calls' args."""
+    samples, queries = [], []
+    for arg in calls:
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            fn(arg)
+            samples.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+    return dict(_summary(samples), total_ms=round(sum(samples), 3), calls=len(samples),
+                queries=statistics.median_high(queries))
+
+
+def bench_upserts(uids, details, versions, writes=300, mix=(0.2, 0.6, 0.2), seed=0):
+    """
+    writes scd2_upsert_entity calls split by mix into inserts (new entities), updates (new name and
+    details) and no-ops (the current state again) of seeded entities. Updates and no-ops touch
+    distinct entities, so uids must hold at least that many.
+    """
+    rnd = random.Random(seed)
+    counts = dict(zip(('insert', 'update', 'noop'), (round(writes * share) for share in mix)))
+    if counts['update'] + counts['noop'] > len(uids):
+        raise ValueError(f"{counts['update'] + counts['noop']} updates and no-ops need as many seeded entities")
+    targets = rnd.sample(uids, counts['update'] + counts['noop'])
+    records = {
+        'insert': [bench_record(uid, 0, details) for uid in bench_uids(counts['insert'], seed + 1)],
+        'update': [bench_record(uid, versions, details) for uid in targets[:counts['update']]],
+        'noop': [bench_record(uid, versions - 1, details) for uid in targets[counts['update']:]],
+    }
+
+    def upsert(record):
+        scd2_upsert_entity(record['entity_uid'], record['entity_type'], record['display_name'],
+                           details=record['details'], actor='bench')
+
+    results = {}
+    for kind, batch in records.items():
+        if batch:
+            result = _measured(upsert, batch)
+            results[kind] = dict(result, writes_per_sec=round(len(batch) / result['total_ms'] * 1000))
+    return results
+
+
+def bench_reads(uids, window, repeats=20, page_size=100, seed=0):
+    """Latency and query count of the read endpoints, serializers included, over the bench entities."""
+    rnd = random.Random(seed)
+    start, end = window
+    client = APIClient()
+    # An unsaved user: authentication is not what is measured.
+    client.force_authenticate(User(username='bench'))
+    points = [start + (end - start) * rnd.random() for _ in range(repeats)]
+    sample = [rnd.choice(uids) for _ in range(repeats)]
+    period = {'from': start.isoformat(), 'to': end.isoformat(), 'limit': page_size}
+
+    def get(name, args=(), params=None):
+        response = client.get(reverse(name, args=args), params)
+        if response.status_code != 200:
+            raise RuntimeError(f'{name} returned {response.status_code}')
+
+    def detail(uid):
+        cache.delete(entity_generation_key(uid))
+        get('entity-detail', [uid])
+
+    # The test client's host, as the test runner allows it.
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        return {
+            'detail': _measured(detail, sample),
+            'list': _measured(lambda _: get('entity-list', params={'limit': page_size}), range(repeats)),
+            'history': _measured(lambda uid: get('entity-history', [uid]), sample),
+            'asof': _measured(lambda ts: get('entity-asof', params={'as_of': ts.isoformat(), 'limit': page_size}),
+                              points),
+            'diff': _measured(lambda _: get('entity-diff', params=period), range(repeats)),
+            'diff_summary': _measured(lambda uid: get('entity-diff', params={**period, 'summary': 'true',
+                                                                              'entity_uid': str(uid)}), sample),
+        }
+
+
+def bench_loader(rows, details, seed=0, batch_size=1000):
+    """Rows per second of load_file for new entities and for the same file again (all no-ops), per merge path."""
+    results = {}
+    for offset, (name, stream) in enumerate((('copy', True), ('orm', False))):
+        uids = bench_uids(rows, seed + 2 + offset)
+        fd, path = tempfile.mkstemp(suffix='.ndjson')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for uid in uids:
+                    f.write(json.dumps(bench_record(uid, 0, details), default=str) + '\n')
+            for phase in ('insert', 'noop'):
+                started = time.perf_counter()
+                load_file(path, stream=stream, batch_size=batch_size, actor='bench')
+                results[f'{name}_{phase}'] = {'rows': rows, 'rows_per_sec': round(rows / (time.perf_counter() - started))}
+        finally:
+            os.remove(path)
+    return results
+
+
+def run_suite(entities=1000, details=3, versions=5, writes=300, mix=(0.2, 0.6, 0.2), repeats=20, loader_rows=2000,
+              seed=0):
+    """
+    Seed a fresh synthetic BENCH dataset and measure writes, reads and the loader on it. Same
+    arguments, same data: uids, values and samples all derive from seed. Leaves the BENCH rows
+    in place; drop_bench_data() removes them.
+    """
+    uids = bench_uids(entities, seed)
+    results = {}
+    drop_bench_data()
+    started = datetime.datetime.now(datetime.timezone.utc)
+    results['seed'] = seed_bench_dataset(uids, details, versions)
+    window = (started, datetime.datetime.now(datetime.timezone.utc))
+    results['reads'] = bench_reads(uids, window, repeats=repeats, seed=seed)
+    results['upsert'] = bench_upserts(uids, details, versions, writes=writes, mix=mix, seed=seed)
+    results['loader'] = bench_loader(loader_rows, details, seed=seed)
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW server_version')
+        server_version = cursor.fetchone()[0]
+    return {
+        'meta': {
+            'started_at': started.isoformat(),
+            'params': {'entities': entities, 'details': details, 'versions': versions, 'writes': writes,
+                       'mix': list(mix), 'repeats': repeats, 'loader_rows': loader_rows, 'seed': seed},
+            'postgres': server_version,
+            'django': django.get_version(),
+        },
+        'results': results,
+    }
+
+
+def _flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare_results(baseline, current, tolerance=0.25):
+    """
+    Regressions of current against baseline (both run_suite() output), as readable strings:
+    median latencies or throughputs worse by more than tolerance, and any increase in query counts.
+    """
+    old, new = _flatten(baseline['results']), _flatten(current['results'])
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+            continue
+        if key.endswith('.queries') and after > before:
+            regressions.append(f'{key}: {before} -> {after} queries')
+        elif key.endswith('.median_ms') and after > before * (1 + tolerance):
+            regressions.append(f'{key}: {before} -> {after} ms')
+        elif key.endswith('_per_sec') and after < before * (1 - tolerance):
+            regressions.append(f'{key}: {before} -> {after}/s')
+    return regressions
@@ -0,0 +1,78 @@
+import select
+import time
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from crm.models import AuditLog
+
+# Notified by the crm_auditlog_notify trigger when a transaction that wrote audit rows commits.
+CHANGES_CHANNEL = 'crm_changes'
+
+# Oldest transaction still running when the statement starts. Every txid below it is settled, so rows
+# can never appear behind a cursor that stays below it - unlike ids, which are not handed out in commit order.
+SETTLED_TXID = RawSQL('pg_snapshot_xmin(pg_current_snapshot())::text::bigint', [])
+
+
+def encode_cursor(log):
+    return f'{log.txid}-{log.pk}'
+
+
+def decode_cursor(value):
+    """(txid, id) of a cursor from encode_cursor(); ValueError when it is not one."""
+    txid, sep, pk = value.partition('-')
+    if not sep:
+        raise ValueError(value)
+    return int(txid), int(pk)
+
+
+def read_changes(since=None, limit=100):
+    """
+    Up to limit AuditLog rows after the (txid, id) position since (from the start when None), in
+    (txid, id) order, from settled transactions only. One range scan of the (txid, id) index per
+    partition, so a poll costs O(new changes) however long the log is.
+    """
+    logs = AuditLog.objects.filter(txid__lt=SETTLED_TXID)
+    if since is not None:
+        txid, pk = since
+        logs = logs.filter(txid__gte=txid).filter(Q(txid__gt=txid) | Q(pk__gt=pk))
+    return list(logs.order_by('txid', 'id')[:limit])
+
+
+def wait_for_changes(since=None, limit=100, timeout=0.0):
+    """
+    read_changes(), but when there are none yet, LISTEN for a commit and read again, for up to timeout
+    seconds. Also rereads every CRM_CHANGES_RECHECK_SECONDS: a committed transaction's rows are held
+    back while an older one is still running, and that one may not notify when it ends.
+    Outside a transaction only, since notifications are delivered between transactions.
+    """
+    changes = read_changes(since, limit)
+    if changes or timeout <= 0 or connection.in_atomic_block:
+        return changes
+    deadline = time.monotonic() + timeout
+    recheck = getattr(settings, 'CRM_CHANGES_RECHECK_SECONDS', 1.0)
+    with connection.cursor() as cursor:
+        cursor.execute(f'LISTEN {CHANGES_CHANNEL}')
+    try:
+        # Read once more after LISTEN: a commit between the first read and LISTEN sent no notification to us.
+        while not (changes := read_changes(since, limit)):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _wait_for_notification(min(remaining, recheck))
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'UNLISTEN {CHANGES_CHANNEL}')
+    return changes
+
+
+def _wait_for_notification(timeout):
+    raw = connection.connection
+    if callable(raw.notifies):  # psycopg 3
+        return any(True for _ in raw.notifies(timeout=timeout, stop_after=1))
+    if not raw.notifies:
+        select.select([raw], [], [], timeout)
+        raw.poll()
+    received = bool(raw.notifies)
+    del raw.notifies[:]
+    return received
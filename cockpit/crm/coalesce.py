@@ -0,0 +1,94 @@
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import close_old_connections, connection
+from crm.models import Entity
+from crm.services import scd2_bulk_upsert, scd2_upsert_entity
+
+
+class WriteCoalescer:
+    """
+    Per-process queue that folds bursts of writes to the same entity into one version.
+
+    submit() queues a record and returns a Future. A background thread waits window seconds after the
+    first queued write, then applies everything queued with one scd2_bulk_upsert() per actor: records
+    for the same entity_uid fold together (later fields win, details merge by code). The Future resolves
+    to the entity's "inserted" / "updated" / "unchanged", or to the exception that failed its batch.
+    The thread exits, closing its connection, after idle_timeout seconds without writes.
+    """
+
+    def __init__(self, window=None, idle_timeout=5.0):
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._thread = None
+
+    def get_window(self):
+        if self.window is not None:
+            return self.window
+        return getattr(settings, 'CRM_WRITE_COALESCE_MS', 0) / 1000
+
+    def submit(self, record, actor='system'):
+        uid = record['entity_uid']
+        uid = uid if isinstance(uid, uuid.UUID) else uuid.UUID(str(uid))
+        future = Future()
+        with self._cond:
+            records, futures = self._pending.setdefault(actor, ([], {}))
+            records.append(record)
+            futures.setdefault(uid, []).append(future)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='crm-write-coalescer', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    if not self._pending and not self._cond.wait_for(lambda: self._pending, self.idle_timeout):
+                        # Cleared under the lock, so a submit() from now on starts a new thread.
+                        self._thread = None
+                        return
+                time.sleep(self.get_window())
+                with self._cond:
+                    pending, self._pending = self._pending, {}
+                self.apply(pending)
+        finally:
+            connection.close()
+
+    def apply(self, pending):
+        close_old_connections()
+        for actor, (records, futures) in pending.items():
+            try:
+                result = scd2_bulk_upsert(records, actor=actor)
+            except Exception as exc:
+                for waiting in futures.values():
+                    for future in waiting:
+                        future.set_exception(exc)
+                continue
+            for uid, waiting in futures.items():
+                for future in waiting:
+                    future.set_result(result[uid])
+
+
+write_coalescer = WriteCoalescer()
+
+
+def upsert_entity(entity_uid, entity_type_code, display_name, details=None, actor='system'):
+    """
+    scd2_upsert_entity(), or through write_coalescer when CRM_WRITE_COALESCE_MS is set and no
+    transaction is open (the write must not outlive it). Returns the entity's current version.
+    """
+    if write_coalescer.get_window() <= 0 or connection.in_atomic_block:
+        return scd2_upsert_entity(entity_uid, entity_type_code, display_name, details=details, actor=actor)
+    write_coalescer.submit({
+        'entity_uid': entity_uid,
+        'entity_type': entity_type_code,
+        'display_name': display_name,
+        'details': details or [],
+    }, actor=actor).result()
+    return Entity.objects.get(entity_uid=entity_uid, is_current=True)
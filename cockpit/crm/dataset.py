@@ -0,0 +1,346 @@
+"""
+Synthetic SCD2 histories at capacity-planning scale, written straight into the tables with COPY.
+
+Each entity is generated from its own seeded random stream (seed, index), so the same arguments
+produce the same rows however the work is split into chunks and processes. Versions of an entity,
+and of each of its details, follow each other without gaps or overlaps (valid_to of one version is
+valid_from of the next, the last one is current), so the exclusion constraints hold by construction.
+Every version gets the AuditLog row the services would have written for it, at its valid_from.
+"""
+import csv
+import datetime
+import json
+import math
+import multiprocessing
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from django.db import DatabaseError, connection, connections, transaction
+from crm.entity_types import entity_types
+from crm.loader import _init_worker, close_connections_for_fork, copy_rows
+from crm.partitions import ensure_audit_partitions, month_start
+from crm.services import detail_hashdiffs, sync_snapshots
+
+DATASET_ACTOR = 'dataset'
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+ENTITY_TYPES = ('PERSON', 'COMPANY', 'INSTITUTION')
+ENTITY_TYPE_WEIGHTS = (70, 25, 5)
+
+FIRST_NAMES = ('Olena', 'Andrii', 'Iryna', 'Taras', 'Maria', 'Dmytro', 'Sofia', 'Oleh', 'Anna', 'Yurii',
+               'Kateryna', 'Bohdan', 'Natalia', 'Serhii', 'Viktoria', 'Maksym')
+LAST_NAMES = ('Kovalenko', 'Shevchenko', 'Bondarenko', 'Tkachenko', 'Kravchenko', 'Melnyk', 'Boiko',
+              'Oliinyk', 'Lysenko', 'Marchenko', 'Savchenko', 'Rudenko', 'Moroz', 'Pavlenko')
+ORGANIZATION_WORDS = ('Nord', 'Dnipro', 'Capital', 'Alliance', 'Vector', 'Prime', 'Atlas', 'Horizon', 'Unity',
+                      'Granit', 'Sigma', 'Delta', 'Kyiv', 'Lviv', 'Orion', 'Zenit')
+ORGANIZATION_SUFFIXES = {'COMPANY': ('LLC', 'JSC', 'Group', 'Holding', 'Trade'),
+                         'INSTITUTION': ('Bank', 'University', 'Fund', 'Institute', 'Hospital')}
+CITIES = ('Kyiv', 'Lviv', 'Odesa', 'Kharkiv', 'Dnipro', 'Vinnytsia', 'Poltava', 'Chernihiv', 'Uzhhorod')
+STREETS = ('Khreshchatyk', 'Shevchenka', 'Franka', 'Hrushevskoho', 'Sadova', 'Naberezhna', 'Soborna')
+
+
+def _email(rng, name):
+    return f"{name.split()[0].lower()}.{rng.randrange(1000)}@{rng.choice(('example.com', 'mail.test', 'corp.test'))}"
+
+
+def _phone(rng, name):
+    return f'+380{rng.randrange(10**8, 10**9)}'
+
+
+def _address(rng, name):
+    return {'street': f'{rng.choice(STREETS)} {rng.randrange(1, 200)}', 'city': rng.choice(CITIES),
+            'zip': f'{rng.randrange(1000, 99999):05d}', 'country': 'UA'}
+
+
+def _tax_id(rng, name):
+    return f'{rng.randrange(10**9, 10**10)}'
+
+
+def _website(rng, name):
+    return f"https://{name.split()[0].lower()}{rng.randrange(100)}.example.com"
+
+
+def _full_name(rng, name):
+    return name
+
+
+# Detail codes with the value generator of each; an entity gets a random subset.
+DETAIL_GENERATORS = {
+    'EMAIL': _email,
+    'PHONE': _phone,
+    'ADDRESS': _address,
+    'TAX_ID': _tax_id,
+    'WEBSITE': _website,
+    'FULL_NAME': _full_name,
+    'ALIAS': _full_name,
+}
+DETAIL_CODES = tuple(DETAIL_GENERATORS)
+
+ENTITY_COLUMNS = ('entity_uid', 'entity_type_id', 'display_name', 'valid_from', 'valid_to', 'is_current',
+                  'created_at', 'updated_at')
+DETAIL_COLUMNS = ('entity_uid', 'detail_code', 'value', 'valid_from', 'valid_to', 'is_current', 'hashdiff',
+                  'created_at', 'updated_at')
+AUDIT_COLUMNS = ('actor', 'action', 'entity_uid', 'detail_code', 'before', 'after', 'timestamp')
+DATASET_TABLES = ('crm_entity', 'crm_entitydetail', 'crm_auditlog')
+
+# Exclusion constraints and indexes other than primary keys (which back no constraint) of the tables.
+DEFERRABLE_INDEXES_SQL = """
+SELECT 'ALTER TABLE ' || conrelid::regclass || ' DROP CONSTRAINT ' || quote_ident(conname),
+       'ALTER TABLE ' || conrelid::regclass || ' ADD CONSTRAINT ' || quote_ident(conname) || ' '
+           || pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE conrelid = ANY(%(tables)s::regclass[]) AND contype = 'x'
+UNION ALL
+SELECT 'DROP INDEX ' || indexrelid::regclass,
+       -- Indexes of a partitioned table are listed ON ONLY the parent; rebuilt, they cover every partition.
+       replace(pg_get_indexdef(indexrelid), ' ON ONLY ', ' ON ')
+FROM pg_index i
+WHERE indrelid = ANY(%(tables)s::regclass[]) AND NOT indisprimary
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+"""
+
+
+def _display_name(rng, entity_type):
+    if entity_type == 'PERSON':
+        return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+    return f'{rng.choice(ORGANIZATION_WORDS)} {rng.choice(ORGANIZATION_WORDS)} {rng.choice(ORGANIZATION_SUFFIXES[entity_type])}'
+
+
+def _geometric(rng, mean):
+    """1, 2, 3, ... with the given mean: most entities have few versions, a long tail has many."""
+    if mean <= 1:
+        return 1
+    return 1 + int(math.log(1.0 - rng.random()) / math.log(1.0 - 1.0 / mean))
+
+
+def _version_starts(rng, created, end, count):
+    """created followed by count - 1 distinct later points before end, in order."""
+    points = {created}
+    while len(points) < min(count, end - created):
+        points.add(rng.randrange(created + 1, end))
+    return sorted(points)
+
+
+def _versions(starts, values):
+    """(valid_from, valid_to, value) of each version; a value equal to the one before is not a new version."""
+    kept = []
+    for valid_from, value in zip(starts, values):
+        if not kept or kept[-1][1] != value:
+            kept.append((valid_from, value))
+    return [(valid_from, kept[n + 1][0] if n + 1 < len(kept) else None, value)
+            for n, (valid_from, value) in enumerate(kept)]
+
+
+def entity_history(seed, index, end, versions, details):
+    """
+    One entity's SCD2 history: (entity versions, detail versions, audit rows) as lists of tuples in
+    ENTITY_COLUMNS / DETAIL_COLUMNS / AUDIT_COLUMNS order, except that entity_type_id is the type
+    code, hashdiff is left None and the audit actor is left out. Points in time are microseconds
+    in [0, end). versions and details are means.
+    """
+    rng = random.Random((seed << 40) + index)
+    uid = uuid.UUID(int=rng.getrandbits(128), version=4)
+    entity_type = rng.choices(ENTITY_TYPES, ENTITY_TYPE_WEIGHTS)[0]
+    created = rng.randrange(end)
+    entity_rows, detail_rows, audit_rows = [], [], []
+
+    starts = _version_starts(rng, created, end, _geometric(rng, versions))
+    names = [_display_name(rng, entity_type) for _ in starts]
+    previous = None
+    for valid_from, valid_to, name in _versions(starts, names):
+        entity_rows.append((uid, entity_type, name, valid_from, valid_to, valid_to is None, valid_from,
+                            valid_from if valid_to is None else valid_to))
+        if previous is None:
+            audit_rows.append(('INSERT_ENTITY', uid, None, None, {'display_name': name, 'entity_type': entity_type},
+                               valid_from))
+        else:
+            audit_rows.append(('UPDATE_ENTITY', uid, None, {'display_name': previous}, {'display_name': name},
+                               valid_from))
+        previous = name
+
+    codes = rng.sample(DETAIL_CODES, min(len(DETAIL_CODES), _geometric(rng, details)))
+    for code in codes:
+        generate = DETAIL_GENERATORS[code]
+        starts = _version_starts(rng, created, end, _geometric(rng, versions))
+        values = [{'value': generate(rng, rng.choice(names))} for _ in starts]
+        previous = None
+        for valid_from, valid_to, value in _versions(starts, values):
+            detail_rows.append((uid, code, value, valid_from, valid_to, valid_to is None, None, valid_from,
+                                valid_from if valid_to is None else valid_to))
+            audit_rows.append(('INSERT_DETAIL' if previous is None else 'UPDATE_DETAIL', uid, code, previous, value,
+                               valid_from))
+            previous = value
+    return entity_rows, detail_rows, audit_rows
+
+
+def timestamp_formatter(start):
+    """
+    Formats microsecond offsets from start (microseconds since the epoch) as UTC timestamp literals.
+    datetime.isoformat() per value costs more than generating the rows: only dates go through
+    datetime, and each point is formatted once (a version's valid_to is the next one's valid_from).
+    """
+    days, texts = {}, {None: None}
+
+    def ts(offset):
+        text = texts.get(offset)
+        if text is None and offset is not None:
+            day, micros = divmod(start + offset, 86_400_000_000)
+            date = days.get(day)
+            if date is None:
+                date = days[day] = (EPOCH + datetime.timedelta(days=day)).date().isoformat()
+            seconds, micros = divmod(micros, 1_000_000)
+            minutes, seconds = divmod(seconds, 60)
+            text = texts[offset] = f'{date} {minutes // 60:02d}:{minutes % 60:02d}:{seconds:02d}.{micros:06d}+00'
+        return text
+    return ts
+
+
+def write_chunk(first, last, seed, start, end, versions, details, type_ids):
+    """Generate entities first..last - 1 and COPY them in one transaction. Returns the row counts."""
+    started = time.monotonic()
+    span = end - start
+    entity_rows, detail_rows, audit_rows = [], [], []
+    for index in range(first, last):
+        entity_versions, detail_versions, audits = entity_history(seed, index, span, versions, details)
+        entity_rows += entity_versions
+        detail_rows += detail_versions
+        audit_rows += audits
+
+    ts = timestamp_formatter(start)
+
+    hashes = detail_hashdiffs(row[2] for row in detail_rows)
+    entity_csv = [
+        (uid, type_ids[code], name, ts(vf), ts(vt), current, ts(created), ts(updated))
+        for uid, code, name, vf, vt, current, created, updated in entity_rows
+    ]
+    detail_csv = [
+        (uid, code, json.dumps(value), ts(vf), ts(vt), current, digest, ts(created), ts(updated))
+        for (uid, code, value, vf, vt, current, _, created, updated), digest in zip(detail_rows, hashes)
+    ]
+    audit_csv = [
+        (DATASET_ACTOR, action, uid, code, None if before is None else json.dumps(before), json.dumps(after), ts(at))
+        for action, uid, code, before, after, at in audit_rows
+    ]
+    # Unquoted empty fields are NULL in COPY's csv format; QUOTE_MINIMAL writes None that way.
+    with transaction.atomic(), connection.cursor() as cursor:
+        copy_rows(cursor, 'crm_entity', ENTITY_COLUMNS, entity_csv, quoting=csv.QUOTE_MINIMAL)
+        copy_rows(cursor, 'crm_entitydetail', DETAIL_COLUMNS, detail_csv, quoting=csv.QUOTE_MINIMAL)
+        copy_rows(cursor, 'crm_auditlog', AUDIT_COLUMNS, audit_csv, quoting=csv.QUOTE_MINIMAL)
+    return {'entities': last - first, 'entity_versions': len(entity_csv), 'detail_versions': len(detail_csv),
+            'audit_rows': len(audit_csv), 'elapsed': time.monotonic() - started}
+
+
+def _execute(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+
+
+def _execute_in_thread(sql):
+    try:
+        _execute(sql)
+    finally:
+        connection.close()
+
+
+def rebuild_indexes(statements, workers=1):
+    """
+    Run CREATE INDEX / ADD CONSTRAINT statements. With workers > 1 the indexes build side by side on
+    their own connections (CREATE INDEX only takes a share lock); the constraints, which lock their
+    table exclusively, follow. Raises with the statements that did not run when any of them fails.
+    """
+    indexes = [sql for sql in statements if sql.startswith('CREATE')]
+    constraints = [sql for sql in statements if not sql.startswith('CREATE')]
+    failed = []
+    for batch in (indexes, constraints):
+        if workers > 1 and len(batch) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {sql: pool.submit(_execute_in_thread, sql) for sql in batch}
+            failed += [(sql, future.exception()) for sql, future in futures.items() if future.exception()]
+        else:
+            for sql in batch:
+                try:
+                    _execute(sql)
+                except DatabaseError as e:
+                    failed.append((sql, e))
+    if failed:
+        raise DatabaseError(f'{failed[0][1]}; not rebuilt:\n' + ';\n'.join(sql for sql, _ in failed))
+
+
+@contextmanager
+def indexes_deferred(tables=DATASET_TABLES, workers=1):
+    """
+    Drop the exclusion constraints and secondary indexes of tables for the block and rebuild them
+    afterwards (also when the block fails). Building an index in one pass over a large table is much
+    faster than maintaining it row by row, but nothing is checked meanwhile and queries lose their
+    indexes: only for loads into an otherwise idle database.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DEFERRABLE_INDEXES_SQL, {'tables': list(tables)})
+        statements = cursor.fetchall()
+        for drop, _ in statements:
+            cursor.execute(drop)
+    try:
+        yield
+    finally:
+        rebuild_indexes([create for _, create in statements], workers=workers)
+
+
+def _write_chunk_in_worker(*args):
+    try:
+        return write_chunk(*args)
+    finally:
+        connections.close_all()
+
+
+def _micros(value):
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def generate_dataset(entities, start, end, versions=3, details=3, seed=0, workers=1, chunk_size=5000,
+                     defer_indexes=False, progress=None):
+    """
+    Write `entities` entities with histories between start and end (aware datetimes) and sync their
+    snapshots. versions and details are means per entity (versions also per detail). Chunks of
+    chunk_size entities are generated and copied by `workers` processes, each chunk in its own
+    transaction; with defer_indexes the load runs inside indexes_deferred(). Returns the totals;
+    progress(totals) is called after every chunk.
+    """
+    with transaction.atomic():
+        type_ids = {code: et.pk for code, et in entity_types.ensure(ENTITY_TYPES).items()}
+    months = (end.year - start.year) * 12 + end.month - start.month
+    ensure_audit_partitions(months_ahead=months, now=month_start(start))
+
+    args = (seed, _micros(start), _micros(end), versions, details, type_ids)
+    bounds = [(first, min(first + chunk_size, entities)) for first in range(0, entities, chunk_size)]
+    totals = {'entities': 0, 'entity_versions': 0, 'detail_versions': 0, 'audit_rows': 0, 'chunks': 0}
+    started = time.monotonic()
+
+    def add(result):
+        for key in ('entities', 'entity_versions', 'detail_versions', 'audit_rows'):
+            totals[key] += result[key]
+        totals['chunks'] += 1
+        if progress:
+            progress(totals)
+
+    with indexes_deferred(workers=workers) if defer_indexes else nullcontext():
+        if workers <= 1:
+            for first, last in bounds:
+                add(write_chunk(first, last, *args))
+        else:
+            close_connections_for_fork()
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+                futures = [pool.submit(_write_chunk_in_worker, first, last, *args) for first, last in bounds]
+                for future in futures:
+                    add(future.result())
+
+    with transaction.atomic():
+        totals['snapshots'] = sync_snapshots()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE crm_entity, crm_entitydetail, crm_auditlog, entity_current_snapshot')
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    rows = totals['entity_versions'] + totals['detail_versions'] + totals['audit_rows']
+    totals['rows_per_sec'] = round(rows / totals['seconds']) if totals['seconds'] else None
+    return totals
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.http import parse_etags
+
+
+def entity_generation_key(entity_uid):
+    return f'crm:entity-generation:{entity_uid}'
+
+
+def entity_cache_key(entity_uid, generation):
+    return f'crm:entity:{entity_uid}:{generation}'
+
+
+def new_generation():
+    return uuid.uuid4().hex
+
+
+def compute_etag(data):
+    raw = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def get_cached_entity(entity_uid, build):
+    """
+    Read-through cache of an entity's serialized current view: {'etag': ..., 'data': ...}.
+    build() returns the serialized data on a miss, or None when the entity does not exist (not cached).
+
+    Entries are stored under the entity's generation, read before build() runs. A write replaces the
+    generation when it commits, so a build that read the state before the write lands under the old
+    generation, which nothing reads any more, instead of caching that state over the write.
+    """
+    generation_key = entity_generation_key(entity_uid)
+    generation = cache.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, new_generation(), None)
+        generation = cache.get(generation_key)
+    key = entity_cache_key(entity_uid, generation)
+    cached = cache.get(key)
+    if cached is None:
+        data = build()
+        if data is None:
+            return None
+        cached = {'etag': compute_etag(data), 'data': data}
+        cache.set(key, cached, getattr(settings, 'CRM_ENTITY_CACHE_TIMEOUT', 300))
+    return cached
+
+
+async def aget_cached_entity(entity_uid, build):
+    """get_cached_entity() for async views; build is a coroutine function."""
+    generation_key = entity_generation_key(entity_uid)
+    generation = await cache.aget(generation_key)
+    if generation is None:
+        await cache.aadd(generation_key, new_generation(), None)
+        generation = await cache.aget(generation_key)
+    key = entity_cache_key(entity_uid, generation)
+    cached = await cache.aget(key)
+    if cached is None:
+        data = await build()
+        if data is None:
+            return None
+        cached = {'etag': compute_etag(data), 'data': data}
+        await cache.aset(key, cached, getattr(settings, 'CRM_ENTITY_CACHE_TIMEOUT', 300))
+    return cached
+
+
+def etag_matches(request, etag):
+    """Whether the request's If-None-Match covers the quoted etag (weak comparison)."""
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    tags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+    return '*' in tags or etag in tags
+
+
+def invalidate_entities(entity_uids):
+    # On commit: a new generation set earlier would let reads in between cache the old state under it.
+    # Generations are random, so one evicted from the cache is replaced and never revives old entries.
+    keys = [entity_generation_key(uid) for uid in entity_uids]
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: new_generation() for key in keys}, None))
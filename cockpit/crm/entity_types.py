@@ -0,0 +1,193 @@
+import threading
+import time
+import weakref
+from django.core.cache import cache
+from django.db import connection, transaction
+from crm.models import EntityType
+
+# Returns only the codes this statement inserted; the others already exist.
+INSERT_TYPES_SQL = """
+INSERT INTO crm_entitytype (code, name, description, created_at, updated_at)
+SELECT code, '', '', now(), now() FROM unnest(%s::text[]) AS code
+ON CONFLICT (code) DO NOTHING
+RETURNING code
+"""
+
+
+class _Marker:
+    def __call__(self):
+        pass
+
+
+class _Layer:
+    """
+    Types read or created by the current transaction. The layer belongs to the outermost atomic
+    block it was made in and is alive while its on_commit marker is pending: Django runs and drops
+    the callbacks on commit and discards them when the transaction, or the savepoint they were
+    registered in, rolls back, and the weak reference dies with them.
+    """
+    __slots__ = ('owner', 'marker', 'maps')
+
+    def __init__(self):
+        self.owner = connection.atomic_blocks[0] if connection.atomic_blocks else None
+        marker = _Marker()
+        transaction.on_commit(marker)
+        self.marker = weakref.ref(marker)
+        self.maps = {'code': {}, 'pk': {}}
+
+    def alive(self):
+        blocks = connection.atomic_blocks
+        return self.marker() is not None and bool(blocks) and blocks[0] is self.owner
+
+    def add(self, types):
+        for et in types:
+            self.maps['code'][et.code] = self.maps['pk'][et.pk] = et
+
+
+class EntityTypeRegistry:
+    """
+    In-process map of EntityType by code and by id, loaded with one query.
+
+    Other processes learn about changes through a version counter in the shared cache, checked at
+    most every check_interval seconds; a lookup miss reloads, so a type created elsewhere is found
+    on first use. The shared map only ever holds committed types. Once a transaction writes types,
+    what it reads or creates from then on goes to per-thread overlay layers instead, each ending
+    when the transaction commits or the block it was made in rolls back; until then the shared map
+    is not reloaded. Returned instances are shared between threads: treat them as read-only.
+    """
+    version_key = 'crm:entity_types:version'
+    check_interval = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._maps = None
+            self._version = None
+            self._checked_at = 0.0
+        self._local.__dict__.clear()
+
+    def _load(self, codes=None):
+        types = list(EntityType.objects.all() if codes is None else EntityType.objects.filter(code__in=codes))
+        return {'code': {et.code: et for et in types}, 'pk': {et.pk: et for et in types}}
+
+    def _layers(self):
+        """The live overlay layers of this thread's transaction; none once it committed or rolled back."""
+        layers = getattr(self._local, 'layers', None)
+        if not layers:
+            return ()
+        if not all(layer.alive() for layer in layers):
+            self._local.layers = layers = [layer for layer in layers if layer.alive()]
+        return layers
+
+    def _new_layer(self):
+        layer = _Layer()
+        if layer.alive():  # inside a transaction
+            self._local.layers = [*self._layers(), layer]
+        return layer
+
+    def _shared_maps(self):
+        if self._maps is None or time.monotonic() - self._checked_at >= self.check_interval:
+            version = cache.get(self.version_key)
+            if (self._maps is None or version != self._version) and not self._layers():
+                maps = self._load()
+                with self._lock:
+                    self._maps, self._version = maps, version
+            self._checked_at = time.monotonic()
+        return self._maps
+
+    def _share(self, types):
+        with self._lock:
+            if self._maps is not None:
+                self._maps = {'code': {**self._maps['code'], **{et.code: et for et in types}},
+                              'pk': {**self._maps['pk'], **{et.pk: et for et in types}}}
+
+    def _get(self, field, key):
+        for layer in reversed(self._layers()):
+            if key in layer.maps[field]:
+                return layer.maps[field][key]
+        shared = self._shared_maps()
+        if shared is not None and key in shared[field]:
+            return shared[field][key]
+        if self._layers():
+            # This transaction wrote types: what it reads may not be committed yet.
+            layer = self._new_layer()
+            layer.add(self._load()['code'].values())
+            return layer.maps[field].get(key)
+        maps = self._load()
+        with self._lock:
+            self._maps = maps
+            self._checked_at = time.monotonic()
+        return maps[field].get(key)
+
+    def get_by_code(self, code):
+        return self._get('code', code)
+
+    def get_by_id(self, pk):
+        return self._get('pk', pk)
+
+    def ensure(self, codes):
+        """
+        {code: EntityType} for the given codes, creating the missing ones with one bulk insert.
+        Created types join the shared map once the surrounding transaction commits.
+        """
+        codes = set(codes)
+        found = {}
+        for code in codes:
+            et = self._known(code)
+            if et is not None:
+                found[code] = et
+        missing = codes - found.keys()
+        if missing:
+            with connection.cursor() as cursor:
+                cursor.execute(INSERT_TYPES_SQL, [sorted(missing)])
+                inserted = {code for code, in cursor.fetchall()}
+            resolved = list(EntityType.objects.filter(code__in=missing))
+            found.update((et.code, et) for et in resolved)
+            if inserted:
+                self.changed()
+            # Codes that conflicted were committed by another transaction (ON CONFLICT waits for it).
+            created = [et for et in resolved if et.code in inserted]
+            existing = [et for et in resolved if et.code not in inserted]
+            if self._layers():
+                self._layers()[-1].add(created + existing)
+            else:
+                self._share(created + existing)
+        return found
+
+    def _known(self, code):
+        # From the maps already loaded, without a query.
+        for layer in reversed(self._layers()):
+            if code in layer.maps['code']:
+                return layer.maps['code'][code]
+        shared = self._shared_maps()
+        return shared['code'].get(code) if shared is not None else None
+
+    def changed(self):
+        """Types were written: keep this transaction's reads out of the shared map until it commits."""
+        self._new_layer()
+        self.invalidate()
+
+    def invalidate(self):
+        # Bump the shared version and drop the local map once the change is visible to other connections.
+        transaction.on_commit(self._bump)
+
+    def _bump(self):
+        cache.add(self.version_key, 0, timeout=None)
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            # Evicted between add() and incr(); a missing key also reads as a new version.
+            pass
+        with self._lock:
+            self._maps = None
+
+
+entity_types = EntityTypeRegistry()
+
+
+def entity_type_changed(sender, **kwargs):
+    entity_types.changed()
@@ -0,0 +1,80 @@
+import hashlib
+import json
+from django.conf import settings
+
+# Stored hashdiffs are "<tag>:<hex digest>"; the tag names the scheme so a stored hash is always
+# compared under the scheme that produced it. Untagged values predate the tags (legacy_hashdiff).
+SCHEMES = {
+    'sha256': ('s2', lambda raw: hashlib.sha256(raw).hexdigest()),
+    'blake2b': ('b2', lambda raw: hashlib.blake2b(raw, digest_size=16).hexdigest()),
+}
+SCHEME_BY_TAG = {tag: name for name, (tag, _) in SCHEMES.items()}
+LEGACY = 'legacy'
+
+
+# Built once: json.dumps() with these arguments builds a new encoder on every call. Stored hashdiffs
+# depend on the exact output, so the arguments must never change.
+_encode = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=False, allow_nan=False).encode
+
+_PLAIN = frozenset((str, int, bool, type(None)))
+
+
+def canonical(value):
+    # Integral floats hash like ints: jsonb compares 1.0 = 1 and may hand either back.
+    # Strings, ints, bools and None are passed through without a call per item.
+    kind = type(value)
+    if kind in _PLAIN:
+        return value
+    if kind is dict:
+        return {key: item if type(item) in _PLAIN else canonical(item) for key, item in value.items()}
+    if kind is list or kind is tuple:
+        return [item if type(item) in _PLAIN else canonical(item) for item in value]
+    if kind is float and value.is_integer():
+        return int(value)
+    return value
+
+
+def canonical_json(value) -> bytes:
+    """Sorted-key, whitespace-free JSON of value; "1" and 1 stay distinct, nested dicts are sorted too."""
+    return _encode(canonical(value)).encode('utf-8')
+
+
+def default_scheme():
+    return getattr(settings, 'CRM_HASHDIFF_SCHEME', 'blake2b')
+
+
+def hashdiff(value, scheme=None) -> str:
+    tag, digest = SCHEMES[scheme or default_scheme()]
+    return f'{tag}:{digest(canonical_json(value))}'
+
+
+def hashdiff_many(values, scheme=None):
+    # Same as [hashdiff(v) for v in values] with the scheme lookups hoisted out of the loop.
+    tag, digest = SCHEMES[scheme or default_scheme()]
+    prefix = f'{tag}:'
+    encode = _encode
+    return [
+        prefix + digest(encode(value if type(value) in _PLAIN else canonical(value)).encode('utf-8'))
+        for value in values
+    ]
+
+
+def legacy_hashdiff(value) -> str:
+    if isinstance(value, dict):
+        raw = str(sorted(value.items())).encode('utf-8')
+    else:
+        raw = str(value).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()
+
+
+def scheme_of(stored):
+    tag, sep, _ = stored.partition(':')
+    return SCHEME_BY_TAG.get(tag) if sep else LEGACY
+
+
+def hashdiff_matches(stored, value) -> bool:
+    """Whether value hashes to stored under the scheme stored was written with."""
+    scheme = scheme_of(stored)
+    if scheme == LEGACY:
+        return legacy_hashdiff(value) == stored
+    return scheme is not None and hashdiff(value, scheme) == stored
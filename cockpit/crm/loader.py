@@ -0,0 +1,345 @@
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.db import connection, connections, transaction
+from crm.entity_types import entity_types
+from crm.locking import entity_lock_key, lock_entities
+from crm.services import scd2_bulk_upsert, fold_records, detail_hashdiffs, entities_changed
+
+ENTITY_FIELDS = ("entity_uid", "entity_type", "display_name")
+
+
+def row_to_record(row):
+    details = row.get("details")
+    if not isinstance(details, list):
+        details = [
+            {"detail_code": key.upper(), "value": {"value": value}}
+            for key, value in row.items()
+            if key not in ENTITY_FIELDS
+        ]
+    return {
+        "entity_uid": row["entity_uid"],
+        "entity_type": row.get("entity_type") or "PERSON",
+        "display_name": row["display_name"],
+        "details": details,
+    }
+
+
+def iter_rows(file_path):
+    if file_path.endswith(".csv"):
+        with open(file_path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    elif file_path.endswith((".ndjson", ".jsonl")):
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    elif file_path.endswith(".json"):
+        with open(file_path, encoding="utf-8") as f:
+            yield from json.load(f)
+    else:
+        raise ValueError("Supported formats: .csv, .ndjson, .jsonl or .json")
+
+
+def partition_of(entity_uid, partitions):
+    # Partitions are unions of lock buckets, so parallel workers never wait on each other's locks.
+    return entity_lock_key(entity_uid) % partitions
+
+
+def iter_batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_checkpoint(checkpoint_path, file_path):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("file_path") != os.path.abspath(file_path) or state.get("size") != os.path.getsize(file_path):
+        return 0
+    return state["rows_done"]
+
+
+def write_checkpoint(checkpoint_path, file_path, rows_done):
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "file_path": os.path.abspath(file_path),
+            "size": os.path.getsize(file_path),
+            "rows_done": rows_done,
+        }, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+STAGING_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS crm_stage_entity (
+    entity_uid uuid PRIMARY KEY,
+    entity_type text NOT NULL,
+    display_name text NOT NULL
+) ON COMMIT DELETE ROWS;
+CREATE TEMP TABLE IF NOT EXISTS crm_stage_detail (
+    entity_uid uuid NOT NULL,
+    detail_code text NOT NULL,
+    value jsonb NOT NULL,
+    hashdiff text NOT NULL,
+    PRIMARY KEY (entity_uid, detail_code)
+) ON COMMIT DELETE ROWS;
+"""
+
+# services.detail_business_value() in SQL: the part of a detail value its hashdiff covers.
+BUSINESS_VALUE_SQL = "(CASE WHEN jsonb_typeof({col}) = 'object' AND {col} ? 'value' THEN {col} -> 'value' ELSE {col} END)"
+
+# Order matters: audit the inserts while "no current row" still means new,
+# then close changed rows, then open a version for every staged row without a current one.
+# The *_versions steps return the entity_uid of each version they open: the entities the batch changed.
+MERGE_ENTITY_SQL = [
+    ("entities_inserted", """
+        INSERT INTO crm_auditlog (actor, action, entity_uid, detail_code, before, after, timestamp)
+        SELECT %(actor)s, 'INSERT_ENTITY', s.entity_uid, NULL, NULL,
+               jsonb_build_object('display_name', s.display_name, 'entity_type', s.entity_type), now()
+        FROM crm_stage_entity s
+        WHERE NOT EXISTS (SELECT 1 FROM crm_entity e WHERE e.entity_uid = s.entity_uid AND e.is_current)
+    """),
+    ("entities_updated", """
+        WITH closed AS (
+            UPDATE crm_entity e
+            SET is_current = FALSE, valid_to = %(change_ts)s, updated_at = now()
+            FROM crm_stage_entity s
+            JOIN crm_entitytype t ON t.code = s.entity_type
+            WHERE e.entity_uid = s.entity_uid
+              AND e.is_current
+              AND (e.display_name <> s.display_name OR e.entity_type_id <> t.id)
+            RETURNING e.entity_uid, e.display_name AS before_name, s.display_name AS after_name
+        )
+        INSERT INTO crm_auditlog (actor, action, entity_uid, detail_code, before, after, timestamp)
+        SELECT %(actor)s, 'UPDATE_ENTITY', entity_uid, NULL,
+               jsonb_build_object('display_name', before_name), jsonb_build_object('display_name', after_name), now()
+        FROM closed
+    """),
+    ("entity_versions", """
+        INSERT INTO crm_entity (entity_uid, entity_type_id, display_name, valid_from, valid_to, is_current, created_at, updated_at)
+        SELECT s.entity_uid, t.id, s.display_name, %(change_ts)s, NULL, TRUE, now(), now()
+        FROM crm_stage_entity s
+        JOIN crm_entitytype t ON t.code = s.entity_type
+        WHERE NOT EXISTS (SELECT 1 FROM crm_entity e WHERE e.entity_uid = s.entity_uid AND e.is_current)
+        RETURNING entity_uid
+    """),
+    ("details_inserted", """
+        INSERT INTO crm_auditlog (actor, action, entity_uid, detail_code, before, after, timestamp)
+        SELECT %(actor)s, 'INSERT_DETAIL', s.entity_uid, s.detail_code, NULL, s.value, now()
+        FROM crm_stage_detail s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM crm_entitydetail d
+            WHERE d.entity_uid = s.entity_uid AND d.detail_code = s.detail_code AND d.is_current
+        )
+    """),
+    ("details_updated", """
+        WITH closed AS (
+            UPDATE crm_entitydetail d
+            SET is_current = FALSE, valid_to = %(change_ts)s, updated_at = now()
+            FROM crm_stage_detail s
+            WHERE d.entity_uid = s.entity_uid
+              AND d.detail_code = s.detail_code
+              AND d.is_current
+              AND d.hashdiff <> s.hashdiff
+              -- Hashes from another scheme (before rehash_details) fall back to comparing business values.
+              AND (split_part(d.hashdiff, ':', 1) = split_part(s.hashdiff, ':', 1)
+                   OR {business_value_d} IS DISTINCT FROM {business_value_s})
+            RETURNING d.entity_uid, d.detail_code, d.value AS before_value, s.value AS after_value
+        )
+        INSERT INTO crm_auditlog (actor, action, entity_uid, detail_code, before, after, timestamp)
+        SELECT %(actor)s, 'UPDATE_DETAIL', entity_uid, detail_code, before_value, after_value, now()
+        FROM closed
+    """.format(business_value_d=BUSINESS_VALUE_SQL.format(col="d.value"),
+               business_value_s=BUSINESS_VALUE_SQL.format(col="s.value"))),
+    ("detail_versions", """
+        INSERT INTO crm_entitydetail (entity_uid, detail_code, value, valid_from, valid_to, is_current, hashdiff, created_at, updated_at)
+        SELECT s.entity_uid, s.detail_code, s.value, %(change_ts)s, NULL, TRUE, s.hashdiff, now(), now()
+        FROM crm_stage_detail s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM crm_entitydetail d
+            WHERE d.entity_uid = s.entity_uid AND d.detail_code = s.detail_code AND d.is_current
+        )
+        RETURNING entity_uid
+    """),
+]
+
+
+def copy_rows(cursor, table, columns, rows, quoting=csv.QUOTE_ALL):
+    buf = io.StringIO()
+    writer = csv.writer(buf, quoting=quoting)
+    writer.writerows(rows)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    if hasattr(cursor, "copy_expert"):  # psycopg2
+        buf.seek(0)
+        cursor.copy_expert(sql, buf)
+    else:  # psycopg 3
+        with cursor.copy(sql) as copy:
+            copy.write(buf.getvalue())
+
+
+def copy_merge_batch(records, actor="batch_loader", change_ts=None):
+    """
+    Stage a batch with COPY FROM STDIN and apply the SCD2 merge as set-based SQL,
+    then sync the snapshots of the entities it changed. Returns the row counts of each step.
+    """
+    folded = fold_records(records)
+    entity_rows = [(uid, item["entity_type"], item["display_name"]) for uid, item in folded.items()]
+    details = [(uid, code, value) for uid, item in folded.items() for code, value in item["details"].items()]
+    detail_rows = [
+        (uid, code, json.dumps(value), new_hash)
+        for (uid, code, value), new_hash in zip(details, detail_hashdiffs(value for _, _, value in details))
+    ]
+
+    stats = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        # The merge joins staged type codes to crm_entitytype, so every code must exist first.
+        entity_types.ensure(item["entity_type"] for item in folded.values())
+        locked_at = lock_entities(folded)
+        if change_ts is None:
+            change_ts = locked_at
+        cursor.execute(STAGING_SQL)
+        copy_rows(cursor, "crm_stage_entity", ("entity_uid", "entity_type", "display_name"), entity_rows)
+        copy_rows(cursor, "crm_stage_detail", ("entity_uid", "detail_code", "value", "hashdiff"), detail_rows)
+        changed = set()
+        for step, sql in MERGE_ENTITY_SQL:
+            cursor.execute(sql, {"actor": actor, "change_ts": change_ts})
+            stats[step] = cursor.rowcount
+            if step.endswith("_versions"):
+                changed.update(row[0] for row in cursor.fetchall())
+        # Entities the batch left as they were keep their snapshot rows and cached reads.
+        stats["snapshots"] = entities_changed(changed)
+        # ON COMMIT DELETE ROWS only fires at the outermost commit.
+        cursor.execute("TRUNCATE crm_stage_entity, crm_stage_detail")
+    return stats
+
+
+def orm_merge_batch(records, actor="batch_loader", change_ts=None):
+    result = scd2_bulk_upsert(records, change_ts=change_ts, actor=actor)
+    stats = {"entities_inserted": 0, "entities_updated": 0, "entities_unchanged": 0}
+    for status in result.values():
+        stats[f"entities_{status}"] += 1
+    return stats
+
+
+def load_file(file_path, stream=False, batch_size=5000, checkpoint_path=None, actor="batch_loader",
+              progress=None):
+    merge_batch = copy_merge_batch if stream else orm_merge_batch
+    rows_done = read_checkpoint(checkpoint_path, file_path)
+    totals = {"rows": 0, "batches": 0, "skipped": rows_done}
+
+    rows = itertools.islice(iter_rows(file_path), rows_done, None)
+    for batch in iter_batches(rows, batch_size):
+        stats = merge_batch([row_to_record(row) for row in batch], actor=actor)
+        rows_done += len(batch)
+        if checkpoint_path:
+            write_checkpoint(checkpoint_path, file_path, rows_done)
+
+        totals["rows"] += len(batch)
+        totals["batches"] += 1
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+        if progress:
+            progress(totals)
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return totals
+
+
+def _init_worker():
+    django.setup()
+
+
+def load_partition(part_path, index, checkpoint=False, **options):
+    # Runs inside a pool process on the partition's file; Django opens a fresh connection for it on first use.
+    started = time.monotonic()
+    last = {"rows": 0, "batches": 0, "skipped": 0}
+    error = None
+    try:
+        last = load_file(part_path, checkpoint_path=f"{part_path}.checkpoint" if checkpoint else None,
+                         progress=lambda totals: last.update(totals), **options)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        connections.close_all()
+    return dict(last, partition=index, elapsed=time.monotonic() - started, error=error)
+
+
+def split_file(file_path, partitions, directory):
+    """
+    Read file_path once and write its rows, by partition_of(entity_uid), to one NDJSON file per
+    partition in directory; returns their paths. A manifest naming the input is written last: a
+    rerun that finds a complete split of the same file reuses it, together with the partition
+    checkpoints kept next to it; anything else in directory is discarded.
+    """
+    paths = [os.path.join(directory, f"part-{index}-of-{partitions}.ndjson") for index in range(partitions)]
+    manifest_path = os.path.join(directory, "manifest.json")
+    manifest = {"file_path": os.path.abspath(file_path), "size": os.path.getsize(file_path), "partitions": partitions}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            if json.load(f) == manifest:
+                return paths
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    parts = [open(path, "w", encoding="utf-8") for path in paths]
+    try:
+        for row in iter_rows(file_path):
+            parts[partition_of(row["entity_uid"], partitions)].write(json.dumps(row, ensure_ascii=False) + "\n")
+    finally:
+        for part in parts:
+            part.close()
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return paths
+
+
+def close_connections_for_fork():
+    # Forked workers must not share the parent's socket, nor a connection pool whose threads do not survive the fork.
+    connections.close_all()
+    for conn in connections.all():
+        if getattr(conn, "pool", None) is not None:
+            conn.close_pool()
+
+
+def load_file_parallel(file_path, workers, checkpoint_path=None, **options):
+    """
+    Split the input by a hash of entity_uid and load each partition in its own process.
+    No two workers touch the same entity, so the SCD2 constraints cannot conflict across them.
+
+    The input is parsed once, here: split_file() spills the partitions to files the workers read.
+    With a checkpoint they go to <checkpoint>.parts, with a checkpoint per partition, and stay
+    until every partition is loaded, so a rerun resumes each one where it stopped.
+    """
+    parts_dir = f"{checkpoint_path}.parts" if checkpoint_path else tempfile.mkdtemp(prefix="crm-load-")
+    results = None
+    try:
+        part_paths = split_file(file_path, workers, parts_dir)
+        close_connections_for_fork()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            futures = [
+                pool.submit(load_partition, path, index, checkpoint=bool(checkpoint_path), **options)
+                for index, path in enumerate(part_paths)
+            ]
+            results = [future.result() for future in futures]
+        return results
+    finally:
+        if not checkpoint_path or (results is not None and not any(r["error"] for r in results)):
+            shutil.rmtree(parts_dir, ignore_errors=True)
@@ -0,0 +1,15 @@
+from django.db.models import CharField, TextField
+from django.db.models.lookups import IContains
+
+
+@CharField.register_lookup
+@TextField.register_lookup
+class ILikeContains(IContains):
+    # icontains compiles to UPPER(col) LIKE UPPER(%s) on PostgreSQL, which a gin_trgm_ops
+    # index on col cannot serve; ILIKE on the bare column can.
+    lookup_name = 'ilike'
+
+    def as_sql(self, compiler, connection):
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs_sql} ILIKE {rhs_sql}', (*lhs_params, *rhs_params)
@@ -0,0 +1,28 @@
+import datetime
+import json
+from django.core.management.base import BaseCommand
+from crm.benchmarks import bench_asof, drop_bench_data, seed_entity_history
+
+
+class Command(BaseCommand):
+    help = 'Benchmark as-of queries: legacy valid_from/valid_to predicate vs GiST range containment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entities', type=int, default=100000)
+        parser.add_argument('--versions', type=int, default=100, help='Versions per entity')
+        parser.add_argument('--repeats', type=int, default=20)
+        parser.add_argument('--reuse', action='store_true', help='Reuse BENCH rows from a previous --keep run')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated BENCH rows')
+
+    def handle(self, *args, **options):
+        step = datetime.timedelta(days=1)
+        if not options['reuse']:
+            drop_bench_data()
+            self.stdout.write(f"Seeding {options['entities'] * options['versions']} entity versions...")
+            seed_entity_history(options['entities'], options['versions'], step=step)
+        try:
+            results = bench_asof(options['versions'], step=step, repeats=options['repeats'])
+        finally:
+            if not options['keep']:
+                drop_bench_data()
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,22 @@
+import json
+from django.core.management.base import BaseCommand
+from crm.benchmarks import bench_concurrent_writes
+
+
+class Command(BaseCommand):
+    help = 'Hammer a few hot entities from many threads; report throughput, conflict rate and versions written'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--writes', type=int, default=50, help='Writes per thread')
+        parser.add_argument('--entities', type=int, default=1, help='Hot entities the writes are spread over')
+        parser.add_argument('--coalesce-ms', type=int, default=0, help='Route writes through a WriteCoalescer')
+
+    def handle(self, *args, **options):
+        runs = {}
+        for locks in (False, True):
+            runs['locks' if locks else 'no_locks'] = bench_concurrent_writes(
+                options['threads'], options['writes'], options['entities'], locks=locks,
+                coalesce_ms=options['coalesce_ms'],
+            )
+        self.stdout.write(json.dumps(runs, indent=2))
@@ -0,0 +1,14 @@
+import json
+from django.core.management.base import BaseCommand
+from crm.benchmarks import bench_hashdiff
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark hashdiff schemes (hashes/sec) on realistic detail payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='Values hashed per run')
+        parser.add_argument('--repeats', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(bench_hashdiff(options['count'], options['repeats']), indent=2))
@@ -0,0 +1,64 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from crm.benchmarks import compare_results, drop_bench_data, run_suite
+
+
+def parse_mix(value):
+    try:
+        parts = [float(part) for part in value.split(',')]
+    except ValueError:
+        parts = []
+    if len(parts) != 3 or min(parts) < 0 or not sum(parts):
+        raise CommandError('--mix takes three non-negative weights: insert,update,noop')
+    return tuple(part / sum(parts) for part in parts)
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic dataset and benchmark SCD2 upserts, the read endpoints and the loader; '
+            'optionally fail on regressions against a baseline run')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entities', type=int, default=1000)
+        parser.add_argument('--details', type=int, default=3, help='Details per entity')
+        parser.add_argument('--versions', type=int, default=5, help='Versions per entity')
+        parser.add_argument('--writes', type=int, default=300, help='scd2_upsert_entity calls')
+        parser.add_argument('--mix', default='20,60,20', help='Weights of inserts, updates and no-ops')
+        parser.add_argument('--repeats', type=int, default=20, help='Requests per read endpoint')
+        parser.add_argument('--loader-rows', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the results JSON to this file')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run to compare with')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown of medians and throughputs against the baseline (0.25 = 25%%)')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated BENCH rows')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+        try:
+            report = run_suite(
+                entities=options['entities'], details=options['details'], versions=options['versions'],
+                writes=options['writes'], mix=parse_mix(options['mix']), repeats=options['repeats'],
+                loader_rows=options['loader_rows'], seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if not options['keep']:
+                drop_bench_data()
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+
+        if baseline is not None:
+            if baseline['meta']['params'] != report['meta']['params']:
+                self.stderr.write('Baseline was run with different parameters; comparing anyway.')
+            regressions = compare_results(baseline, report, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stderr.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from crm.audit import drain_spool
+
+
+class Command(BaseCommand):
+    help = "Move spooled audit entries (CRM_AUDIT_MODE='spool') into AuditLog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Spooled transactions moved per statement')
+        parser.add_argument('--loop', action='store_true', help='Keep draining, sleeping --interval seconds when idle')
+        parser.add_argument('--interval', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            moved = drain_spool(options['batch_size'])
+            total += moved
+            if moved:
+                continue
+            if not options['loop']:
+                break
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                break
+        self.stdout.write(self.style.SUCCESS(f'{total} audit entries drained.'))
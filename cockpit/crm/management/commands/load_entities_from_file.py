@@ -1,49 +1,76 @@
-import csv
-import json
+import time
 from django.core.management.base import BaseCommand, CommandError
-from crm.services import scd2_upsert_entity
-from crm.models import EntityType
+from crm.loader import load_file, load_file_parallel
 
 
 class Command(BaseCommand):
-    help = "Batch load entities from CSV or JSON file."
+    help = "Batch load entities from CSV, NDJSON or JSON file."
 
     def add_arguments(self, parser):
-        parser.add_argument("file_path", type=str, help="Path to CSV or JSON file")
+        parser.add_argument("file_path", type=str, help="Path to CSV, NDJSON (.ndjson/.jsonl) or JSON file")
+        parser.add_argument("--stream", action="store_true",
+                            help="Stream rows into a staging table with COPY and merge them with set-based SQL")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per transaction")
+        parser.add_argument("--checkpoint", type=str, default=None,
+                            help="Checkpoint file; an interrupted load resumes after the last committed batch")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Load partitions of the file (split by a hash of entity_uid) in N processes")
 
     def handle(self, *args, **options):
         file_path = options["file_path"]
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        if options["workers"] > 1:
+            return self.handle_parallel(file_path, options)
+
+        started = time.monotonic()
         try:
-            if file_path.endswith(".csv"):
-                with open(file_path, newline="", encoding="utf-8") as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        self.process_row(row)
-            elif file_path.endswith(".json"):
-                with open(file_path, encoding="utf-8") as f:
-                    data = json.load(f)
-                    for row in data:
-                        self.process_row(row)
-            else:
-                raise CommandError("Supported formats: .csv or .json")
-
-            self.stdout.write(self.style.SUCCESS("File loaded successfully."))
+            totals = load_file(
+                file_path,
+                stream=options["stream"],
+                batch_size=options["batch_size"],
+                checkpoint_path=options["checkpoint"],
+                progress=self.report_progress if options["verbosity"] > 1 else None,
+            )
         except Exception as e:
             raise CommandError(f"Error loading file: {e}")
 
-    def process_row(self, row):
-        entity_type_code = row.get("entity_type", "PERSON")
-        entity_type, _ = EntityType.objects.get_or_create(code=entity_type_code)
-
-        details = []
-        for key, value in row.items():
-            if key not in ("entity_uid", "entity_type", "display_name"):
-                details.append({"detail_code": key.upper(), "value": {"value": value}})
-
-        scd2_upsert_entity(
-            entity_uid=row["entity_uid"],
-            entity_type=entity_type,
-            display_name=row["display_name"],
-            details=details,
-            actor="batch_loader",
-        )
\ No newline at end of file
+        elapsed = time.monotonic() - started
+        if totals["skipped"]:
+            self.stdout.write(f"Resumed after {totals['skipped']} rows from checkpoint.")
+        self.stdout.write(
+            f"{totals['rows']} rows in {totals['batches']} batches, {elapsed:.1f}s "
+            f"({totals['rows'] / elapsed if elapsed else 0:.0f} rows/s)"
+        )
+        self.stdout.write(self.style.SUCCESS("File loaded successfully."))
+
+    def handle_parallel(self, file_path, options):
+        started = time.monotonic()
+        results = load_file_parallel(
+            file_path,
+            workers=options["workers"],
+            stream=options["stream"],
+            batch_size=options["batch_size"],
+            checkpoint_path=options["checkpoint"],
+        )
+        elapsed = time.monotonic() - started
+
+        for r in results:
+            rate = r["rows"] / r["elapsed"] if r["elapsed"] else 0
+            resumed = f", resumed after {r['skipped']}" if r["skipped"] else ""
+            self.stdout.write(
+                f"worker {r['partition']}: {r['rows']} rows in {r['batches']} batches, "
+                f"{r['elapsed']:.1f}s ({rate:.0f} rows/s{resumed})"
+            )
+        total_rows = sum(r["rows"] for r in results)
+        self.stdout.write(f"total: {total_rows} rows, {elapsed:.1f}s ({total_rows / elapsed if elapsed else 0:.0f} rows/s)")
+
+        failed = [r for r in results if r["error"]]
+        if failed:
+            for r in failed:
+                self.stderr.write(f"worker {r['partition']} stopped after {r['rows']} rows: {r['error']}")
+            raise CommandError(f"{len(failed)} of {len(results)} workers failed; rerun with the same --checkpoint to resume.")
+        self.stdout.write(self.style.SUCCESS("File loaded successfully."))
+
+    def report_progress(self, totals):
+        self.stdout.write(f"  {totals['rows']} rows loaded")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from crm.partitions import detach_audit_partitions, ensure_audit_partitions
+
+
+class Command(BaseCommand):
+    help = ('Create the upcoming monthly AuditLog partitions and detach the ones past the retention '
+            'period (to the crm_audit_archive schema, or dropped with --drop)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=None,
+                            help='Months to create ahead of the current one (default CRM_AUDIT_PARTITIONS_AHEAD)')
+        parser.add_argument('--retain-months', type=int, default=None,
+                            help='Months of audit history to keep attached (default CRM_AUDIT_RETENTION_MONTHS)')
+        parser.add_argument('--drop', action='store_true', help='Drop expired partitions instead of archiving them')
+
+    def handle(self, *args, **options):
+        created = ensure_audit_partitions(months_ahead=options['ahead'])
+        detached = detach_audit_partitions(retain_months=options['retain_months'], drop=options['drop'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Audit partitions: {len(created)} created ({', '.join(created) or '-'}), "
+            f"{len(detached)} {'dropped' if options['drop'] else 'archived'} ({', '.join(detached) or '-'})."
+        ))
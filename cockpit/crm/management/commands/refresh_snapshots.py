@@ -1,11 +1,35 @@
+import time
 from django.core.management.base import BaseCommand
-from django.db import connection
+from crm.snapshots import refresh_snapshots
 
 
 class Command(BaseCommand):
-    help = 'Refresh materialized views (snapshots of current entities)'
+    help = ('Reconcile entity_current_snapshot with entity/detail rows changed since the last run '
+            '(skipped when nothing changed, coalesced while writes are arriving)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild every snapshot row')
+        parser.add_argument('--loop', action='store_true', help='Keep running every --interval seconds')
+        parser.add_argument('--interval', type=float, default=10, help='Seconds between runs with --loop')
 
     def handle(self, *args, **options):
-        with connection.cursor() as cursor:
-            cursor.exucate('REFRESH MATERIALIZED VIEW CONCURRENTLY entity_current_snapshot;')
-        self.stdout.write(self.style.SUCCESS('Materialized views refreshed.'))
\ No newline at end of file
+        force = options['force']
+        while True:
+            self.report(refresh_snapshots(force=force))
+            if not options['loop']:
+                return
+            force = False
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                return
+
+    def report(self, result):
+        if result['status'] != 'refreshed':
+            self.stdout.write(f"Snapshots {result['status']}, nothing to do.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshots refreshed: {result['entities_scanned']} entities scanned, "
+            f"{result['rows_changed']} rows changed in {result['duration_ms']:.1f} ms "
+            f"(high-water mark {result['high_water_mark']})."
+        ))
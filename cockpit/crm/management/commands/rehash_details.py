@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from crm.hashdiff import SCHEMES, default_scheme
+from crm.services import rehash_details
+
+
+class Command(BaseCommand):
+    help = 'Rewrite stored EntityDetail.hashdiff values under the current hashdiff scheme, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scheme', choices=sorted(SCHEMES), default=None,
+                            help='Target scheme (default: CRM_HASHDIFF_SCHEME)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per transaction')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        scheme = options['scheme'] or default_scheme()
+        rewritten = rehash_details(
+            scheme=scheme,
+            batch_size=options['batch_size'],
+            progress=self.report_progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f'{rewritten} detail hashdiffs rewritten as {scheme}.'))
+
+    def report_progress(self, scanned, rewritten):
+        self.stdout.write(f'  {scanned} rows scanned, {rewritten} rewritten')
@@ -0,0 +1,218 @@
+"""
+Per-view request instrumentation: latency, SQL query count, SQL time and the slowest statement.
+
+metrics_middleware samples requests at CRM_METRICS_SAMPLE_RATE. A sampled request gets a QueryStats
+in a context variable; record_query, installed as an execute_wrapper on every connection, adds each
+statement to it. Unsampled requests and code outside requests only pay a context variable lookup per
+query. Sampled crm views get a Server-Timing header and are added to the in-process registry that
+/metrics exposes in the Prometheus text format (each worker process reports its own requests) to
+CRM_METRICS_ALLOWED_IPS and staff users.
+"""
+import random
+import threading
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Statement text kept for the slowest query of a view; placeholders only, never parameters.
+SQL_PREVIEW_CHARS = 200
+
+_current = ContextVar('crm_query_stats', default=None)
+
+
+class QueryStats:
+    __slots__ = ('count', 'seconds', 'slowest', 'slowest_sql')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.slowest_sql = ''
+
+    def add(self, sql, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.slowest:
+            self.slowest, self.slowest_sql = seconds, sql
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # connection_created fires on every (re)connect of the same wrapper object.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class ViewMetrics:
+    __slots__ = ('requests', 'buckets', 'seconds', 'queries', 'sql_seconds', 'slowest', 'slowest_sql')
+
+    def __init__(self):
+        self.requests = {}
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slowest = 0.0
+        self.slowest_sql = ''
+
+
+class MetricsRegistry:
+    """Totals per view since the process started; observe() is called once per sampled request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def observe(self, view, method, status, seconds, stats):
+        with self._lock:
+            metrics = self._views.get(view)
+            if metrics is None:
+                metrics = self._views[view] = ViewMetrics()
+            key = (method, status)
+            metrics.requests[key] = metrics.requests.get(key, 0) + 1
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    metrics.buckets[i] += 1
+            metrics.seconds += seconds
+            metrics.queries += stats.count
+            metrics.sql_seconds += stats.seconds
+            if stats.slowest > metrics.slowest:
+                metrics.slowest, metrics.slowest_sql = stats.slowest, stats.slowest_sql
+
+    def render(self):
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                '# HELP crm_metrics_sample_rate Fraction of requests recorded below.',
+                '# TYPE crm_metrics_sample_rate gauge',
+                f'crm_metrics_sample_rate {sample_rate()}',
+                '# HELP crm_requests_total Sampled requests by view, method and status.',
+                '# TYPE crm_requests_total counter',
+            ]
+            for view, metrics in views:
+                for (method, status), count in sorted(metrics.requests.items()):
+                    lines.append(f'crm_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+            lines += [
+                '# HELP crm_request_duration_seconds Time to the response (first byte of streams) by view.',
+                '# TYPE crm_request_duration_seconds histogram',
+            ]
+            for view, metrics in views:
+                total = sum(metrics.requests.values())
+                for bound, count in zip(DURATION_BUCKETS, metrics.buckets):
+                    lines.append(f'crm_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'crm_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {total}')
+                lines.append(f'crm_request_duration_seconds_sum{{view="{view}"}} {metrics.seconds:.6f}')
+                lines.append(f'crm_request_duration_seconds_count{{view="{view}"}} {total}')
+            for name, kind, help_text, value in (
+                ('crm_db_queries_total', 'counter', 'SQL statements run by sampled requests.',
+                 lambda m: m.queries),
+                ('crm_db_query_seconds_total', 'counter', 'Time spent in SQL by sampled requests.',
+                 lambda m: f'{m.sql_seconds:.6f}'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{{view="{view}"}} {value(metrics)}' for view, metrics in views]
+            lines += [
+                '# HELP crm_db_slowest_query_seconds Slowest SQL statement of the view so far.',
+                '# TYPE crm_db_slowest_query_seconds gauge',
+            ]
+            for view, metrics in views:
+                if metrics.slowest_sql:
+                    sql = escape_label(' '.join(metrics.slowest_sql.split())[:SQL_PREVIEW_CHARS])
+                    lines.append(f'crm_db_slowest_query_seconds{{view="{view}",sql="{sql}"}} {metrics.slowest:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def sample_rate():
+    return getattr(settings, 'CRM_METRICS_SAMPLE_RATE', 1.0)
+
+
+def sampled():
+    rate = sample_rate()
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+def view_label(request):
+    """The crm view that served the request (class name for class-based views), or None for other apps."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    func = match.func
+    view = getattr(func, 'view_class', None) or getattr(func, 'cls', None) or func
+    if not view.__module__.startswith('crm.'):
+        return None
+    return view.__name__
+
+
+def finish(request, response, started, stats):
+    seconds = time.perf_counter() - started
+    view = view_label(request)
+    if view is None:
+        return response
+    registry.observe(view, request.method, response.status_code, seconds, stats)
+    response['Server-Timing'] = (
+        f'app;dur={seconds * 1000:.1f}, db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries", '
+        f'db-slowest;dur={stats.slowest * 1000:.1f}'
+    )
+    return response
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not sampled():
+                return await get_response(request)
+            stats = QueryStats()
+            token = _current.set(stats)
+            started = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            return finish(request, response, started, stats)
+    else:
+        def middleware(request):
+            if not sampled():
+                return get_response(request)
+            stats = QueryStats()
+            token = _current.set(stats)
+            started = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            return finish(request, response, started, stats)
+    return middleware
+
+
+def metrics_view(request):
+    # Statement text, timings and request volumes are internal: only for listed scrapers and staff.
+    allowed_ips = getattr(settings, 'CRM_METRICS_ALLOWED_IPS', ())
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_create_materialized_views'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['timestamp', 'id'], name='auditlog_timestamp_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['valid_from', 'id'], name='entity_valid_from_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(condition=models.Q(('is_current', True)), fields=['valid_from', 'id'], name='entity_current_keyset_idx'),
+        ),
+    ]
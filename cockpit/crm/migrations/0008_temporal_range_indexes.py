@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:42
+
+import crm.models
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='entity',
+            name='exclude_overlapping_entity_uid',
+        ),
+        migrations.RemoveConstraint(
+            model_name='entitydetail',
+            name='exclude_overlapping_detail_per_entity',
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=django.contrib.postgres.indexes.GistIndex(crm.models.TsTzRange('valid_from', 'valid_to', django.contrib.postgres.fields.ranges.RangeBoundary()), name='entity_valid_range_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='entitydetail',
+            index=django.contrib.postgres.indexes.GistIndex(crm.models.TsTzRange('valid_from', 'valid_to', django.contrib.postgres.fields.ranges.RangeBoundary()), name='entitydetail_valid_range_gist'),
+        ),
+        migrations.AddConstraint(
+            model_name='entity',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(expressions=[('entity_uid', '='), (crm.models.TsTzRange('valid_from', 'valid_to', django.contrib.postgres.fields.ranges.RangeBoundary()), '&&')], name='exclude_overlapping_entity_uid'),
+        ),
+        migrations.AddConstraint(
+            model_name='entitydetail',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(expressions=[('entity_uid', '='), ('detail_code', '='), (crm.models.TsTzRange('valid_from', 'valid_to', django.contrib.postgres.fields.ranges.RangeBoundary()), '&&')], name='exclude_overlapping_detail_per_entity'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:49
+
+import django.contrib.postgres.indexes
+import django.db.models.fields.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_temporal_range_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='entity',
+            name='entity_display_name_gin',
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=django.contrib.postgres.indexes.GinIndex(condition=models.Q(('is_current', True)), fields=['display_name'], name='entity_display_name_gin', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='entitydetail',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.fields.json.KeyTextTransform('value', 'value'), name='gin_trgm_ops'), condition=models.Q(('detail_code__in', ('NAME', 'FULL_NAME', 'FIRST_NAME', 'LAST_NAME', 'LEGAL_NAME', 'SHORT_NAME', 'ALIAS')), ('is_current', True)), name='entitydetail_name_value_trgm'),
+        ),
+    ]
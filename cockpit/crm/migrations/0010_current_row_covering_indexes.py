@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_trigram_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='entitydetail',
+            name='unique_current_detail',
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(condition=models.Q(('is_current', True)), fields=['entity_type', 'valid_from', 'id'], name='entity_current_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entitydetail',
+            index=models.Index(condition=models.Q(('is_current', True)), fields=['detail_code', 'entity_uid'], name='entitydetail_current_code_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='entitydetail',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_current', True)), fields=('entity_uid', 'detail_code'), include=('hashdiff',), name='unique_current_detail'),
+        ),
+    ]
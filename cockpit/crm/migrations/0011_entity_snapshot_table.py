@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CREATE_MATERIALIZED_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS entity_current_snapshot AS
+SELECT e.entity_uid,
+       e.display_name,
+       e.entity_type_id,
+       e.valid_from,
+       e.valid_to,
+       e.updated_at
+FROM crm_entity e
+WHERE e.is_current = TRUE;
+"""
+
+BACKFILL_SQL = """
+INSERT INTO entity_current_snapshot (entity_uid, entity_type_id, entity_type_code, display_name, valid_from, details, updated_at)
+SELECT e.entity_uid, e.entity_type_id, t.code, e.display_name, e.valid_from,
+       COALESCE((SELECT jsonb_object_agg(d.detail_code, d.value)
+                 FROM crm_entitydetail d
+                 WHERE d.entity_uid = e.entity_uid AND d.is_current), '{}'::jsonb),
+       now()
+FROM crm_entity e
+JOIN crm_entitytype t ON t.id = e.entity_type_id
+WHERE e.is_current;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_current_row_covering_indexes'),
+    ]
+
+    operations = [
+        # The materialized view is replaced by a table of the same name, so existing readers keep working.
+        migrations.RunSQL(
+            sql='DROP MATERIALIZED VIEW IF EXISTS entity_current_snapshot;',
+            reverse_sql=CREATE_MATERIALIZED_VIEW_SQL,
+        ),
+        migrations.CreateModel(
+            name='EntitySnapshot',
+            fields=[
+                ('entity_uid', models.UUIDField(primary_key=True, serialize=False)),
+                ('entity_type_code', models.CharField(max_length=50)),
+                ('display_name', models.TextField()),
+                ('valid_from', models.DateTimeField()),
+                ('details', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField()),
+                ('entity_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='crm.entitytype')),
+            ],
+            options={
+                'db_table': 'entity_current_snapshot',
+            },
+        ),
+        migrations.RunSQL(sql=BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0011_entity_snapshot_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotRefresh',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('high_water_mark', models.DateTimeField(blank=True, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('last_status', models.CharField(blank=True, max_length=20)),
+                ('last_duration_ms', models.FloatField(blank=True, null=True)),
+                ('last_entities_scanned', models.IntegerField(default=0)),
+                ('last_rows_changed', models.IntegerField(default=0)),
+                ('refresh_count', models.IntegerField(default=0)),
+                ('skip_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['updated_at'], name='entity_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entitydetail',
+            index=models.Index(fields=['updated_at'], name='entitydetail_updated_at_idx'),
+        ),
+    ]
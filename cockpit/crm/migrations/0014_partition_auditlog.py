@@ -0,0 +1,82 @@
+from django.db import migrations
+
+COLUMNS = 'id, actor, action, entity_uid, detail_code, before, after, timestamp'
+
+# crm_auditlog becomes a table partitioned by month on timestamp. A primary key on a partitioned table
+# must include the partition key, so it is (id, timestamp); id stays unique through its sequence.
+# Identity columns cannot be used on partitioned tables before PostgreSQL 17, hence a plain sequence.
+PARTITION_SQL = f"""
+CREATE TABLE crm_auditlog_partitioned (
+    id bigint NOT NULL,
+    actor varchar(200) NULL,
+    action varchar(50) NOT NULL,
+    entity_uid uuid NULL,
+    detail_code varchar(100) NULL,
+    before jsonb NULL,
+    after jsonb NULL,
+    timestamp timestamp with time zone NOT NULL,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE crm_auditlog_default PARTITION OF crm_auditlog_partitioned DEFAULT;
+
+DO $$
+DECLARE
+    month timestamp := date_trunc('month', coalesce((SELECT min(timestamp) FROM crm_auditlog), now()) AT TIME ZONE 'UTC');
+    last timestamp := date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months';
+BEGIN
+    WHILE month <= last LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF crm_auditlog_partitioned FOR VALUES FROM (%L) TO (%L)',
+            'crm_auditlog_p' || to_char(month, 'YYYY_MM'),
+            month AT TIME ZONE 'UTC', (month + interval '1 month') AT TIME ZONE 'UTC'
+        );
+        month := month + interval '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO crm_auditlog_partitioned ({COLUMNS}) SELECT {COLUMNS} FROM crm_auditlog;
+DROP TABLE crm_auditlog;
+ALTER TABLE crm_auditlog_partitioned RENAME TO crm_auditlog;
+ALTER INDEX crm_auditlog_partitioned_pkey RENAME TO crm_auditlog_pkey;
+
+CREATE SEQUENCE crm_auditlog_id_seq OWNED BY crm_auditlog.id;
+SELECT setval('crm_auditlog_id_seq', coalesce((SELECT max(id) FROM crm_auditlog), 0) + 1, false);
+ALTER TABLE crm_auditlog ALTER COLUMN id SET DEFAULT nextval('crm_auditlog_id_seq');
+
+CREATE INDEX crm_auditlog_entity_uid_56f6fd86 ON crm_auditlog (entity_uid);
+CREATE INDEX auditlog_timestamp_id_idx ON crm_auditlog (timestamp, id);
+"""
+
+UNPARTITION_SQL = f"""
+CREATE TABLE crm_auditlog_plain (
+    id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+    actor varchar(200) NULL,
+    action varchar(50) NOT NULL,
+    entity_uid uuid NULL,
+    detail_code varchar(100) NULL,
+    before jsonb NULL,
+    after jsonb NULL,
+    timestamp timestamp with time zone NOT NULL
+);
+INSERT INTO crm_auditlog_plain ({COLUMNS}) SELECT {COLUMNS} FROM crm_auditlog;
+DROP TABLE crm_auditlog;
+ALTER TABLE crm_auditlog_plain RENAME TO crm_auditlog;
+ALTER INDEX crm_auditlog_plain_pkey RENAME TO crm_auditlog_pkey;
+ALTER SEQUENCE crm_auditlog_plain_id_seq RENAME TO crm_auditlog_id_seq;
+SELECT setval('crm_auditlog_id_seq', coalesce((SELECT max(id) FROM crm_auditlog), 0) + 1, false);
+
+CREATE INDEX crm_auditlog_entity_uid_56f6fd86 ON crm_auditlog (entity_uid);
+CREATE INDEX auditlog_timestamp_id_idx ON crm_auditlog (timestamp, id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0013_audit_spool'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_SQL, UNPARTITION_SQL),
+    ]
@@ -0,0 +1,54 @@
+import crm.models
+from django.db import migrations, models
+
+# Rows written before the feed existed get txid 0, so they come first, in id order. Adding the column
+# with a constant default does not rewrite the table; the real default is set afterwards.
+ADD_TXID_SQL = """
+ALTER TABLE crm_auditlog ADD COLUMN txid bigint NOT NULL DEFAULT 0;
+ALTER TABLE crm_auditlog ALTER COLUMN txid SET DEFAULT pg_current_xact_id()::text::bigint;
+"""
+
+# Wakes /changes long-polls. NOTIFY is delivered when the transaction commits (and dropped on rollback),
+# once per transaction, however many statements inserted audit rows.
+NOTIFY_TRIGGER_SQL = """
+CREATE FUNCTION crm_auditlog_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM new_rows) THEN
+        PERFORM pg_notify('crm_changes', '');
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE TRIGGER crm_auditlog_notify AFTER INSERT ON crm_auditlog
+REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION crm_auditlog_notify();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0015_auditlog_diff_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='auditlog',
+                    name='txid',
+                    field=models.BigIntegerField(db_default=crm.models.CurrentTxid(), editable=False),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(ADD_TXID_SQL, 'ALTER TABLE crm_auditlog DROP COLUMN txid;'),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['txid', 'id'], name='auditlog_txid_id_idx'),
+        ),
+        migrations.RunSQL(
+            NOTIFY_TRIGGER_SQL,
+            'DROP TRIGGER crm_auditlog_notify ON crm_auditlog; DROP FUNCTION crm_auditlog_notify();',
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0016_auditlog_txid'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='entitydetail',
+            name='unique_current_detail',
+        ),
+        migrations.AddConstraint(
+            model_name='entitydetail',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_current', True)), fields=('entity_uid', 'detail_code'), include=('hashdiff', 'id'), name='unique_current_detail'),
+        ),
+    ]
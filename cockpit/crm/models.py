@@ -1,12 +1,24 @@
 import uuid
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils import timezone
 from django.db.models import Q, Func
+from django.db.models.fields.json import KeyTextTransform
+from django.contrib.postgres.indexes import OpClass
 from django.contrib.postgres.fields import DateTimeRangeField
 from django.contrib.postgres.fields import RangeBoundary
 from django.contrib.postgres.constraints import ExclusionConstraint
 from django.contrib.postgres.fields import RangeOperators
-from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+
+
+# Detail codes whose value is a name; their current values are trigram-indexed for search.
+NAME_DETAIL_CODES = ('NAME', 'FULL_NAME', 'FIRST_NAME', 'LAST_NAME', 'LEGAL_NAME', 'SHORT_NAME', 'ALIAS')
+
+
+def detail_text_value():
+    return KeyTextTransform('value', 'value')
 
 
 class TsTzRange(Func):
@@ -14,6 +26,25 @@ class TsTzRange(Func):
     output_field = DateTimeRangeField()
 
 
+class CurrentTxid(Func):
+    # 64-bit id of the writing transaction (xid8, never wraps around) as a bigint.
+    template = 'pg_current_xact_id()::text::bigint'
+    output_field = models.BigIntegerField()
+
+
+class VersionQuerySet(models.QuerySet):
+    # Same expression as the exclusion constraints, so the filters below can use their GiST indexes.
+    def with_valid_range(self):
+        return self.alias(valid_range=TsTzRange('valid_from', 'valid_to', RangeBoundary()))
+
+    def as_of(self, ts):
+        # The redundant valid_from bound gives the planner a btree path for "latest versions first" pages.
+        return self.with_valid_range().filter(valid_range__contains=ts, valid_from__lte=ts)
+
+    def overlapping(self, start=None, end=None):
+        return self.with_valid_range().filter(valid_range__overlap=DateTimeTZRange(start, end))
+
+
 class EntityType(models.Model):
     code = models.CharField(max_length=50, unique=True)
     name = models.CharField(max_length=200, blank=True)
@@ -35,18 +66,30 @@ class Entity(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = VersionQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=['entity_uid']),
-            GinIndex(fields=['display_name'], name='entity_display_name_gin', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['display_name'], name='entity_display_name_gin', opclasses=['gin_trgm_ops'],
+                     condition=Q(is_current=True)),
+            models.Index(fields=['valid_from', 'id'], name='entity_valid_from_id_idx'),
+            models.Index(fields=['valid_from', 'id'], condition=Q(is_current=True), name='entity_current_keyset_idx'),
+            GistIndex(TsTzRange('valid_from', 'valid_to', RangeBoundary()), name='entity_valid_range_gist'),
+            models.Index(fields=['updated_at'], name='entity_updated_at_idx'),
+            # ?type= list pages: one index range per type in keyset order, history rows excluded.
+            models.Index(fields=['entity_type', 'valid_from', 'id'], condition=Q(is_current=True),
+                         name='entity_current_type_idx'),
         ]
         constraints = [
             models.UniqueConstraint(fields=['entity_uid'], condition=Q(is_current=True), name='unique_current_entity'),
+            # entity_uid leads so each constraint check is a point lookup rather than a scan
+            # of every version overlapping in time; as-of queries use entity_valid_range_gist.
             ExclusionConstraint(
                 name='exclude_overlapping_entity_uid',
                 expressions=[
-                    (TsTzRange('valid_from', 'valid_to', RangeBoundary()), RangeOperators.OVERLAPS),
                     ('entity_uid', RangeOperators.EQUAL),
+                    (TsTzRange('valid_from', 'valid_to', RangeBoundary()), RangeOperators.OVERLAPS),
                 ],
             ),
         ]
@@ -66,15 +109,32 @@ class EntityDetail(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = VersionQuerySet.as_manager()
+
     class Meta:
+        indexes = [
+            GistIndex(TsTzRange('valid_from', 'valid_to', RangeBoundary()), name='entitydetail_valid_range_gist'),
+            GinIndex(
+                OpClass(detail_text_value(), name='gin_trgm_ops'),
+                condition=Q(is_current=True, detail_code__in=NAME_DETAIL_CODES),
+                name='entitydetail_name_value_trgm',
+            ),
+            models.Index(fields=['updated_at'], name='entitydetail_updated_at_idx'),
+            # ?detail_code= semi-join reads entity_uid straight from the index.
+            models.Index(fields=['detail_code', 'entity_uid'], condition=Q(is_current=True),
+                         name='entitydetail_current_code_idx'),
+        ]
         constraints = [
-            models.UniqueConstraint(fields=['entity_uid', 'detail_code'], condition=Q(is_current=True), name='unique_current_detail'),
+            # hashdiff and id are included: upserts compare and close current versions from an index-only scan.
+            # value is left out: jsonb values can exceed the btree tuple size limit.
+            models.UniqueConstraint(fields=['entity_uid', 'detail_code'], condition=Q(is_current=True),
+                                    include=['hashdiff', 'id'], name='unique_current_detail'),
             ExclusionConstraint(
                 name='exclude_overlapping_detail_per_entity',
                 expressions=[
-                    (TsTzRange('valid_from', 'valid_to', RangeBoundary()), RangeOperators.OVERLAPS),
                     ('entity_uid', RangeOperators.EQUAL),
                     ('detail_code', RangeOperators.EQUAL),
+                    (TsTzRange('valid_from', 'valid_to', RangeBoundary()), RangeOperators.OVERLAPS),
                 ],
             ),
         ]
@@ -83,14 +143,78 @@ class EntityDetail(models.Model):
         return f"{self.entity_uid} {self.detail_code} -> {self.value}"
 
 
+class EntitySnapshot(models.Model):
+    """
+    Current state of each entity with its type code and current details ({detail_code: value}),
+    kept up to date by the SCD2 services (services.sync_snapshots) in the writing transaction.
+    """
+    entity_uid = models.UUIDField(primary_key=True)
+    entity_type = models.ForeignKey(EntityType, on_delete=models.PROTECT, related_name='+')
+    entity_type_code = models.CharField(max_length=50)
+    display_name = models.TextField()
+    valid_from = models.DateTimeField()
+    details = models.JSONField(default=dict)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'entity_current_snapshot'
+
+    def __str__(self):
+        return f"{self.display_name} ({self.entity_uid})"
+
+
+class SnapshotRefresh(models.Model):
+    """High-water mark and metrics of the scheduled snapshot reconciliation (one row per snapshot table)."""
+    name = models.CharField(max_length=100, primary_key=True)
+    high_water_mark = models.DateTimeField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_status = models.CharField(max_length=20, blank=True)
+    last_duration_ms = models.FloatField(null=True, blank=True)
+    last_entities_scanned = models.IntegerField(default=0)
+    last_rows_changed = models.IntegerField(default=0)
+    refresh_count = models.IntegerField(default=0)
+    skip_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} @ {self.high_water_mark}"
+
+
 class AuditLog(models.Model):
+    """
+    Partitioned by month on timestamp (migration 0014, crm.partitions); the table's primary key is
+    (id, timestamp), id alone stays unique through its sequence. Filter on timestamp to prune partitions.
+    """
     actor = models.CharField(max_length=200, null=True, blank=True)
     action = models.CharField(max_length=50)
-    entity_uid = models.UUIDField(null=True, db_index=True)
+    entity_uid = models.UUIDField(null=True)
     detail_code = models.CharField(max_length=100, null=True, blank=True)
     before = models.JSONField(null=True, blank=True)
     after = models.JSONField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Change feed position (crm.changes): rows of one transaction share a txid and appear together.
+    txid = models.BigIntegerField(db_default=CurrentTxid(), editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='auditlog_timestamp_id_idx'),
+            models.Index(fields=['txid', 'id'], name='auditlog_txid_id_idx'),
+            # DiffView filters: action within a time range, and one entity's changes (also plain entity_uid lookups).
+            models.Index(fields=['timestamp', 'action'], name='auditlog_timestamp_action_idx'),
+            models.Index(fields=['entity_uid', 'timestamp'], name='auditlog_entity_uid_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.timestamp} {self.action} {self.entity_uid}"
+
+
+class AuditSpool(models.Model):
+    """
+    Opt-in durable queue for audit rows (CRM_AUDIT_MODE = 'spool'): one row per transaction holding
+    its AuditLog entries as a JSON list, written in that transaction and moved into AuditLog by
+    drain_audit_spool.
+    """
+    entries = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.timestamp} {self.action} {self.entity_uid}"
\ No newline at end of file
+        return f"{self.created_at} ({len(self.entries)} entries)"
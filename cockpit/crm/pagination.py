@@ -0,0 +1,137 @@
+import base64
+import json
+import uuid
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique (column, id) ordering, ascending or descending
+    ('-column', '-id'). The cursor holds the last row's key, so every page is an
+    index range scan regardless of depth.
+    """
+    ordering = ('valid_from', 'id')
+    page_size = api_settings.PAGE_SIZE or 100
+    max_page_size = 1000
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(list(self.page_queryset(queryset, request)))
+
+    def page_queryset(self, queryset, request):
+        # The page's query, unevaluated (async views iterate it themselves); pass its rows to finish_page().
+        self.request = request
+        self.limit = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            column, tiebreaker = (field.lstrip('-') for field in self.ordering)
+            op = 'lt' if self.ordering[0].startswith('-') else 'gt'
+            value, last_id = position
+            # The plain bound (>= or <=) is what lets the planner start the index scan at the cursor.
+            try:
+                queryset = queryset.filter(**{f'{column}__{op}e': value}).filter(
+                    Q(**{f'{column}__{op}': value}) | Q(**{f'{tiebreaker}__{op}': last_id})
+                )
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.limit + 1]
+
+    def finish_page(self, page):
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        self.next_position = self.get_position(page[-1]) if self.has_next else None
+        return page
+
+    def get_page_size(self, request):
+        try:
+            limit = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(limit, self.max_page_size))
+
+    def get_position(self, item):
+        fields = [field.lstrip('-') for field in self.ordering]
+        if isinstance(item, dict):
+            return [item[field] for field in fields]
+        return [getattr(item, field) for field in fields]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            value, last_id = position
+            return value, int(last_id)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        # isoformat() keeps microseconds; DjangoJSONEncoder would truncate them and repeat rows.
+        raw = json.dumps(position, default=lambda value: value.isoformat()).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SummaryPagination(KeysetPagination):
+    """
+    Keyset pagination of rows keyed by (entity_uid, detail_code), fetched with fetch(after, limit),
+    where after is the last row's key or None; detail_code may be null.
+    """
+    ordering = ('entity_uid', 'detail_code')
+
+    def paginate_rows(self, fetch, request):
+        self.request = request
+        self.limit = self.get_page_size(request)
+        page = fetch(self.decode_cursor(request), self.limit + 1)
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        self.next_position = self.get_position(page[-1]) if self.has_next else None
+        return page
+
+    def get_position(self, item):
+        return [str(item['entity_uid']), item['detail_code']]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            uid, code = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if code is not None and not isinstance(code, str):
+                raise ValueError(code)
+            return uuid.UUID(uid), code
+        except (TypeError, ValueError, UnicodeError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,26 @@
+import codecs
+import json
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    One JSON value per line, parsed lazily as the body is read. A line that is not valid JSON becomes
+    a ParseError in its place instead of failing the whole request, so it can be reported per item.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding') or 'utf-8'
+        return self.iter_items(codecs.getreader(encoding)(stream))
+
+    def iter_items(self, lines):
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield ParseError(f'Line {number}: {exc}')
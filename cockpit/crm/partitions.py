@@ -0,0 +1,106 @@
+import datetime
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+AUDIT_TABLE = 'crm_auditlog'
+AUDIT_DEFAULT_PARTITION = 'crm_auditlog_default'
+# Detached partitions are moved here, out of the application's way, for pg_dump -n or a later DROP.
+AUDIT_ARCHIVE_SCHEMA = 'crm_audit_archive'
+PARTITION_NAME = re.compile(r'^crm_auditlog_p(\d{4})_(\d{2})$')
+
+
+def month_start(value):
+    """First instant (UTC) of the month containing value."""
+    value = timezone.localtime(value, datetime.timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f'{AUDIT_TABLE}_p{month:%Y_%m}'
+
+
+def audit_partitions():
+    """{month start: partition name} of the monthly partitions currently attached to crm_auditlog."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+        """, [AUDIT_TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    months = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months[datetime.datetime(int(match[1]), int(match[2]), 1, tzinfo=datetime.timezone.utc)] = name
+    return months
+
+
+def _literal(month):
+    return f"'{month.isoformat()}'"
+
+
+@transaction.atomic
+def ensure_audit_partitions(months_ahead=None, now=None):
+    """
+    Create the monthly partitions from the current month to months_ahead months ahead (default
+    CRM_AUDIT_PARTITIONS_AHEAD). Rows that landed in the default partition for one of those months
+    are moved into the new partition before it is attached. Returns the names of created partitions.
+    """
+    if months_ahead is None:
+        months_ahead = getattr(settings, 'CRM_AUDIT_PARTITIONS_AHEAD', 3)
+    current = month_start(now or timezone.now())
+    existing = audit_partitions()
+    created = []
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if month in existing:
+                continue
+            name, start, end = partition_name(month), _literal(month), _literal(add_months(month, 1))
+            # Filled and attached rather than CREATE ... PARTITION OF: ATTACH does not block writers
+            # on the parent, and the partition's own rows are checked against its bounds only once.
+            cursor.execute(f'CREATE TABLE "{name}" (LIKE "{AUDIT_TABLE}" INCLUDING DEFAULTS)')
+            cursor.execute(f"""
+                WITH moved AS (
+                    DELETE FROM "{AUDIT_DEFAULT_PARTITION}" WHERE timestamp >= {start} AND timestamp < {end}
+                    RETURNING *
+                )
+                INSERT INTO "{name}" SELECT * FROM moved
+            """)
+            cursor.execute(f'ALTER TABLE "{AUDIT_TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM ({start}) TO ({end})')
+            created.append(name)
+    return created
+
+
+@transaction.atomic
+def detach_audit_partitions(retain_months=None, now=None, drop=False):
+    """
+    Detach the monthly partitions that end more than retain_months months before the current month
+    (default CRM_AUDIT_RETENTION_MONTHS; None keeps everything). Detached partitions are moved to the
+    crm_audit_archive schema, or dropped with drop=True. Returns the names of detached partitions.
+    """
+    if retain_months is None:
+        retain_months = getattr(settings, 'CRM_AUDIT_RETENTION_MONTHS', None)
+    if retain_months is None:
+        return []
+    cutoff = add_months(month_start(now or timezone.now()), -retain_months)
+    detached = []
+    with connection.cursor() as cursor:
+        for month, name in sorted(audit_partitions().items()):
+            if month >= cutoff:
+                break
+            cursor.execute(f'ALTER TABLE "{AUDIT_TABLE}" DETACH PARTITION "{name}"')
+            if drop:
+                cursor.execute(f'DROP TABLE "{name}"')
+            else:
+                cursor.execute(f'CREATE SCHEMA IF NOT EXISTS "{AUDIT_ARCHIVE_SCHEMA}"')
+                cursor.execute(f'ALTER TABLE "{name}" SET SCHEMA "{AUDIT_ARCHIVE_SCHEMA}"')
+            detached.append(name)
+    return detached
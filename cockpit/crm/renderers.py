@@ -0,0 +1,29 @@
+import itertools
+import json
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only non-streamed responses (errors) get here; streamed bodies go through stream_ndjson.
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return b''.join(json.dumps(row, cls=JSONEncoder).encode('utf-8') + b'\n' for row in rows)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def stream_ndjson(rows):
+    lines = (json.dumps(row, cls=JSONEncoder) + '\n' for row in rows)
+    return StreamingHttpResponse(lines, content_type=NDJSONRenderer.media_type)
@@ -0,0 +1,44 @@
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, transaction
+from crm.models import Entity, EntityDetail, NAME_DETAIL_CODES, detail_text_value
+
+
+def search_entities(query, threshold=0.3, limit=20, include_details=True):
+    """
+    Fuzzy search over current entities ranked by trigram similarity.
+
+    Matches go through the `%` operator so the partial gin_trgm_ops indexes on
+    display_name and on name-typed detail values do the filtering; an entity's
+    score is its best match. Returns [(entity, similarity)] best first.
+    """
+    scores = {}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)", [str(threshold)])
+
+        name_hits = (
+            Entity.objects.filter(is_current=True, display_name__trigram_similar=query)
+            .annotate(similarity=TrigramSimilarity('display_name', query))
+            .order_by('-similarity')
+            .values_list('entity_uid', 'similarity')[:limit]
+        )
+        scores.update(name_hits)
+
+        if include_details:
+            detail_hits = (
+                EntityDetail.objects.filter(is_current=True, detail_code__in=NAME_DETAIL_CODES)
+                .alias(name=detail_text_value())
+                .filter(name__trigram_similar=query)
+                .annotate(similarity=TrigramSimilarity(detail_text_value(), query))
+                .order_by('-similarity')
+                .values_list('entity_uid', 'similarity')[:limit]
+            )
+            for uid, similarity in detail_hits:
+                scores[uid] = max(scores.get(uid, 0), similarity)
+
+    top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    entities = {
+        e.entity_uid: e
+        for e in Entity.objects.filter(is_current=True, entity_uid__in=[uid for uid, _ in top])
+    }
+    return [(entities[uid], similarity) for uid, similarity in top if uid in entities]
@@ -1,5 +1,9 @@
+import uuid
+from django.db import models
 from rest_framework import serializers
 from .models import Entity, EntityDetail, EntityType
+from .entity_types import entity_types
+from .services import load_details_by_uid
 
 
 class EntityTypeSerializer(serializers.ModelSerializer):
@@ -14,14 +18,61 @@ class EntityDetailSerializer(serializers.ModelSerializer):
         fields = ['detail_code', 'value', 'valid_from', 'valid_to', 'is_current']
 
 
+class EntityTypeCodeField(serializers.Field):
+    """EntityType as its code, resolved through the in-process registry instead of a query or join per row."""
+    default_error_messages = {'does_not_exist': 'Entity type "{code}" does not exist.'}
+
+    def get_attribute(self, instance):
+        return instance.entity_type_id
+
+    def to_representation(self, value):
+        return entity_types.get_by_id(value).code
+
+    def to_internal_value(self, data):
+        entity_type = entity_types.get_by_code(data)
+        if entity_type is None:
+            self.fail('does_not_exist', code=data)
+        return entity_type
+
+
+class EntityListSerializer(serializers.ListSerializer):
+    # Loads the details of the whole page in one query and hands them to the child via context.
+    # With an 'as_of' context the detail versions valid at that time are loaded instead of the current ones.
+    def to_representation(self, data):
+        entities = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if 'details_by_uid' not in self.context:
+            self.context['details_by_uid'] = load_details_by_uid(
+                [e.entity_uid for e in entities], as_of=self.context.get('as_of'),
+            )
+        return super().to_representation(entities)
+
+
 class EntitySerializer(serializers.ModelSerializer):
     details = serializers.SerializerMethodField()
-    entity_type = serializers.SlugRelatedField(slug_field='code', queryset=EntityType.objects.all())
+    entity_type = EntityTypeCodeField()
 
     class Meta:
         model = Entity
         fields = ['entity_uid', 'entity_type', 'display_name', 'valid_from', 'valid_to', 'is_current', 'details']
+        list_serializer_class = EntityListSerializer
 
     def get_details(self, obj):
-        qs = EntityDetail.objects.filter(entity_uid=obj.entity_uid, is_current=True)
-        return EntityDetailSerializer(qs, many=True).data
+        details_by_uid = self.context.get('details_by_uid')
+        if details_by_uid is None:
+            details = load_details_by_uid([obj.entity_uid], as_of=self.context.get('as_of')).get(obj.entity_uid, [])
+        else:
+            details = details_by_uid.get(obj.entity_uid, [])
+        return EntityDetailSerializer(details, many=True).data
+
+
+class DetailInputSerializer(serializers.Serializer):
+    detail_code = serializers.CharField(max_length=100)
+    value = serializers.JSONField()
+
+
+class EntityInputSerializer(serializers.Serializer):
+    """One entity of a bulk write, validated into the record shape scd2_bulk_upsert() takes."""
+    entity_uid = serializers.UUIDField(default=uuid.uuid4)
+    entity_type = serializers.CharField(max_length=50)
+    display_name = serializers.CharField()
+    details = DetailInputSerializer(many=True, default=list)
@@ -1,23 +1,44 @@
-import hashlib
-from django.db import transaction, connection
+import uuid
+from django.db import DataError, IntegrityError, transaction, connection
 from django.utils import timezone
-from crm.models import Entity, EntityDetail, EntityType, AuditLog
+from crm.audit import audit_writer
+from crm.entity_cache import invalidate_entities
+from crm.entity_types import entity_types
+from crm.locking import lock_entities
+from crm.hashdiff import SCHEMES, default_scheme, hashdiff, hashdiff_many, hashdiff_matches, scheme_of
+from crm.models import Entity, EntityDetail, AuditLog
 
 
-def compute_hashdiff(value: dict) -> str:
-    if isinstance(value, dict):
-        raw = str(sorted(value.items())).encode('utf-8')
-    else:
-        raw = str(value).encode('utf-8')
-    return hashlib.sha256(raw).hexdigest()
+def compute_hashdiff(value) -> str:
+    return hashdiff(value)
+
+
+def detail_business_value(value):
+    return value.get('value') if isinstance(value, dict) and 'value' in value else value
+
+
+def detail_hashdiff(value) -> str:
+    return hashdiff(detail_business_value(value))
+
+
+def detail_hashdiffs(values, scheme=None):
+    return hashdiff_many((detail_business_value(value) for value in values), scheme)
+
+
+def detail_unchanged(stored, new_hash, value) -> bool:
+    # Hashes written under another scheme (e.g. before rehash_details) are recomputed under theirs.
+    if stored == new_hash:
+        return True
+    return scheme_of(stored) != scheme_of(new_hash) and hashdiff_matches(stored, detail_business_value(value))
 
 
 @transaction.atomic
+@audit_writer.batched
 def scd2_upsert_entity(entity_uid, entity_type_code, display_name, details=None, actor="system", change_ts=None):
+    et = entity_types.ensure([entity_type_code])[entity_type_code]
+    locked_at = lock_entities([entity_uid])
     if change_ts is None:
-        change_ts = timezone.now()
-
-    et, _ = EntityType.objects.get_or_create(code=entity_type_code)
+        change_ts = locked_at
     current = Entity.objects.filter(entity_uid=entity_uid, is_current=True).first()
 
     new_hash = compute_hashdiff({
@@ -33,18 +54,18 @@ def scd2_upsert_entity(entity_uid, entity_type_code, display_name, details=None,
             valid_from=change_ts,
             is_current=True,
         )
-        AuditLog.objects.create(
+        audit_writer.add(AuditLog(
             actor=actor,
             action="INSERT_ENTITY",
             entity_uid=entity_uid,
             before=None,
             after={"display_name": display_name, "entity_type": entity_type_code},
-        )
+        ))
 
     else:
         old_hash = compute_hashdiff({
             "display_name": current.display_name,
-            "entity_type": current.entity_type.code,
+            "entity_type": entity_types.get_by_id(current.entity_type_id).code,
         })
 
         if new_hash == old_hash:
@@ -62,34 +83,48 @@ def scd2_upsert_entity(entity_uid, entity_type_code, display_name, details=None,
                 is_current=True,
             )
 
-            AuditLog.objects.create(
+            audit_writer.add(AuditLog(
                 actor=actor,
                 action="UPDATE_ENTITY",
                 entity_uid=entity_uid,
                 before={"display_name": current.display_name},
                 after={"display_name": display_name},
-            )
+            ))
 
+    changed = entity is not current
     if details:
         for d in details:
-            scd2_upsert_detail(
+            _, wrote = _upsert_detail(
                 entity_uid=entity.entity_uid,
                 detail_code=d["detail_code"],
                 value=d["value"],
                 actor=actor,
                 change_ts=change_ts,
             )
+            changed = changed or wrote
 
+    # A no-op write leaves the snapshot row and the cached reads alone.
+    if changed:
+        entities_changed([entity.entity_uid])
     return entity
 
 
 @transaction.atomic
+@audit_writer.batched
 def scd2_upsert_detail(entity_uid, detail_code, value, actor="system", change_ts=None):
+    locked_at = lock_entities([entity_uid])
     if change_ts is None:
-        change_ts = timezone.now()
+        change_ts = locked_at
 
-    business_value = value.get('value') if isinstance(value, dict) and 'value' in value else value
-    hashdiff = compute_hashdiff(business_value)
+    detail, wrote = _upsert_detail(entity_uid, detail_code, value, actor, change_ts)
+    if wrote:
+        entities_changed([entity_uid])
+    return detail
+
+
+def _upsert_detail(entity_uid, detail_code, value, actor, change_ts):
+    # Returns (current detail, whether a new version was written).
+    new_hash = detail_hashdiff(value)
     current = EntityDetail.objects.filter(
         entity_uid=entity_uid,
         detail_code=detail_code,
@@ -97,8 +132,8 @@ def scd2_upsert_detail(entity_uid, detail_code, value, actor="system", change_ts
     ).first()
 
     if current:
-        if current.hashdiff == hashdiff:
-            return current
+        if detail_unchanged(current.hashdiff, new_hash, value):
+            return current, False
 
         current.is_current = False
         current.valid_to = change_ts
@@ -111,21 +146,21 @@ def scd2_upsert_detail(entity_uid, detail_code, value, actor="system", change_ts
             entity_uid=entity_uid,
             detail_code=detail_code,
             value=value,
-            hashdiff=hashdiff,
+            hashdiff=new_hash,
             valid_from=change_ts,
             is_current=True,
         )
 
-        AuditLog.objects.create(
+        audit_writer.add(AuditLog(
             actor=actor,
             action=action,
             entity_uid=entity_uid,
             detail_code=detail_code,
             before=before_val,
             after=value,
-        )
+        ))
 
-        return detail
+        return detail, True
     else:
         action = 'INSERT_DETAIL'
         before_val = None
@@ -134,26 +169,322 @@ def scd2_upsert_detail(entity_uid, detail_code, value, actor="system", change_ts
             entity_uid=entity_uid,
             detail_code=detail_code,
             value=value,
-            hashdiff=hashdiff,
+            hashdiff=new_hash,
             valid_from=change_ts,
             is_current=True,
         )
 
-        AuditLog.objects.create(
+        audit_writer.add(AuditLog(
             actor=actor,
             action=action,
             entity_uid=entity_uid,
             detail_code=detail_code,
             before=before_val,
             after=value,
+        ))
+
+        return detail, True
+
+
+def fold_records(records):
+    # Later records for the same entity_uid supersede earlier ones, details are merged by detail_code.
+    folded = {}
+    for rec in records:
+        uid = rec["entity_uid"]
+        uid = uid if isinstance(uid, uuid.UUID) else uuid.UUID(str(uid))
+        item = folded.setdefault(uid, {"details": {}})
+        item["entity_type"] = rec["entity_type"]
+        item["display_name"] = rec["display_name"]
+        for d in rec.get("details") or []:
+            item["details"][d["detail_code"]] = d["value"]
+    return folded
+
+
+@transaction.atomic
+@audit_writer.batched
+def scd2_bulk_upsert(records, change_ts=None, actor="system", batch_size=1000):
+    """
+    Set-based variant of scd2_upsert_entity for a batch of records
+    ({"entity_uid", "entity_type", "display_name", "details": [{"detail_code", "value"}]}).
+
+    Returns {entity_uid: "inserted" | "updated" | "unchanged"}.
+    """
+    folded = fold_records(records)
+    if not folded:
+        return {}
+    uids = list(folded)
+
+    types = entity_types.ensure(item["entity_type"] for item in folded.values())
+    locked_at = lock_entities(uids)
+    if change_ts is None:
+        change_ts = locked_at
+
+    current_entities = {
+        e.entity_uid: e
+        for e in Entity.objects.filter(entity_uid__in=uids, is_current=True)
+    }
+    # (pk, hashdiff) only, so the comparison is an index-only scan of unique_current_detail;
+    # values are fetched afterwards for the versions that actually change.
+    current_details = {
+        (uid, detail_code): (pk, hashdiff)
+        for uid, detail_code, pk, hashdiff in EntityDetail.objects.filter(
+            entity_uid__in=uids, is_current=True
+        ).values_list("entity_uid", "detail_code", "pk", "hashdiff")
+    }
+
+    detail_keys = [(uid, code) for uid, item in folded.items() for code in item["details"]]
+    new_hashes = dict(zip(detail_keys, detail_hashdiffs(folded[uid]["details"][code] for uid, code in detail_keys)))
+
+    result = {}
+    close_entity_ids, new_entities = [], []
+    close_detail_ids, new_details = [], []
+    audit, detail_updates = [], []
+
+    for uid, item in folded.items():
+        entity_type_code = item["entity_type"]
+        display_name = item["display_name"]
+        current = current_entities.get(uid)
+
+        if not current:
+            result[uid] = "inserted"
+            new_entities.append(Entity(
+                entity_uid=uid,
+                entity_type=types[entity_type_code],
+                display_name=display_name,
+                valid_from=change_ts,
+                is_current=True,
+            ))
+            audit.append(AuditLog(
+                actor=actor,
+                action="INSERT_ENTITY",
+                entity_uid=uid,
+                before=None,
+                after={"display_name": display_name, "entity_type": entity_type_code},
+            ))
+        else:
+            result[uid] = "unchanged"
+            new_hash = compute_hashdiff({"display_name": display_name, "entity_type": entity_type_code})
+            old_hash = compute_hashdiff({
+                "display_name": current.display_name,
+                "entity_type": entity_types.get_by_id(current.entity_type_id).code,
+            })
+            if new_hash != old_hash:
+                result[uid] = "updated"
+                close_entity_ids.append(current.pk)
+                new_entities.append(Entity(
+                    entity_uid=uid,
+                    entity_type=types[entity_type_code],
+                    display_name=display_name,
+                    valid_from=change_ts,
+                    is_current=True,
+                ))
+                audit.append(AuditLog(
+                    actor=actor,
+                    action="UPDATE_ENTITY",
+                    entity_uid=uid,
+                    before={"display_name": current.display_name},
+                    after={"display_name": display_name},
+                ))
+
+        for detail_code, value in item["details"].items():
+            new_hash = new_hashes[uid, detail_code]
+            current_detail = current_details.get((uid, detail_code))
+            if current_detail and detail_unchanged(current_detail[1], new_hash, value):
+                continue
+
+            if current_detail:
+                close_detail_ids.append(current_detail[0])
+            new_details.append(EntityDetail(
+                entity_uid=uid,
+                detail_code=detail_code,
+                value=value,
+                hashdiff=new_hash,
+                valid_from=change_ts,
+                is_current=True,
+            ))
+            log = AuditLog(
+                actor=actor,
+                action="UPDATE_DETAIL" if current_detail else "INSERT_DETAIL",
+                entity_uid=uid,
+                detail_code=detail_code,
+                before=None,
+                after=value,
+            )
+            audit.append(log)
+            if current_detail:
+                detail_updates.append((log, current_detail[0]))
+            if result[uid] == "unchanged":
+                result[uid] = "updated"
+
+    if detail_updates:
+        before_values = dict(EntityDetail.objects.filter(pk__in=close_detail_ids).values_list("pk", "value"))
+        for log, pk in detail_updates:
+            log.before = before_values[pk]
+
+    # Close the previous versions first so the partial unique indexes and the
+    # exclusion constraints see [valid_from, change_ts) next to [change_ts, NULL).
+    now = timezone.now()
+    if close_entity_ids:
+        Entity.objects.filter(pk__in=close_entity_ids).update(is_current=False, valid_to=change_ts, updated_at=now)
+    if close_detail_ids:
+        EntityDetail.objects.filter(pk__in=close_detail_ids).update(is_current=False, valid_to=change_ts, updated_at=now)
+
+    Entity.objects.bulk_create(new_entities, batch_size=batch_size)
+    EntityDetail.objects.bulk_create(new_details, batch_size=batch_size)
+    audit_writer.add(*audit)
+    entities_changed([uid for uid, status in result.items() if status != "unchanged"])
+
+    return result
+
+
+def details_queryset(entity_uids=None, as_of=None):
+    # Current details, or the versions valid at as_of; entity_uids=None loads every entity.
+    details = EntityDetail.objects.as_of(as_of) if as_of is not None else EntityDetail.objects.filter(is_current=True)
+    if entity_uids is not None:
+        details = details.filter(entity_uid__in=set(entity_uids))
+    return details
+
+
+def load_details_by_uid(entity_uids=None, as_of=None):
+    grouped = {}
+    for detail in details_queryset(entity_uids, as_of):
+        grouped.setdefault(detail.entity_uid, []).append(detail)
+    return grouped
+
+
+async def aload_details_by_uid(entity_uids=None, as_of=None):
+    grouped = {}
+    async for detail in details_queryset(entity_uids, as_of):
+        grouped.setdefault(detail.entity_uid, []).append(detail)
+    return grouped
+
+
+def snapshot_as_of(as_of, entity_uids=None):
+    """
+    Point-in-time reconstruction in two queries: the entity versions and the
+    detail versions valid at as_of. Returns (entities, {entity_uid: [details]}).
+    """
+    entities = Entity.objects.as_of(as_of).order_by('valid_from', 'id')
+    if entity_uids is not None:
+        entities = entities.filter(entity_uid__in=entity_uids)
+    return list(entities), load_details_by_uid(entity_uids, as_of=as_of)
+
+
+def rehash_details(scheme=None, batch_size=5000, progress=None):
+    """
+    Rewrite stored EntityDetail.hashdiff values under the given (default: configured) scheme,
+    walking the table in id order with one transaction per batch. Rows already on the scheme are
+    skipped, so an interrupted run can simply be restarted. Returns the number of rows rewritten.
+    """
+    scheme = scheme or default_scheme()
+    prefix = f"{SCHEMES[scheme][0]}:"
+    last_id = rewritten = scanned = 0
+    while True:
+        rows = list(
+            EntityDetail.objects.filter(pk__gt=last_id).order_by("pk").values_list("pk", "value", "hashdiff")[:batch_size]
         )
+        if not rows:
+            return rewritten
+        last_id = rows[-1][0]
+        scanned += len(rows)
+        stale = [(pk, value) for pk, value, stored in rows if not stored.startswith(prefix)]
+        if stale:
+            hashes = detail_hashdiffs((value for _, value in stale), scheme)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE crm_entitydetail d SET hashdiff = v.hashdiff "
+                    "FROM unnest(%s::bigint[], %s::text[]) AS v(id, hashdiff) WHERE d.id = v.id",
+                    [[pk for pk, _ in stale], hashes],
+                )
+            rewritten += len(stale)
+        if progress:
+            progress(scanned, rewritten)
+
+
+SNAPSHOT_UPSERT_SQL = """
+INSERT INTO entity_current_snapshot (entity_uid, entity_type_id, entity_type_code, display_name, valid_from, details, updated_at)
+SELECT e.entity_uid, e.entity_type_id, t.code, e.display_name, e.valid_from,
+       COALESCE((SELECT jsonb_object_agg(d.detail_code, d.value)
+                 FROM crm_entitydetail d
+                 WHERE d.entity_uid = e.entity_uid AND d.is_current), '{{}}'::jsonb),
+       now()
+FROM crm_entity e
+JOIN crm_entitytype t ON t.id = e.entity_type_id
+WHERE e.is_current {filter}
+ON CONFLICT (entity_uid) DO UPDATE
+SET entity_type_id = EXCLUDED.entity_type_id,
+    entity_type_code = EXCLUDED.entity_type_code,
+    display_name = EXCLUDED.display_name,
+    valid_from = EXCLUDED.valid_from,
+    details = EXCLUDED.details,
+    updated_at = EXCLUDED.updated_at
+WHERE (entity_current_snapshot.entity_type_id, entity_current_snapshot.display_name,
+       entity_current_snapshot.valid_from, entity_current_snapshot.details)
+      IS DISTINCT FROM (EXCLUDED.entity_type_id, EXCLUDED.display_name, EXCLUDED.valid_from, EXCLUDED.details)
+"""
+
+SNAPSHOT_DELETE_SQL = """
+DELETE FROM entity_current_snapshot s
+WHERE NOT EXISTS (SELECT 1 FROM crm_entity e WHERE e.entity_uid = s.entity_uid AND e.is_current) {filter}
+"""
+
+
+def entities_changed(entity_uids):
+    """
+    Hook for every SCD2 write path, called in the writing transaction: syncs the snapshot rows
+    and drops the cached reads of the entities once it commits. Returns sync_snapshots()'s count.
+    """
+    entity_uids = list(entity_uids)
+    invalidate_entities(entity_uids)
+    return sync_snapshots(entity_uids)
+
+
+def sync_snapshots(entity_uids=None):
+    """
+    Bring entity_current_snapshot in line with the current versions of the given entities,
+    or of all entities when entity_uids is None. Call it in the transaction that wrote them.
+    Returns the number of snapshot rows written or removed.
+    """
+    if entity_uids is None:
+        upsert_filter = delete_filter = ""
+        params = []
+    else:
+        entity_uids = list(entity_uids)
+        if not entity_uids:
+            return 0
+        upsert_filter = "AND e.entity_uid = ANY(%s::uuid[])"
+        delete_filter = "AND s.entity_uid = ANY(%s::uuid[])"
+        params = [entity_uids]
+    with connection.cursor() as cursor:
+        cursor.execute(SNAPSHOT_UPSERT_SQL.format(filter=upsert_filter), params)
+        written = cursor.rowcount
+        cursor.execute(SNAPSHOT_DELETE_SQL.format(filter=delete_filter), params)
+        return written + cursor.rowcount
 
-        return detail
 
+def scd2_bulk_apply(records, actor="system", transaction_size=1000):
+    """
+    scd2_bulk_upsert() over records in transactions of transaction_size records. A transaction that
+    fails on its data is retried record by record, so only the offending records are lost.
 
-def refresh_materialized_views():
-    try:
-        with connection.cursor() as cursor:
-            cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY entity_current_snapshot;")
-    except Exception as e:
-        print(f'[WARN] Materialized view not found or refresh failed: {e}')
\ No newline at end of file
+    Returns one entry per record: "inserted" | "updated" | "unchanged", the exception that failed it, or
+    None for a record folded into a later record of the same entity in its transaction (see fold_records),
+    which carries their combined status.
+    """
+    statuses = []
+    for start in range(0, len(records), transaction_size):
+        chunk = records[start:start + transaction_size]
+        try:
+            result = scd2_bulk_upsert(chunk, actor=actor)
+            last = {record["entity_uid"]: i for i, record in enumerate(chunk)}
+            statuses += [
+                result[record["entity_uid"]] if last[record["entity_uid"]] == i else None
+                for i, record in enumerate(chunk)
+            ]
+        except (DataError, IntegrityError):
+            for record in chunk:
+                try:
+                    statuses.append(scd2_bulk_upsert([record], actor=actor)[record["entity_uid"]])
+                except (DataError, IntegrityError) as exc:
+                    statuses.append(exc)
+    return statuses
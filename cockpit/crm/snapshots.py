@@ -0,0 +1,107 @@
+import datetime
+import time
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from crm.entity_cache import invalidate_entities
+from crm.models import Entity, EntityDetail, EntitySnapshot, SnapshotRefresh
+from crm.services import sync_snapshots
+
+SNAPSHOT_NAME = 'entity_current_snapshot'
+# pg_try_advisory_xact_lock key; a second runner finds it taken and skips instead of queueing up.
+REFRESH_LOCK_KEY = 0x63726d736e6170  # "crmsnap"
+
+
+def _setting_seconds(name, default):
+    return datetime.timedelta(seconds=getattr(settings, name, default))
+
+
+def pending_changes(mark):
+    """
+    (first, last) updated_at of entity and detail rows written after mark (all rows when mark is None),
+    or (None, None) when there are none. Both are min/max lookups on the updated_at indexes.
+    """
+    firsts, lasts = [], []
+    for model in (Entity, EntityDetail):
+        rows = model.objects.all() if mark is None else model.objects.filter(updated_at__gt=mark)
+        bounds = rows.aggregate(first=Min('updated_at'), last=Max('updated_at'))
+        if bounds['last'] is not None:
+            firsts.append(bounds['first'])
+            lasts.append(bounds['last'])
+    if not lasts:
+        return None, None
+    return min(firsts), max(lasts)
+
+
+def changed_entity_uids(since):
+    uids = set(Entity.objects.filter(updated_at__gte=since).values_list('entity_uid', flat=True))
+    uids.update(EntityDetail.objects.filter(updated_at__gte=since).values_list('entity_uid', flat=True))
+    return uids
+
+
+def refresh_snapshots(force=False, now=None):
+    """
+    Reconcile entity_current_snapshot with the entity and detail rows written since the last run.
+
+    The SCD2 services keep the snapshot in sync as they write; this catches rows written around
+    them (admin, manual SQL). A run is skipped when nothing changed since the high-water mark,
+    deferred while writes are still arriving (quiet period) unless the oldest pending change is
+    older than the max lag, and skipped when another runner holds the lock. force=True (or the
+    first run) rebuilds every snapshot row.
+
+    Quiet period and lag are measured with the database clock (now unless given), so a runner whose
+    own clock is off neither defers runs nor forces them early.
+
+    Returns the run's metrics; 'status' is one of 'refreshed', 'unchanged', 'deferred' or 'locked'.
+    """
+    started = time.monotonic()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s), now()', [REFRESH_LOCK_KEY])
+            locked, db_now = cursor.fetchone()
+            if not locked:
+                return {'status': 'locked'}
+        now = now or db_now
+
+        state, _ = SnapshotRefresh.objects.select_for_update().get_or_create(name=SNAPSHOT_NAME)
+        first, last = pending_changes(state.high_water_mark)
+        full = force or state.high_water_mark is None
+        scanned = rows_changed = 0
+
+        if not full and last is None:
+            status = 'unchanged'
+        elif (not full and now - last < _setting_seconds('CRM_SNAPSHOT_QUIET_SECONDS', 30)
+              and now - first < _setting_seconds('CRM_SNAPSHOT_MAX_LAG_SECONDS', 300)):
+            status = 'deferred'
+        elif full:
+            status = 'refreshed'
+            rows_changed = sync_snapshots()
+            scanned = EntitySnapshot.objects.count()
+        else:
+            status = 'refreshed'
+            # Rescan a margin before the mark: a transaction that started earlier may have committed since.
+            since = state.high_water_mark - _setting_seconds('CRM_SNAPSHOT_OVERLAP_SECONDS', 60)
+            uids = changed_entity_uids(since)
+            scanned = len(uids)
+            rows_changed = sync_snapshots(uids)
+            invalidate_entities(uids)
+
+        if status == 'refreshed':
+            state.high_water_mark = max(filter(None, [state.high_water_mark, last]), default=None)
+            state.refresh_count += 1
+        else:
+            state.skip_count += 1
+        state.last_run_at = now
+        state.last_status = status
+        state.last_duration_ms = round((time.monotonic() - started) * 1000, 3)
+        state.last_entities_scanned = scanned
+        state.last_rows_changed = rows_changed
+        state.save()
+
+    return {
+        'status': status,
+        'duration_ms': state.last_duration_ms,
+        'entities_scanned': scanned,
+        'rows_changed': rows_changed,
+        'high_water_mark': state.high_water_mark,
+    }
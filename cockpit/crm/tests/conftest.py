@@ -0,0 +1,12 @@
+import pytest
+from django.core.cache import cache
+from crm.entity_types import entity_types
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    # Each test's database is rolled back; cached reads and type ids must not leak into the next test.
+    cache.clear()
+    entity_types.reset()
+    yield
+    entity_types.reset()
@@ -0,0 +1,62 @@
+import uuid
+import pytest
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from crm.audit import audit_writer
+from crm.models import AuditLog, AuditSpool
+from crm.services import scd2_upsert_entity
+
+DETAILS = [{'detail_code': code, 'value': {'value': code.lower()}} for code in ('EMAIL', 'PHONE', 'CITY')]
+
+
+def audit_inserts(ctx):
+    return [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "crm_auditlog"')]
+
+
+@pytest.mark.django_db
+def test_audit_rows_of_a_call_are_written_with_one_insert():
+    uid = uuid.uuid4()
+    with CaptureQueriesContext(connection) as ctx:
+        scd2_upsert_entity(uid, 'PERSON', 'Alic', details=DETAILS)
+    assert len(audit_inserts(ctx)) == 1
+    assert list(AuditLog.objects.filter(entity_uid=uid).order_by('id').values_list('action', flat=True)) == [
+        'INSERT_ENTITY', 'INSERT_DETAIL', 'INSERT_DETAIL', 'INSERT_DETAIL',
+    ]
+
+
+@pytest.mark.django_db
+def test_outer_batch_skips_rows_of_rolled_back_savepoints():
+    kept, rolled_back = uuid.uuid4(), uuid.uuid4()
+    with CaptureQueriesContext(connection) as ctx:
+        with transaction.atomic(), audit_writer.batch():
+            scd2_upsert_entity(kept, 'PERSON', 'Kept')
+            try:
+                with transaction.atomic():
+                    scd2_upsert_entity(rolled_back, 'PERSON', 'Gone')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            scd2_upsert_entity(kept, 'PERSON', 'Kept B')
+            assert not AuditLog.objects.exists()
+    assert len(audit_inserts(ctx)) == 1
+    assert list(AuditLog.objects.values_list('entity_uid', 'action')) == [
+        (kept, 'INSERT_ENTITY'), (kept, 'UPDATE_ENTITY'),
+    ]
+
+
+@pytest.mark.django_db
+def test_spool_mode_is_drained_into_audit_log(settings):
+    settings.CRM_AUDIT_MODE = 'spool'
+    uid = uuid.uuid4()
+    scd2_upsert_entity(uid, 'PERSON', 'Alic', details=DETAILS)
+    scd2_upsert_entity(uid, 'PERSON', 'Alic B')
+    assert AuditSpool.objects.count() == 2
+    assert not AuditLog.objects.exists()
+
+    call_command('drain_audit_spool', batch_size=1)
+    assert not AuditSpool.objects.exists()
+    logs = list(AuditLog.objects.order_by('id'))
+    assert [log.action for log in logs] == ['INSERT_ENTITY'] + ['INSERT_DETAIL'] * 3 + ['UPDATE_ENTITY']
+    assert logs[1].entity_uid == uid and logs[1].after == {'value': 'email'}
+    assert logs[-1].before == {'display_name': 'Alic'}
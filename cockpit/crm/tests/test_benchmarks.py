@@ -0,0 +1,37 @@
+import pytest
+from crm.benchmarks import compare_results, drop_bench_data, run_suite
+from crm.models import Entity, EntityDetail
+
+
+@pytest.mark.django_db
+def test_suite_runs_at_small_scale_and_is_seeded():
+    report = run_suite(entities=10, details=2, versions=3, writes=10, repeats=2, loader_rows=10)
+    results = report['results']
+    assert report['meta']['params']['entities'] == 10
+    assert results['seed']['rows'] == 30
+    assert {kind: r['calls'] for kind, r in results['upsert'].items()} == {'insert': 2, 'update': 6, 'noop': 2}
+    assert results['upsert']['noop']['queries'] < results['upsert']['update']['queries']
+    assert set(results['reads']) == {'detail', 'list', 'history', 'asof', 'diff', 'diff_summary'}
+    assert set(results['loader']) == {'copy_insert', 'copy_noop', 'orm_insert', 'orm_noop'}
+    # 10 seeded + 2 inserted + 2 x 10 loaded entities; 6 updated ones have a 4th version.
+    assert Entity.objects.filter(is_current=True).count() == 32
+    assert Entity.objects.count() == 10 * 3 + 6 + 2 + 20
+
+    drop_bench_data()
+    assert not Entity.objects.exists() and not EntityDetail.objects.exists()
+
+
+def test_compare_results_flags_slower_medians_lower_throughput_and_more_queries():
+    baseline = {'results': {'reads': {'asof': {'median_ms': 10.0, 'p95_ms': 20.0, 'queries': 2}},
+                            'loader': {'copy_insert': {'rows': 100, 'rows_per_sec': 1000}}}}
+    within = {'results': {'reads': {'asof': {'median_ms': 12.0, 'p95_ms': 90.0, 'queries': 2}},
+                          'loader': {'copy_insert': {'rows': 100, 'rows_per_sec': 800}}}}
+    assert compare_results(baseline, within, tolerance=0.25) == []
+
+    worse = {'results': {'reads': {'asof': {'median_ms': 13.0, 'p95_ms': 20.0, 'queries': 3}},
+                         'loader': {'copy_insert': {'rows': 100, 'rows_per_sec': 700}}}}
+    assert compare_results(baseline, worse, tolerance=0.25) == [
+        'loader.copy_insert.rows_per_sec: 1000 -> 700/s',
+        'reads.asof.median_ms: 10.0 -> 13.0 ms',
+        'reads.asof.queries: 2 -> 3 queries',
+    ]
@@ -0,0 +1,98 @@
+import threading
+import time
+import uuid
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from crm.models import EntityType
+from crm.services import scd2_upsert_entity
+
+# The feed only returns rows of settled transactions, so these tests commit for real.
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture
+def client():
+    token = Token.objects.create(user=User.objects.create_user(username='feed', password='feed'))
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+def in_thread(target):
+    def run():
+        try:
+            target()
+        finally:
+            connection.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def changes(client, **params):
+    response = client.get(reverse('changes'), params)
+    assert response.status_code == 200
+    return response.data
+
+
+def test_feed_pages_through_changes_in_commit_order(client):
+    first, second = uuid.uuid4(), uuid.uuid4()
+    scd2_upsert_entity(first, 'PERSON', 'Ada', details=[{'detail_code': 'EMAIL', 'value': {'value': 'ada@x.io'}}])
+    scd2_upsert_entity(second, 'PERSON', 'Bob')
+
+    page = changes(client, limit=2)
+    assert [(c['entity_uid'], c['action']) for c in page['changes']] == [(first, 'INSERT_ENTITY'), (first, 'INSERT_DETAIL')]
+    assert page['next'] == page['changes'][-1]['cursor']
+    page = changes(client, since=page['next'])
+    assert [(c['entity_uid'], c['action']) for c in page['changes']] == [(second, 'INSERT_ENTITY')]
+    tail = page['next']
+    assert changes(client, since=tail) == {'next': tail, 'changes': []}
+
+    scd2_upsert_entity(second, 'PERSON', 'Bob B')
+    assert [c['action'] for c in changes(client, since=tail)['changes']] == ['UPDATE_ENTITY']
+    assert client.get(reverse('changes'), {'since': 'nope'}).status_code == 400
+    assert client.get(reverse('changes'), {'limit': 0}).status_code == 400
+
+
+def test_rows_behind_a_running_transaction_are_held_back(client):
+    EntityType.objects.create(code='PERSON')  # or Fast would wait for Slow's uncommitted PERSON
+    slow, fast = uuid.uuid4(), uuid.uuid4()
+    written, release = threading.Event(), threading.Event()
+
+    def slow_writer():
+        with transaction.atomic():
+            scd2_upsert_entity(slow, 'PERSON', 'Slow')
+            written.set()
+            release.wait(10)
+
+    thread = in_thread(slow_writer)
+    assert written.wait(10)
+    # Committed after the slow transaction took its id: handing it out now would let the
+    # consumer's cursor pass the slow transaction's rows before they are committed.
+    scd2_upsert_entity(fast, 'PERSON', 'Fast')
+    assert changes(client)['changes'] == []
+
+    release.set()
+    thread.join()
+    assert [c['entity_uid'] for c in changes(client)['changes']] == [slow, fast]
+
+
+def test_long_poll_returns_on_commit(client, settings):
+    settings.CRM_CHANGES_RECHECK_SECONDS = 30
+    tail = changes(client)['next']
+    uid = uuid.uuid4()
+
+    def writer():
+        time.sleep(0.3)
+        scd2_upsert_entity(uid, 'PERSON', 'Late')
+
+    thread = in_thread(writer)
+    started = time.monotonic()
+    page = changes(client, since=tail or '', wait=10)
+    thread.join()
+    assert time.monotonic() - started < 5
+    assert [c['entity_uid'] for c in page['changes']] == [uid]
@@ -0,0 +1,69 @@
+import threading
+import uuid
+import pytest
+from django.conf import settings
+from django.db import connection, transaction
+from crm.benchmarks import bench_concurrent_writes
+from crm.loader import copy_merge_batch
+from crm.models import Entity, EntityType
+from crm.services import scd2_bulk_upsert
+
+# Writers run in their own threads and connections, so the tests commit for real.
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def test_concurrent_writers_of_a_hot_entity_queue_instead_of_failing():
+    result = bench_concurrent_writes(threads=6, writes=10, entities=1)
+    assert result['conflicts'] == 0, result['errors']
+    assert result['current_rows'] == 1
+    assert result['versions'] == 60
+
+
+def test_coalescing_collapses_bursts_into_fewer_versions():
+    result = bench_concurrent_writes(threads=6, writes=10, entities=1, coalesce_ms=50)
+    assert result['conflicts'] == 0, result['errors']
+    assert result['current_rows'] == 1
+    assert result['versions'] <= 30
+
+
+def test_overlapping_batches_do_not_deadlock():
+    EntityType.objects.create(code='PERSON')
+    uids = [uuid.uuid4() for _ in range(20)]
+    errors = []
+
+    def writer(order, name):
+        try:
+            for round_ in range(10):
+                scd2_bulk_upsert([
+                    {'entity_uid': uid, 'entity_type': 'PERSON', 'display_name': f'{name} {round_}'} for uid in order
+                ])
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=writer, args=(order, name))
+               for order, name in ((uids, 'Forward'), (uids[::-1], 'Backward'), (uids[5:] + uids[:5], 'Rotated'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert Entity.objects.filter(entity_uid__in=uids, is_current=True).count() == 20
+
+
+def test_a_batch_larger_than_the_lock_table_takes_at_most_one_lock_per_bucket():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT current_setting('max_locks_per_transaction')::int"
+                       " * (current_setting('max_connections')::int + current_setting('max_prepared_transactions')::int)")
+        lock_table_size = cursor.fetchone()[0]
+    records = [{'entity_uid': uuid.uuid4(), 'entity_type': 'PERSON', 'display_name': f'Bulk {n}', 'details': []}
+               for n in range(2 * lock_table_size)]
+
+    with transaction.atomic():
+        stats = copy_merge_batch(records)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+            assert cursor.fetchone()[0] <= settings.CRM_WRITE_LOCK_BUCKETS
+    assert stats['entity_versions'] == len(records)
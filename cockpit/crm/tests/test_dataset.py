@@ -0,0 +1,68 @@
+import datetime
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, Q
+from crm.dataset import entity_history, generate_dataset, indexes_deferred
+from crm.models import AuditLog, Entity, EntityDetail, EntitySnapshot
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+END = datetime.datetime(2024, 7, 1, tzinfo=datetime.timezone.utc)
+
+
+def test_histories_are_deterministic_and_contiguous():
+    span = 10**12
+    assert entity_history(3, 42, span, 4, 3) == entity_history(3, 42, span, 4, 3)
+    assert entity_history(3, 42, span, 4, 3)[0][0][0] != entity_history(4, 42, span, 4, 3)[0][0][0]
+    for index in range(50):
+        entity_rows, detail_rows, audit_rows = entity_history(3, index, span, 4, 3)
+        for rows in [entity_rows] + [[r for r in detail_rows if r[1] == code] for code in {r[1] for r in detail_rows}]:
+            assert [r[4] for r in rows[:-1]] == [r[3] for r in rows[1:]]
+            assert rows[-1][4] is None and rows[-1][5] and not any(r[5] for r in rows[:-1])
+        assert len(audit_rows) == len(entity_rows) + len(detail_rows)
+
+
+@pytest.mark.django_db
+def test_generated_histories_are_consistent_scd2():
+    totals = generate_dataset(60, START, END, versions=3, details=2, seed=7, chunk_size=25)
+    assert totals['entities'] == 60 and totals['chunks'] == 3
+    assert Entity.objects.count() == totals['entity_versions']
+    assert EntityDetail.objects.count() == totals['detail_versions']
+    assert AuditLog.objects.filter(actor='dataset').count() == totals['audit_rows']
+    assert EntitySnapshot.objects.count() == 60
+
+    per_entity = Entity.objects.values('entity_uid').annotate(current=Count('id', filter=Q(is_current=True)))
+    assert {row['current'] for row in per_entity} == {1}
+    assert not Entity.objects.filter(Q(valid_from__lt=START) | Q(valid_from__gte=END)).exists()
+    # Audit rows went into the monthly partitions, not the default one.
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM crm_auditlog_default')
+        assert cursor.fetchone()[0] == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_command_loads_in_parallel_with_deferred_indexes():
+    def index_count():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_indexes WHERE tablename IN ('crm_entity', 'crm_entitydetail')")
+            return cursor.fetchone()[0]
+
+    indexes = index_count()
+    call_command('generate_dataset', entities=40, workers=2, chunk_size=10, start='2024-01-01', end='2024-07-01',
+                 defer_indexes=True)
+    assert index_count() == indexes
+    assert Entity.objects.filter(is_current=True).count() == 40
+    with pytest.raises(Exception, match='already generated'):
+        call_command('generate_dataset', entities=40, start='2024-01-01', end='2024-07-01')
+
+
+@pytest.mark.django_db
+def test_deferred_indexes_are_rebuilt_when_the_load_fails():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_indexes WHERE tablename = 'crm_entity'")
+        before = cursor.fetchone()[0]
+        with pytest.raises(RuntimeError):
+            with indexes_deferred(('crm_entity',)):
+                raise RuntimeError('load failed')
+        cursor.execute("SELECT count(*) FROM pg_indexes WHERE tablename = 'crm_entity'")
+        assert cursor.fetchone()[0] == before
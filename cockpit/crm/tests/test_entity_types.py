@@ -0,0 +1,64 @@
+import uuid
+import pytest
+from django.core.cache import cache
+from django.db import transaction
+from crm.entity_types import EntityTypeRegistry, entity_types
+from crm.models import EntityType
+from crm.services import scd2_upsert_entity
+
+
+@pytest.mark.django_db
+def test_ensure_creates_missing_types_in_bulk(django_assert_num_queries):
+    registry = EntityTypeRegistry()
+    EntityType.objects.create(code='PERSON')
+
+    # One query loads the map, one inserts the missing codes, one reads them back.
+    with django_assert_num_queries(3):
+        types = registry.ensure(['PERSON', 'BANK', 'FUND'])
+    assert set(types) == {'PERSON', 'BANK', 'FUND'}
+    with django_assert_num_queries(0):
+        assert registry.get_by_code('BANK') == types['BANK']
+        assert registry.get_by_id(types['FUND'].pk).code == 'FUND'
+        assert registry.ensure(['PERSON', 'BANK']) == {'PERSON': types['PERSON'], 'BANK': types['BANK']}
+
+
+@pytest.mark.django_db
+def test_types_from_a_rolled_back_transaction_are_forgotten():
+    registry = EntityTypeRegistry()
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            assert registry.ensure(['TEMP'])['TEMP'].pk
+            raise RuntimeError
+    assert registry.get_by_code('TEMP') is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changes_reach_other_workers_through_the_version_counter(django_assert_num_queries):
+    worker = EntityTypeRegistry()
+    worker.check_interval = 0
+    person = EntityType.objects.create(code='PERSON', name='Person')
+    assert worker.get_by_code('PERSON').name == 'Person'
+
+    with django_assert_num_queries(0):
+        worker.get_by_id(person.pk)
+
+    # Saved in another process: the post_save hook bumps the shared version on commit.
+    person.name = 'Natural person'
+    person.save()
+    assert worker.get_by_id(person.pk).name == 'Natural person'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_repeated_writes_resolve_types_without_queries(django_assert_num_queries):
+    EntityType.objects.create(code='PERSON')
+    uid = uuid.uuid4()
+    scd2_upsert_entity(uid, 'PERSON', 'Olena', details=[{'detail_code': 'EMAIL', 'value': {'value': 'o@example.com'}}])
+    scd2_upsert_entity(uid, 'BANK', 'Olena')  # creates BANK; the next write reloads the map once
+    scd2_upsert_entity(uid, 'BANK', 'Olena')
+    version = cache.get(entity_types.version_key)
+
+    # No type insert, no map reload: BEGIN, lock, current entity, current detail, COMMIT (no snapshot sync for a no-op).
+    for _ in range(3):
+        with django_assert_num_queries(5):
+            scd2_upsert_entity(uid, 'BANK', 'Olena', details=[{'detail_code': 'EMAIL', 'value': {'value': 'o@example.com'}}])
+    assert cache.get(entity_types.version_key) == version
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import uuid
+import pytest
+from django.core.management import call_command
+from crm.hashdiff import canonical, hashdiff, hashdiff_many, hashdiff_matches, legacy_hashdiff, scheme_of
+from crm.loader import copy_merge_batch
+from crm.models import EntityDetail
+from crm.services import scd2_bulk_upsert, scd2_upsert_detail, scd2_upsert_entity
+
+
+def test_hashdiff_is_canonical_and_type_aware():
+    assert hashdiff({'b': {'y': 1, 'x': [1, 2]}, 'a': 'z'}) == hashdiff({'a': 'z', 'b': {'x': [1, 2], 'y': 1}})
+    assert hashdiff({'v': 1}) == hashdiff({'v': 1.0})
+    assert len({hashdiff(v) for v in (1, '1', 1.5, True, None, [1], {'1': 1})}) == 7
+    assert hashdiff([1, 2]) != hashdiff([2, 1])
+
+    values = ['a', {'k': [1.0, {'z': None}]}, 3]
+    for scheme in ('sha256', 'blake2b'):
+        assert hashdiff_many(values, scheme) == [hashdiff(v, scheme) for v in values]
+    assert scheme_of(hashdiff('a', 'blake2b')) == 'blake2b'
+    assert scheme_of(legacy_hashdiff('a')) == 'legacy'
+    assert hashdiff_matches(legacy_hashdiff('a'), 'a') and not hashdiff_matches(legacy_hashdiff('a'), 'b')
+
+
+def test_digests_are_over_the_canonical_json():
+    values = ['a', 'ü "q"\n', 0, -3, 2.5, True, None, [], {}, [1, 'x', [None]],
+              {'value': {'city': 'Kyiv', 'geo': {'lat': 50.45, 'lon': 30.52}, 'tags': ['b', 'a'], 'ünï': 1.0}}]
+    for value in values:
+        raw = json.dumps(canonical(value), sort_keys=True, separators=(',', ':'), ensure_ascii=False, allow_nan=False)
+        assert hashdiff(value, 'sha256') == 's2:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    # Stored hashdiffs depend on the exact encoding: this one must never change.
+    assert hashdiff(values[-1], 'sha256') == 's2:7b472c8499e6c9372f34e3ddd06dd6fe84ac099a72a19c4f20032b2d871a24b4'
+    with pytest.raises(ValueError):
+        hashdiff({'v': float('nan')})
+
+
+def store_legacy_hashes():
+    for detail in EntityDetail.objects.all():
+        value = detail.value['value'] if isinstance(detail.value, dict) and 'value' in detail.value else detail.value
+        EntityDetail.objects.filter(pk=detail.pk).update(hashdiff=legacy_hashdiff(value))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('path', ['row', 'bulk', 'copy'])
+def test_legacy_hashes_do_not_cause_spurious_versions(path):
+    uid = uuid.uuid4()
+    address = {'value': {'city': 'Kyiv', 'geo': {'lat': 50.45, 'lon': 30.52}}}
+    scd2_upsert_entity(uid, 'PERSON', 'Olena', details=[{'detail_code': 'ADDRESS', 'value': address}])
+    store_legacy_hashes()
+
+    same = json.loads(json.dumps(address))
+    changed = {'value': {'city': 'Lviv', 'geo': {'lat': 49.84, 'lon': 24.03}}}
+    for value in (same, changed):
+        record = {'entity_uid': uid, 'entity_type': 'PERSON', 'display_name': 'Olena',
+                  'details': [{'detail_code': 'ADDRESS', 'value': value}]}
+        if path == 'row':
+            scd2_upsert_detail(uid, 'ADDRESS', value)
+        elif path == 'bulk':
+            scd2_bulk_upsert([record])
+        else:
+            copy_merge_batch([record])
+        if value is same:
+            assert EntityDetail.objects.filter(entity_uid=uid).count() == 1
+
+    assert EntityDetail.objects.filter(entity_uid=uid).count() == 2
+    assert scheme_of(EntityDetail.objects.get(entity_uid=uid, is_current=True).hashdiff) == 'blake2b'
+
+
+@pytest.mark.django_db
+def test_rehash_details_rewrites_in_batches():
+    for i in range(5):
+        scd2_upsert_entity(uuid.uuid4(), 'PERSON', f'P{i}', details=[{'detail_code': 'CITY', 'value': {'value': f'C{i}'}}])
+    store_legacy_hashes()
+
+    call_command('rehash_details', batch_size=2, scheme='sha256')
+    assert {scheme_of(h) for h in EntityDetail.objects.values_list('hashdiff', flat=True)} == {'sha256'}
+    for detail in EntityDetail.objects.all():
+        assert detail.hashdiff == hashdiff(detail.value['value'], 'sha256')
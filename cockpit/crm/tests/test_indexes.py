@@ -0,0 +1,55 @@
+import hashlib
+import uuid
+import pytest
+from django.db import connection
+from crm.models import Entity, EntityDetail, EntityType
+
+
+@pytest.fixture
+def history():
+    # Ten closed versions per current one, so the partial indexes are much smaller than the tables and
+    # the planner picks them on cost. VACUUM sets the visibility map the index-only scans rely on.
+    person = EntityType.objects.create(code='PERSON')
+    institution = EntityType.objects.create(code='INSTITUTION')
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO crm_entity (entity_uid, entity_type_id, display_name, valid_from, valid_to, is_current, created_at, updated_at)
+            SELECT md5('e' || e)::uuid, CASE WHEN e %% 20 = 0 THEN %s ELSE %s END, 'Person ' || e || ' v' || v,
+                   '2020-01-01'::timestamptz + v * interval '1 day',
+                   CASE WHEN v < 10 THEN '2020-01-01'::timestamptz + (v + 1) * interval '1 day' END,
+                   v = 10, now(), now()
+            FROM generate_series(1, 2000) AS e CROSS JOIN generate_series(0, 10) AS v
+        """, [institution.pk, person.pk])
+        cursor.execute("""
+            INSERT INTO crm_entitydetail (entity_uid, detail_code, value, valid_from, valid_to, is_current, hashdiff, created_at, updated_at)
+            SELECT entity_uid, code, jsonb_build_object('value', display_name), valid_from, valid_to, is_current, md5(display_name), now(), now()
+            FROM crm_entity CROSS JOIN unnest(ARRAY['EMAIL', 'PHONE']) AS code
+        """)
+        cursor.execute('VACUUM ANALYZE crm_entity')
+        cursor.execute('VACUUM ANALYZE crm_entitydetail')
+    return institution
+
+
+# VACUUM cannot run inside the test transaction.
+@pytest.mark.django_db(transaction=True)
+def test_current_row_lookups_stay_on_partial_indexes(history):
+    uids = [uuid.UUID(hashlib.md5(f'e{e}'.encode()).hexdigest()) for e in (1, 2, 3)]
+    by_type = Entity.objects.filter(is_current=True, entity_type=history).order_by('valid_from', 'id')
+    plans = {
+        # scd2_bulk_upsert: current details of the batch, compared by hashdiff.
+        'Index Only Scan using unique_current_detail':
+            EntityDetail.objects.filter(entity_uid__in=uids, is_current=True)
+            .values_list('entity_uid', 'detail_code', 'pk', 'hashdiff').explain(),
+        # ?detail_code= semi-join.
+        'Index Only Scan using entitydetail_current_code_idx':
+            EntityDetail.objects.filter(detail_code='EMAIL', is_current=True).values('entity_uid').explain(),
+        # ?type= page, and its keyset positions.
+        'Index Scan using entity_current_type_idx': by_type[:101].explain(),
+        'Index Only Scan using entity_current_type_idx': by_type.values_list('valid_from', 'id')[:101].explain(),
+        # Unfiltered list page.
+        'Index Scan using entity_current_keyset_idx':
+            Entity.objects.filter(is_current=True).order_by('valid_from', 'id')[:101].explain(),
+    }
+    for expected, plan in plans.items():
+        assert expected in plan, plan
+        assert 'Seq Scan' not in plan and 'Bitmap' not in plan, plan
@@ -0,0 +1,88 @@
+import json
+import os
+import uuid
+import pytest
+from django.core.management import call_command
+from crm.loader import write_checkpoint, partition_of, split_file
+from crm.models import Entity, EntityDetail, EntitySnapshot, AuditLog
+
+
+def write_ndjson(path, rows):
+    path.write_text("\n".join(json.dumps(row) for row in rows) + "\n", encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("stream", [False, True])
+def test_load_ndjson_applies_scd2(tmp_path, stream):
+    uid = str(uuid.uuid4())
+    options = {"stream": stream, "batch_size": 2}
+    call_command("load_entities_from_file", write_ndjson(tmp_path / "v1.ndjson", [
+        {"entity_uid": uid, "entity_type": "PERSON", "display_name": "Alic", "email": "alic@example.com"},
+    ]), **options)
+    call_command("load_entities_from_file", write_ndjson(tmp_path / "v2.ndjson", [
+        {"entity_uid": uid, "entity_type": "PERSON", "display_name": "Alic B", "email": "alic@example.com"},
+    ]), **options)
+
+    assert Entity.objects.filter(entity_uid=uid).count() == 2
+    assert Entity.objects.get(entity_uid=uid, is_current=True).display_name == "Alic B"
+    assert EntityDetail.objects.get(entity_uid=uid).value == {"value": "alic@example.com"}
+    assert list(AuditLog.objects.filter(entity_uid=uid).order_by("id").values_list("action", flat=True)) == [
+        "INSERT_ENTITY", "INSERT_DETAIL", "UPDATE_ENTITY",
+    ]
+    snapshot = EntitySnapshot.objects.get(entity_uid=uid)
+    assert (snapshot.display_name, snapshot.details) == ("Alic B", {"EMAIL": {"value": "alic@example.com"}})
+
+
+@pytest.mark.django_db
+def test_stream_load_csv_resumes_from_checkpoint(tmp_path):
+    uids = [str(uuid.uuid4()) for _ in range(3)]
+    csv_path = tmp_path / "entities.csv"
+    csv_path.write_text(
+        "entity_uid,entity_type,display_name,city\n" + "".join(f"{uid},PERSON,Name {i},Kyiv\n" for i, uid in enumerate(uids)),
+        encoding="utf-8",
+    )
+    checkpoint = tmp_path / "load.checkpoint"
+    write_checkpoint(str(checkpoint), str(csv_path), 2)
+
+    call_command("load_entities_from_file", str(csv_path), stream=True, checkpoint=str(checkpoint))
+
+    assert list(Entity.objects.values_list("entity_uid", flat=True)) == [uuid.UUID(uids[2])]
+    assert EntityDetail.objects.get().detail_code == "CITY"
+    assert not checkpoint.exists()
+
+
+def test_partition_of_is_stable_and_bounded():
+    uid = uuid.uuid4()
+    assert partition_of(uid, 4) == partition_of(str(uid), 4)
+    assert {partition_of(uuid.uuid4(), 4) for _ in range(200)} == {0, 1, 2, 3}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_load_partitions_by_entity(tmp_path):
+    rows = [{"entity_uid": str(uuid.uuid4()), "display_name": f"Name {i}", "city": "Lviv"} for i in range(20)]
+    path = write_ndjson(tmp_path / "entities.ndjson", rows)
+
+    call_command("load_entities_from_file", path, stream=True, workers=3, batch_size=4)
+
+    assert Entity.objects.filter(is_current=True).count() == 20
+    assert EntityDetail.objects.filter(detail_code="CITY").count() == 20
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_load_resumes_each_partition_of_one_split(tmp_path):
+    rows = [{"entity_uid": str(uuid.UUID(int=i)), "display_name": f"Name {i}"} for i in range(20)]
+    path = write_ndjson(tmp_path / "entities.ndjson", rows)
+    checkpoint = str(tmp_path / "load.ckpt")
+
+    # An earlier run split the file and committed the first two rows of partition 0.
+    parts = split_file(path, 2, f"{checkpoint}.parts")
+    with open(parts[0], encoding="utf-8") as f:
+        done = [json.loads(line)["entity_uid"] for line in f][:2]
+    write_checkpoint(f"{parts[0]}.checkpoint", parts[0], 2)
+
+    call_command("load_entities_from_file", path, stream=True, workers=2, batch_size=4, checkpoint=checkpoint)
+
+    assert Entity.objects.count() == 18
+    assert not Entity.objects.filter(entity_uid__in=done).exists()
+    assert not os.path.exists(f"{checkpoint}.parts")
@@ -0,0 +1,66 @@
+import re
+import uuid
+import pytest
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from crm.metrics import registry
+from crm.services import scd2_upsert_entity
+
+
+def sample(text, name):
+    match = re.search(rf'^{re.escape(name)} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+@pytest.mark.django_db
+class TestMetrics:
+    def setup_method(self):
+        registry.reset()
+        token, _ = Token.objects.get_or_create(user=User.objects.create_user(username='metrics'))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_records_latency_and_queries_per_view(self, settings):
+        settings.CRM_METRICS_ALLOWED_IPS = ['127.0.0.1']
+        scd2_upsert_entity(uuid.uuid4(), 'PERSON', 'Ada')
+        response = self.client.get(reverse('entity-list'))
+        timing = response['Server-Timing']
+        queries = int(re.search(r'desc="(\d+) queries"', timing).group(1))
+        assert queries >= 3  # token, entities, their details
+        assert timing.startswith('app;dur=')
+
+        text = Client().get(reverse('metrics')).content.decode()
+        assert sample(text, 'crm_requests_total{view="EntityListCreateView",method="GET",status="200"}') == 1
+        assert sample(text, 'crm_db_queries_total{view="EntityListCreateView"}') == queries
+        assert sample(text, 'crm_request_duration_seconds_count{view="EntityListCreateView"}') == 1
+        assert sample(text, 'crm_request_duration_seconds_bucket{view="EntityListCreateView",le="+Inf"}') == 1
+        assert 'crm_db_slowest_query_seconds{view="EntityListCreateView",sql="SELECT' in text
+
+    def test_async_views_count_their_queries(self):
+        uid = uuid.uuid4()
+        scd2_upsert_entity(uid, 'PERSON', 'Ada')
+        response = self.client.get(reverse('async-entity-detail', args=[uid]))
+        assert response.status_code == 200
+        assert 'desc="0 queries"' not in response['Server-Timing']
+        assert 'crm_requests_total{view="entity_detail",method="GET",status="200"} 1' in registry.render()
+
+    def test_sampling_disabled_records_nothing(self, settings):
+        settings.CRM_METRICS_SAMPLE_RATE = 0
+        response = self.client.get(reverse('entity-list'))
+        assert response.status_code == 200
+        assert 'Server-Timing' not in response
+        assert 'crm_requests_total{' not in registry.render()
+
+    def test_metrics_are_only_served_to_allowed_ips_and_staff(self, settings):
+        settings.CRM_METRICS_ALLOWED_IPS = ['10.0.0.5']
+        url = reverse('metrics')
+        assert Client().get(url).status_code == 403
+        assert self.client.get(url).status_code == 403
+        assert Client(REMOTE_ADDR='10.0.0.5').get(url).status_code == 200
+
+        staff = Client()
+        staff.force_login(User.objects.create_user(username='ops', is_staff=True))
+        assert staff.get(url).status_code == 200
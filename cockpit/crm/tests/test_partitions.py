@@ -0,0 +1,72 @@
+import datetime
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from crm.models import AuditLog
+from crm.partitions import AUDIT_ARCHIVE_SCHEMA, audit_partitions, detach_audit_partitions, ensure_audit_partitions
+
+UTC = datetime.timezone.utc
+
+
+def partition_of(log):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT tableoid::regclass::text FROM crm_auditlog WHERE id = %s', [log.pk])
+        return cursor.fetchone()[0]
+
+
+def audit_at(timestamp):
+    log = AuditLog.objects.create(action='INSERT_ENTITY')
+    AuditLog.objects.filter(pk=log.pk).update(timestamp=timestamp)
+    return log
+
+
+def table_exists(name, schema='public'):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [f'{schema}.{name}'])
+        return cursor.fetchone()[0]
+
+
+@pytest.mark.django_db
+def test_audit_rows_land_in_their_month_partition():
+    log = AuditLog.objects.create(action='INSERT_ENTITY')
+    assert partition_of(log) == f'crm_auditlog_p{log.timestamp.astimezone(UTC):%Y_%m}'
+
+    far = audit_at(datetime.datetime(2099, 5, 20, tzinfo=UTC))
+    assert partition_of(far) == 'crm_auditlog_default'
+    assert ensure_audit_partitions(months_ahead=1, now=datetime.datetime(2099, 5, 1, tzinfo=UTC)) == [
+        'crm_auditlog_p2099_05', 'crm_auditlog_p2099_06',
+    ]
+    assert partition_of(far) == 'crm_auditlog_p2099_05'
+    assert ensure_audit_partitions(months_ahead=1, now=datetime.datetime(2099, 5, 1, tzinfo=UTC)) == []
+
+
+@pytest.mark.django_db
+def test_diff_range_scans_only_its_partitions():
+    ensure_audit_partitions(months_ahead=2, now=datetime.datetime(2030, 1, 1, tzinfo=UTC))
+    plan = AuditLog.objects.filter(
+        timestamp__gte=datetime.datetime(2030, 2, 3, tzinfo=UTC),
+        timestamp__lte=datetime.datetime(2030, 2, 10, tzinfo=UTC),
+    ).order_by('timestamp', 'id').explain()
+    assert 'crm_auditlog_p2030_02' in plan
+    assert 'crm_auditlog_p2030_01' not in plan
+    assert 'crm_auditlog_p2030_03' not in plan
+    assert 'crm_auditlog_default' not in plan
+
+
+@pytest.mark.django_db
+def test_expired_partitions_are_archived_or_dropped():
+    old = datetime.datetime(2001, 1, 1, tzinfo=UTC)
+    ensure_audit_partitions(months_ahead=1, now=old)
+    audit_at(datetime.datetime(2001, 1, 15, tzinfo=UTC))
+    kept = AuditLog.objects.create(action='INSERT_ENTITY')
+
+    assert detach_audit_partitions(retain_months=None) == []
+    assert detach_audit_partitions(retain_months=12) == ['crm_auditlog_p2001_01', 'crm_auditlog_p2001_02']
+    assert list(AuditLog.objects.values_list('pk', flat=True)) == [kept.pk]
+    assert table_exists('crm_auditlog_p2001_01', AUDIT_ARCHIVE_SCHEMA)
+    assert datetime.datetime(2001, 1, 1, tzinfo=UTC) not in audit_partitions()
+
+    ensure_audit_partitions(months_ahead=0, now=old)
+    call_command('maintain_audit_partitions', ahead=0, retain_months=12, drop=True)
+    assert not table_exists('crm_auditlog_p2001_01')
+    assert AuditLog.objects.filter(pk=kept.pk).exists()
@@ -0,0 +1,53 @@
+import uuid
+import pytest
+from django.db import connection
+from crm.models import Entity, EntityDetail, NAME_DETAIL_CODES, detail_text_value
+from crm.search import search_entities
+from crm.services import scd2_upsert_entity
+
+
+@pytest.fixture
+def people():
+    scd2_upsert_entity(uuid.uuid4(), 'PERSON', 'Oleksandr Shevchenko')
+    scd2_upsert_entity(uuid.uuid4(), 'PERSON', 'Olga Kobylianska')
+    scd2_upsert_entity(uuid.uuid4(), 'INSTITUTION', 'Acme Bank',
+                       details=[{'detail_code': 'LEGAL_NAME', 'value': {'value': 'Shevchenko Holdings'}}])
+
+
+@pytest.mark.django_db
+def test_search_ranks_names_and_name_details(people):
+    hits = search_entities('Shevchenko', threshold=0.3)
+    names = [entity.display_name for entity, _ in hits]
+    assert set(names) == {'Oleksandr Shevchenko', 'Acme Bank'}
+    assert [s for _, s in hits] == sorted((s for _, s in hits), reverse=True)
+
+    assert [e.display_name for e, _ in search_entities('Shevchenko', include_details=False)] == ['Oleksandr Shevchenko']
+    assert search_entities('Shevchenko', threshold=0.9) == []
+
+
+@pytest.mark.django_db
+def test_search_uses_trigram_indexes(people):
+    # Enough rows that the planner's choice reflects index usability rather than table size.
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO crm_entity (entity_uid, entity_type_id, display_name, valid_from, is_current, created_at, updated_at)
+            SELECT gen_random_uuid(), (SELECT id FROM crm_entitytype WHERE code = 'PERSON'), 'Person ' || i, now(), TRUE, now(), now()
+            FROM generate_series(1, 20000) AS i
+        """)
+        cursor.execute("""
+            INSERT INTO crm_entitydetail (entity_uid, detail_code, value, valid_from, is_current, hashdiff, created_at, updated_at)
+            SELECT entity_uid, 'EMAIL', jsonb_build_object('value', display_name || '@example.com'), now(), TRUE, '', now(), now()
+            FROM crm_entity
+        """)
+        cursor.execute('ANALYZE crm_entity')
+        cursor.execute('ANALYZE crm_entitydetail')
+        cursor.execute('SET LOCAL enable_seqscan = off')
+    plans = [
+        Entity.objects.filter(is_current=True, display_name__ilike='shev').explain(),
+        Entity.objects.filter(is_current=True, display_name__trigram_similar='shev').explain(),
+        EntityDetail.objects.filter(is_current=True, detail_code__in=NAME_DETAIL_CODES)
+        .alias(name=detail_text_value()).filter(name__trigram_similar='shev').explain(),
+    ]
+    assert 'entity_display_name_gin' in plans[0]
+    assert 'entity_display_name_gin' in plans[1]
+    assert 'entitydetail_name_value_trgm' in plans[2]
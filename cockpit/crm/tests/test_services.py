@@ -1,7 +1,11 @@
 import uuid
+from datetime import timedelta
 import pytest
-from crm.services import scd2_upsert_entity, scd2_upsert_detail
-from crm.models import Entity, EntityDetail
+from django.utils import timezone
+from django.db import DataError
+from crm.services import (scd2_upsert_entity, scd2_upsert_detail, scd2_bulk_upsert, scd2_bulk_apply, snapshot_as_of,
+                          sync_snapshots)
+from crm.models import Entity, EntityDetail, EntitySnapshot, AuditLog
 
 
 @pytest.mark.django_db
@@ -35,3 +39,98 @@ def test_detail_upsert_idempotent():
     d1.refresh_from_db()
     assert not d1.is_current
     assert d3.is_current
+
+
+@pytest.mark.django_db
+def test_bulk_upsert_matches_row_semantics(django_assert_max_num_queries):
+    uid_a, uid_b = uuid.uuid4(), uuid.uuid4()
+    scd2_upsert_entity(uid_a, 'PERSON', 'Alic', details=[{'detail_code': 'EMAIL', 'value': {'value': 'a@example.com'}}])
+
+    records = [
+        {'entity_uid': str(uid_a), 'entity_type': 'PERSON', 'display_name': 'Alic',
+         'details': [{'detail_code': 'EMAIL', 'value': {'value': 'alic@example.com'}}]},
+        {'entity_uid': uid_b, 'entity_type': 'INSTITUTION', 'display_name': 'Bank',
+         'details': [{'detail_code': 'CITY', 'value': {'value': 'Kyiv'}}]},
+    ]
+    with django_assert_max_num_queries(14):
+        result = scd2_bulk_upsert(records, actor='bulk')
+
+    assert result == {uid_a: 'updated', uid_b: 'inserted'}
+    assert Entity.objects.filter(entity_uid=uid_a).count() == 1
+    assert EntityDetail.objects.filter(entity_uid=uid_a).count() == 2
+    assert EntityDetail.objects.get(entity_uid=uid_a, is_current=True).value == {'value': 'alic@example.com'}
+    assert Entity.objects.get(entity_uid=uid_b).entity_type.code == 'INSTITUTION'
+    assert AuditLog.objects.filter(actor='bulk').count() == 3
+
+    assert scd2_bulk_upsert(records) == {uid_a: 'unchanged', uid_b: 'unchanged'}
+    assert EntityDetail.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_as_of_returns_one_version_at_boundaries():
+    uid = uuid.uuid4()
+    t0 = timezone.now() - timedelta(days=2)
+    t1 = t0 + timedelta(days=1)
+    scd2_upsert_entity(uid, 'PERSON', 'Alic', change_ts=t0)
+    scd2_upsert_entity(uid, 'PERSON', 'Alic B', change_ts=t1)
+
+    assert not Entity.objects.as_of(t0 - timedelta(seconds=1)).exists()
+    assert list(Entity.objects.as_of(t0).values_list('display_name', flat=True)) == ['Alic']
+    assert list(Entity.objects.as_of(t1).values_list('display_name', flat=True)) == ['Alic B']
+    assert Entity.objects.overlapping(t0, t1).count() == 1
+    assert Entity.objects.overlapping(t0, None).count() == 2
+
+
+@pytest.mark.django_db
+def test_snapshot_as_of_reconstructs_details(django_assert_num_queries):
+    uid = uuid.uuid4()
+    t0 = timezone.now() - timedelta(days=2)
+    scd2_upsert_entity(uid, 'PERSON', 'Olena', change_ts=t0, details=[{'detail_code': 'CITY', 'value': 'Lviv'}])
+    scd2_upsert_detail(uid, 'CITY', 'Kharkiv', change_ts=t0 + timedelta(days=1))
+
+    with django_assert_num_queries(2):
+        entities, details = snapshot_as_of(t0 + timedelta(hours=1))
+    assert [e.display_name for e in entities] == ['Olena']
+    assert [d.value for d in details[uid]] == ['Lviv']
+
+
+@pytest.mark.django_db
+def test_snapshots_follow_every_write_path():
+    uid_a, uid_b = uuid.uuid4(), uuid.uuid4()
+    scd2_upsert_entity(uid_a, 'PERSON', 'Alic', details=[{'detail_code': 'CITY', 'value': {'value': 'Lviv'}}])
+    scd2_upsert_detail(uid_a, 'EMAIL', {'value': 'alic@example.com'})
+    scd2_bulk_upsert([
+        {'entity_uid': uid_a, 'entity_type': 'INSTITUTION', 'display_name': 'Alic LLC',
+         'details': [{'detail_code': 'CITY', 'value': {'value': 'Kyiv'}}]},
+        {'entity_uid': uid_b, 'entity_type': 'PERSON', 'display_name': 'Bohdan'},
+    ])
+
+    snapshots = {s.entity_uid: s for s in EntitySnapshot.objects.all()}
+    assert set(snapshots) == {uid_a, uid_b}
+    a = snapshots[uid_a]
+    assert (a.entity_type_code, a.display_name) == ('INSTITUTION', 'Alic LLC')
+    assert a.valid_from == Entity.objects.get(entity_uid=uid_a, is_current=True).valid_from
+    assert a.details == {'CITY': {'value': 'Kyiv'}, 'EMAIL': {'value': 'alic@example.com'}}
+    assert snapshots[uid_b].details == {}
+
+    # Already in sync: a full rebuild writes nothing; rows without a current entity are removed.
+    assert sync_snapshots() == 0
+    Entity.objects.filter(entity_uid=uid_b).update(is_current=False, valid_to=timezone.now())
+    assert sync_snapshots([uid_b]) == 1
+    assert not EntitySnapshot.objects.filter(entity_uid=uid_b).exists()
+
+
+@pytest.mark.django_db
+def test_bulk_apply_isolates_records_the_database_rejects():
+    good, bad, other = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    records = [
+        {"entity_uid": good, "entity_type": "PERSON", "display_name": "Good", "details": []},
+        # jsonb cannot store \u0000, so this record fails inside the database.
+        {"entity_uid": bad, "entity_type": "PERSON", "display_name": "Bad",
+         "details": [{"detail_code": "NOTE", "value": {"value": "\x00"}}]},
+        {"entity_uid": other, "entity_type": "PERSON", "display_name": "Other", "details": []},
+    ]
+    statuses = scd2_bulk_apply(records, transaction_size=10)
+    assert statuses[0] == "inserted" and statuses[2] == "inserted"
+    assert isinstance(statuses[1], DataError)
+    assert set(Entity.objects.values_list("entity_uid", flat=True)) == {good, other}
@@ -0,0 +1,61 @@
+import uuid
+from datetime import timedelta
+import pytest
+from django.db import connection
+from django.utils import timezone
+from crm.models import Entity, EntitySnapshot, SnapshotRefresh
+from crm.services import scd2_upsert_entity
+from crm.snapshots import refresh_snapshots, REFRESH_LOCK_KEY
+
+
+@pytest.mark.django_db
+def test_refresh_skips_coalesces_and_catches_up(settings):
+    settings.CRM_SNAPSHOT_QUIET_SECONDS = 30
+    settings.CRM_SNAPSHOT_MAX_LAG_SECONDS = 300
+    uid = uuid.uuid4()
+    scd2_upsert_entity(uid, 'PERSON', 'Alic')
+
+    assert refresh_snapshots()['status'] == 'refreshed'
+    assert refresh_snapshots()['status'] == 'unchanged'
+
+    # A write around the service layer leaves the snapshot stale until the next delta run.
+    edited_at = timezone.now()
+    Entity.objects.filter(entity_uid=uid).update(display_name='Alic B', updated_at=edited_at)
+    assert refresh_snapshots(now=edited_at + timedelta(seconds=5))['status'] == 'deferred'
+    assert EntitySnapshot.objects.get(entity_uid=uid).display_name == 'Alic'
+
+    result = refresh_snapshots(now=edited_at + timedelta(seconds=31))
+    assert (result['status'], result['entities_scanned'], result['rows_changed']) == ('refreshed', 1, 1)
+    assert EntitySnapshot.objects.get(entity_uid=uid).display_name == 'Alic B'
+
+    state = SnapshotRefresh.objects.get()
+    assert state.high_water_mark == edited_at
+    assert (state.refresh_count, state.skip_count, state.last_status) == (2, 2, 'refreshed')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_quiet_period_is_measured_with_the_database_clock(monkeypatch):
+    uid = uuid.uuid4()
+    scd2_upsert_entity(uid, 'PERSON', 'Alic')
+    assert refresh_snapshots()['status'] == 'refreshed'
+
+    # Written by SQL at the database's now(), while the runner's clock is an hour ahead.
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE crm_entity SET display_name = 'Alic B', updated_at = now() WHERE entity_uid = %s", [uid])
+    skewed = timezone.now() + timedelta(hours=1)
+    monkeypatch.setattr(timezone, 'now', lambda: skewed)
+    assert refresh_snapshots()['status'] == 'deferred'
+
+
+@pytest.mark.django_db
+def test_refresh_is_skipped_while_another_runner_holds_the_lock():
+    other = connection.copy()
+    try:
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [REFRESH_LOCK_KEY])
+        assert refresh_snapshots(force=True) == {'status': 'locked'}
+    finally:
+        # A pooled connection keeps its session locks when it goes back to the pool.
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock_all()')
+        other.close()
@@ -1,11 +1,20 @@
 from django.urls import path
-from .views import EntityListCreateView, EntityRetrieveUpdateView, EntityHistoryView, EntityAsOfView, DiffView
+from . import async_views
+from .views import (EntityListCreateView, EntityRetrieveUpdateView, EntityHistoryView, EntityAsOfView, DiffView,
+                    EntitySearchView, EntityBulkView, ChangesView)
 
 urlpatterns = [
     path('entities', EntityListCreateView.as_view(), name='entity-list'),
+    path('entities/bulk', EntityBulkView.as_view(), name='entity-bulk'),
+    path('entities/search', EntitySearchView.as_view(), name='entity-search'),
     path('entities/<uuid:entity_uid>', EntityRetrieveUpdateView.as_view(), name='entity-detail'),
     path('entities/<uuid:entity_uid>/history', EntityHistoryView.as_view(), name='entity-history'),
     path('entities-asof', EntityAsOfView.as_view(), name='entity-asof'),
     path('diff', DiffView.as_view(), name='entity-diff'),
+    path('changes', ChangesView.as_view(), name='changes'),
+    path('async/entities/<uuid:entity_uid>', async_views.entity_detail, name='async-entity-detail'),
+    path('async/entities/<uuid:entity_uid>/history', async_views.entity_history, name='async-entity-history'),
+    path('async/entities-asof', async_views.entities_as_of, name='async-entity-asof'),
+    path('async/diff', async_views.diff, name='async-entity-diff'),
 ]
 
@@ -1,16 +1,30 @@
+import itertools
 import uuid
 from rest_framework import generics, status, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.settings import api_settings
+from django.conf import settings
 from django.utils.dateparse import parse_date
-from django.db.models import Q
 from django.utils.timezone import make_aware, is_naive, get_current_timezone
 from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
 import datetime
+from .audit import audit_summary
+from .changes import decode_cursor, encode_cursor, wait_for_changes
+from .coalesce import upsert_entity
+from .entity_cache import etag_matches, get_cached_entity
+from .entity_types import entity_types
 from .models import Entity, EntityDetail, AuditLog
-from .serializers import EntitySerializer
-from .services import scd2_upsert_entity, scd2_upsert_detail
+from .parsers import NDJSONParser
+from .pagination import KeysetPagination, SummaryPagination
+from .renderers import NDJSONRenderer, chunked, stream_ndjson
+from .search import search_entities
+from .serializers import EntityInputSerializer, EntitySerializer
+from .services import scd2_bulk_apply
 
 
 class EntityListCreateView(generics.ListCreateAPIView):
@@ -24,9 +38,10 @@ class EntityListCreateView(generics.ListCreateAPIView):
         detail_code = self.request.query_params.get('detail_code')
 
         if q:
-            qs = qs.filter(display_name__icontains=q)
+            qs = qs.filter(display_name__ilike=q)
         if entity_type:
-            qs = qs.filter(entity_type__code=entity_type)
+            et = entity_types.get_by_code(entity_type)
+            qs = qs.filter(entity_type_id=et.pk) if et else qs.none()
         if detail_code:
             qs = qs.filter(entity_uid__in=EntityDetail.objects.filter(detail_code=detail_code, is_current=True).values("entity_uid"))
 
@@ -39,21 +54,102 @@ class EntityListCreateView(generics.ListCreateAPIView):
         display_name = data.get('display_name')
         details = data.get('details', [])
 
-        entity = scd2_upsert_entity(entity_uid, entity_type, display_name, actor=str(request.user))
-
-        for d in details:
-            scd2_upsert_detail(entity.entity_uid, d['detail_code'], d['value'], actor=str(request.user))
+        entity = upsert_entity(entity_uid, entity_type, display_name, details=details, actor=str(request.user))
 
         serializer = self.get_serializer(entity)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class EntityBulkView(APIView):
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request):
+        max_items = getattr(settings, 'CRM_BULK_MAX_ITEMS', 10000)
+        items = request.data
+        if isinstance(items, (dict, str)) or not hasattr(items, '__iter__'):
+            return Response({'error': 'Expected a JSON array or NDJSON of entities'}, status=400)
+        items = list(itertools.islice(items, max_items + 1))
+        if len(items) > max_items:
+            return Response({'error': f'At most {max_items} entities per request'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        results, records = [], []
+        for index, item in enumerate(items):
+            if isinstance(item, ParseError):
+                results.append({'index': index, 'status': 'error', 'errors': {'non_field_errors': [item.detail]}})
+                continue
+            serializer = EntityInputSerializer(data=item)
+            if serializer.is_valid():
+                records.append(serializer.validated_data)
+                results.append({'index': index, 'entity_uid': serializer.validated_data['entity_uid']})
+            else:
+                results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+
+        statuses = iter(scd2_bulk_apply(records, actor=str(request.user),
+                                        transaction_size=getattr(settings, 'CRM_BULK_TRANSACTION_SIZE', 1000)))
+        folded = {}  # entity_uid -> earlier results folded into the next record of that entity
+        for result in results:
+            if 'status' in result:
+                continue
+            outcome = next(statuses)
+            if outcome is None:
+                # Counted once, on the item whose write carries it.
+                result['status'] = 'unchanged'
+                folded.setdefault(result['entity_uid'], []).append(result)
+                continue
+            for earlier in folded.pop(result['entity_uid'], ()):
+                earlier['folded_into'] = result['index']
+            if isinstance(outcome, Exception):
+                result.update(status='error', errors={'non_field_errors': [str(outcome).strip()]})
+            else:
+                result['status'] = outcome
+
+        counts = dict.fromkeys(('inserted', 'updated', 'unchanged', 'error'), 0)
+        for result in results:
+            counts[result['status']] += 1
+        return Response({'counts': counts, 'results': results},
+                        status=status.HTTP_207_MULTI_STATUS if counts['error'] else status.HTTP_200_OK)
+
+
+class EntitySearchView(APIView):
+    max_limit = 100
+
+    def get(self, request):
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            return Response({'error': 'q parameter required'}, status=400)
+        try:
+            threshold = float(request.query_params.get('threshold', 0.3))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({'error': 'threshold must be a number and limit an integer'}, status=400)
+        if not 0 < threshold <= 1 or not 0 < limit <= self.max_limit:
+            return Response({'error': f'threshold must be in (0, 1] and limit in 1..{self.max_limit}'}, status=400)
+        include_details = request.query_params.get('details', 'true').lower() not in ('0', 'false', 'no')
+
+        hits = search_entities(q, threshold=threshold, limit=limit, include_details=include_details)
+        data = EntitySerializer([entity for entity, _ in hits], many=True).data
+        for row, (_, similarity) in zip(data, hits):
+            row['similarity'] = round(similarity, 4)
+        return Response(data)
+
+
 class EntityRetrieveUpdateView(APIView):
     def get(self, request, entity_uid):
+        cached = get_cached_entity(entity_uid, lambda: self.serialize_current(entity_uid))
+        if cached is None:
+            return Response({'detail': 'Not found'}, status=404)
+
+        etag = quote_etag(cached['etag'])
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(cached['data'], headers={'ETag': etag})
+
+    def serialize_current(self, entity_uid):
         entity = Entity.objects.filter(entity_uid=entity_uid, is_current=True).first()
         if not entity:
-            return Response({'detail': 'Not found'}, status=404)
-        return Response(EntitySerializer(entity).data)
+            return None
+        return EntitySerializer(entity).data
 
     def patch(self, request, entity_uid):
         data = request.data
@@ -61,65 +157,185 @@ class EntityRetrieveUpdateView(APIView):
         display_name = data.get('display_name')
         details = data.get('details', [])
 
-        entity = scd2_upsert_entity(entity_uid, entity_type, display_name, actor=str(request.user))
-        for d in details:
-            scd2_upsert_detail(entity.entity_uid, d['detail_code'], d['value'], actor=str(request.user))
+        entity = upsert_entity(entity_uid, entity_type, display_name, details=details, actor=str(request.user))
 
         return Response(EntitySerializer(entity).data)
 
 
+def parse_point_in_time(value, end_of_day=True):
+    # A plain date first: parse_datetime() also accepts one (as midnight) on Python 3.11+.
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day:
+        ts = datetime.datetime.combine(day, datetime.time.max if end_of_day else datetime.time.min)
+    else:
+        try:
+            ts = parse_datetime(value)
+        except ValueError:
+            return None
+        if ts is None:
+            return None
+    if is_naive(ts):
+        ts = make_aware(ts, timezone=get_current_timezone())
+    return ts
+
+
+def history_querysets(entity_uid, params):
+    """(entity versions, detail versions, error) of an entity, optionally only those overlapping [from, to)."""
+    entities = Entity.objects.filter(entity_uid=entity_uid).order_by('valid_from')
+    details = EntityDetail.objects.filter(entity_uid=entity_uid).order_by('valid_from')
+
+    window = {}
+    for param, end_of_day in (('from', False), ('to', True)):
+        if params.get(param):
+            window[param] = parse_point_in_time(params[param], end_of_day=end_of_day)
+            if window[param] is None:
+                return None, None, f'Invalid {param} date format'
+    if window:
+        entities = entities.overlapping(window.get('from'), window.get('to'))
+        details = details.overlapping(window.get('from'), window.get('to'))
+    return entities, details, None
+
+
+def history_detail_row(detail):
+    return {'detail_code': detail.detail_code, 'value': detail.value, 'valid_from': detail.valid_from,
+            'valid_to': detail.valid_to}
+
+
 class EntityHistoryView(APIView):
     def get(self, request, entity_uid):
-        entities = Entity.objects.filter(entity_uid=entity_uid).order_by('valid_from')
-        details = EntityDetail.objects.filter(entity_uid=entity_uid).order_by('valid_from')
+        entities, details, error = history_querysets(entity_uid, request.query_params)
+        if error:
+            return Response({'error': error}, status=400)
 
         return Response({
             'entities': EntitySerializer(entities, many=True).data,
-            'details': [{'detail_code': d.detail_code, 'value': d.value, 'valid_from': d.valid_from,
-                         'valid_to': d.valid_to} for d in details]
+            'details': [history_detail_row(d) for d in details]
         })
 
 
+def stream_chunk_size():
+    return getattr(settings, 'CRM_STREAM_CHUNK_SIZE', 2000)
+
+
+def audit_row(log):
+    return {
+        'entity_uid': log.entity_uid,
+        'detail_code': log.detail_code,
+        'action': log.action,
+        'before': log.before,
+        'after': log.after,
+        'timestamp': log.timestamp,
+    }
+
+
 class EntityAsOfView(APIView):
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+
     def get(self, request):
         as_of_str = request.query_params.get('as_of')
         if not as_of_str:
             return Response({'error': 'as_of parameter required'}, status=400)
 
-        as_of = parse_datetime(as_of_str)
+        as_of = parse_point_in_time(as_of_str)
         if as_of is None:
-            as_of_date = parse_date(as_of_str)
-            if not as_of_date:
-                return Response({'error': 'Invalid date format'}, status=400)
-            as_of = make_aware(datetime.datetime.combine(as_of_date, datetime.time.max))
+            return Response({'error': 'Invalid date format'}, status=400)
+
+        qs = Entity.objects.as_of(as_of)
+        if request.accepted_renderer.format == 'ndjson':
+            return stream_ndjson(self.iter_snapshot(qs.order_by('valid_from', 'id'), as_of))
+        # Latest versions first: walking valid_from backwards from as_of hits matching rows immediately.
+        paginator = KeysetPagination(ordering=('-valid_from', '-id'))
+        page = paginator.paginate_queryset(qs, request, view=self)
+        return paginator.get_paginated_response(EntitySerializer(page, many=True, context={'as_of': as_of}).data)
+
+    def iter_snapshot(self, qs, as_of):
+        chunk_size = stream_chunk_size()
+        for chunk in chunked(qs.iterator(chunk_size=chunk_size), chunk_size):
+            yield from EntitySerializer(chunk, many=True, context={'as_of': as_of}).data
+
+
+DIFF_FILTER_FIELDS = ('entity_uid', 'detail_code', 'action', 'actor')
+
+
+def diff_queryset(params):
+    """(AuditLog rows matching the /diff parameters, error)."""
+    bounds = {}
+    for param, end_of_day in (('from', False), ('to', True)):
+        if not params.get(param):
+            return None, 'from and to parameters required'
+        # Dates cover whole days; datetimes are taken as given.
+        bounds[param] = parse_point_in_time(params[param], end_of_day=end_of_day)
+        if bounds[param] is None:
+            return None, f'Invalid {param} date format'
+    filters = {field: params[field] for field in DIFF_FILTER_FIELDS if params.get(field)}
+    if 'entity_uid' in filters:
+        try:
+            filters['entity_uid'] = uuid.UUID(filters['entity_uid'])
+        except ValueError:
+            return None, 'Invalid entity_uid'
+    return AuditLog.objects.filter(timestamp__gte=bounds['from'], timestamp__lte=bounds['to'], **filters), None
 
-        if is_naive(as_of):
-            as_of = make_aware(as_of, timezone=get_current_timezone())
 
-        qs = Entity.objects.filter(valid_from__lte=as_of).filter(Q(valid_to__isnull=True) | Q(valid_to__gte=as_of))
-        return Response(EntitySerializer(qs, many=True).data)
+def wants_summary(params):
+    return params.get('summary', '').lower() in ('1', 'true', 'yes')
 
 
 class DiffView(APIView):
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+
     def get(self, request):
-        from_date = parse_date(request.query_params.get('from'))
-        to_date = parse_date(request.query_params.get('to'))
-        if not from_date or not to_date:
-            return Response({'error': 'from and to parameters required'}, status=400)
-        logs = AuditLog.objects.filter(timestamp__gte=make_aware(datetime.datetime.combine(from_date, datetime.time.min)),
-                                       timestamp__lte=make_aware(datetime.datetime.combine(to_date, datetime.time.max)),
-                                       )
-        result = []
-        for log in logs:
-            result.append({
-                'entity_uid': log.entity_uid,
-                'detail_code': log.detail_code,
-                'action': log.action,
-                'before': log.before,
-                'after': log.after,
-                'timestamp': log.timestamp,
-            })
-        return Response(result)
+        logs, error = diff_queryset(request.query_params)
+        if error:
+            return Response({'error': error}, status=400)
+
+        if wants_summary(request.query_params):
+            return self.summary(request, logs)
+        if request.accepted_renderer.format == 'ndjson':
+            logs = logs.order_by('timestamp', 'id').iterator(chunk_size=stream_chunk_size())
+            return stream_ndjson(audit_row(log) for log in logs)
+        paginator = KeysetPagination(ordering=('timestamp', 'id'))
+        page = paginator.paginate_queryset(logs, request, view=self)
+        return paginator.get_paginated_response([audit_row(log) for log in page])
+
+    def summary(self, request, logs):
+        if request.accepted_renderer.format == 'ndjson':
+            return stream_ndjson(self.iter_summary(logs))
+        paginator = SummaryPagination()
+        page = paginator.paginate_rows(lambda after, limit: audit_summary(logs, after=after, limit=limit), request)
+        return paginator.get_paginated_response(page)
+
+    def iter_summary(self, logs):
+        chunk_size = stream_chunk_size()
+        after = None
+        while rows := audit_summary(logs, after=after, limit=chunk_size):
+            yield from rows
+            after = rows[-1]['entity_uid'], rows[-1]['detail_code']
+
+
+class ChangesView(APIView):
+    max_limit = 1000
+
+    def get(self, request):
+        since = request.query_params.get('since')
+        try:
+            position = decode_cursor(since) if since else None
+            limit = int(request.query_params.get('limit', 100))
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            return Response({'error': 'since must be a cursor from a previous response, limit an integer '
+                                      'and wait a number of seconds'}, status=400)
+        max_wait = getattr(settings, 'CRM_CHANGES_MAX_WAIT_SECONDS', 30)
+        if not 0 < limit <= self.max_limit or not 0 <= wait <= max_wait:
+            return Response({'error': f'limit must be in 1..{self.max_limit} and wait in 0..{max_wait}'}, status=400)
+
+        changes = wait_for_changes(position, limit, timeout=wait)
+        return Response({
+            'next': encode_cursor(changes[-1]) if changes else since,
+            'changes': [dict(audit_row(log), actor=log.actor, cursor=encode_cursor(log)) for log in changes],
+        })
 
 
 class EntityViewSet(viewsets.ModelViewSet):
@@ -131,5 +347,5 @@ class EntityViewSet(viewsets.ModelViewSet):
         q = self.request.query_params.get('q')
 
         if q:
-            qs = qs.filter(display_name__icontains=q)
+            qs = qs.filter(display_name__ilike=q)
         return qs
\ No newline at end of file